@@ -0,0 +1,12 @@
+import utils.parser.parser
+from utils.distributed import run_actor
+
+
+# Steps envs for a train_distributed.py learner on another machine, the learner sends game, focus
+# file and policy once connected. Both authenticate with the key in SCOBI_DISTRIBUTED_KEY.
+def main():
+    flags_dictionary = utils.parser.parser.parse_actor()
+    run_actor(flags_dictionary["host"], flags_dictionary["port"], flags_dictionary["environments"])
+
+if __name__ == '__main__':
+    main()
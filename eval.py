@@ -16,6 +16,7 @@ from viper_extract import DTClassifierModel
 
 import utils.parser.parser
 from scobi import Environment
+from utils.checkpointing import load_env_config
 
 
 def flist(l):
@@ -101,12 +102,15 @@ def main():
     vecnorm_str = "best_vecnormalize.pkl"
     model_path = Path("resources/checkpoints", exp_name, checkpoint_str)
     vecnorm_path = Path("resources/checkpoints",  exp_name, vecnorm_str)
+    scobi_norm_path = Path("resources/checkpoints",  exp_name, "best_scobi_normalization.npz")
     ff_file_path = Path("resources/checkpoints", exp_name)
     if not _ensure_completeness(ff_file_path):
         print('Training not completed!')
         print('Delete the folder ' + str(ff_file_path) + ' or complete the training process')
         return
     EVAL_ENV_SEED = 84
+    # observation settings of the training run, flags override them
+    env_config = load_env_config(ff_file_path, {k: flag_dictionary[k] for k in ["hud", "obs_dtype", "focus_rules", "noise_std", "noise_error_rate"]})
     if variant == "rgb":
         env = make_vec_env(env_str, seed=EVAL_ENV_SEED, wrapper_class=WarpFrame)
     else:
@@ -115,13 +119,18 @@ def main():
                           focus_file=pruned_ff_name,
                           hide_properties=hide_properties,
                           draw_features=True, # implement feature attribution
-                          reward=0) #env reward only for evaluation
+                          reward=0, #env reward only for evaluation
+                          normalization_stats=scobi_norm_path if scobi_norm_path.exists() else None,
+                          **env_config)
 
         _, _ = env.reset(seed=EVAL_ENV_SEED)
         dummy_vecenv = DummyVecEnv([lambda :  env])
-        env = VecNormalize.load(vecnorm_path, dummy_vecenv)
-        env.training = False
-        env.norm_reward = False
+        if scobi_norm_path.exists(): # normalized inside scobi
+            env = dummy_vecenv
+        else:
+            env = VecNormalize.load(vecnorm_path, dummy_vecenv)
+            env.training = False
+            env.norm_reward = False
     if viper:
         print("loading viper tree of " + exp_name)
         if isinstance(viper, str):
@@ -140,7 +149,7 @@ def main():
     if variant == "rgb":
         img = plt.imshow(env.get_images()[0])
     else:
-        scobi_env = env.venv.envs[0]
+        scobi_env = env.venv.envs[0] if isinstance(env, VecNormalize) else env.envs[0]
         img = plt.imshow(scobi_env.obj_obs)
 
     if progress_bar:
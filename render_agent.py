@@ -4,6 +4,7 @@ from stable_baselines3.common.atari_wrappers import WarpFrame
 from stable_baselines3.common.env_util import make_vec_env
 from stable_baselines3.common.vec_env import VecNormalize, DummyVecEnv
 from scobi import Environment
+from utils.checkpointing import load_env_config
 from utils.parser.parser import render_parser, get_highest_version
 from utils.renderer import Renderer
 from viper_extract import DTClassifierModel
@@ -56,11 +57,14 @@ def main():
     vecnorm_str = "best_vecnormalize.pkl"
     model_path = Path("resources/checkpoints", exp_name, checkpoint_str)
     vecnorm_path = Path("resources/checkpoints",  exp_name, vecnorm_str)
+    scobi_norm_path = Path("resources/checkpoints",  exp_name, "best_scobi_normalization.npz")
     ff_file_path = Path("resources/checkpoints", exp_name)
     EVAL_ENV_SEED = 84
     if not _ensure_completeness(ff_file_path):
         print("The folder " + str(ff_file_path) + " does not contain a completed training checkpoint.")
         return
+    # observation settings of the training run, flags override them
+    env_config = load_env_config(ff_file_path, {k: flag_dictionary[k] for k in ["hud", "obs_dtype", "focus_rules", "noise_std", "noise_error_rate"]})
     if variant == "rgb":
         env = make_vec_env(env_str, seed=EVAL_ENV_SEED, wrapper_class=WarpFrame)
     else:
@@ -69,13 +73,18 @@ def main():
                           focus_file=pruned_ff_name,
                           hide_properties=hide_properties,
                           draw_features=True, # implement feature attribution
-                          reward=0) #env reward only for evaluation
+                          reward=0, #env reward only for evaluation
+                          normalization_stats=scobi_norm_path if scobi_norm_path.exists() else None,
+                          **env_config)
 
         _, _ = env.reset(seed=EVAL_ENV_SEED)
         dummy_vecenv = DummyVecEnv([lambda :  env])
-        env = VecNormalize.load(vecnorm_path, dummy_vecenv)
-        env.training = False
-        env.norm_reward = False
+        if scobi_norm_path.exists(): # normalized inside scobi
+            env = dummy_vecenv
+        else:
+            env = VecNormalize.load(vecnorm_path, dummy_vecenv)
+            env.training = False
+            env.norm_reward = False
     if viper:
         print("loading viper tree of " + exp_name)
         if isinstance(viper, str):
@@ -7,6 +7,9 @@ from scobi.utils.colors import get_closest_color
 from scobi.utils.decorators import register
 COLOR_INT_MEMORY = {}
 EPS = np.finfo(np.float64).eps.item()
+# category arguments: positions of the visible objects of a whole category as (n, 2) array,
+# focus builds them for all categories in one pass per step (see Focus.get_category_layer)
+CategoryPositions = Tuple[Tuple[int, int], ...]
 # GameObject = get_wrapper_class()
 
 # None forwarding crucial for feature handling when objects are invisible
@@ -120,3 +123,67 @@ def get_color_name(rgb: Tuple[int, int, int]) -> Tuple[int]:
         _, col_int = get_closest_color(rgb)
         COLOR_INT_MEMORY[rgb] = col_int
         return col_int,
+
+
+def _nearest_distances(a_position, b_positions, k):
+    # x, y distances to the k nearest points, closest first. missing neighbours are None
+    if None in a_position:
+        return (None,) * (2 * k)
+    deltas = b_positions - np.asarray(a_position, dtype=b_positions.dtype)
+    sq_dists = np.einsum("ij,ij->i", deltas, deltas)
+    if len(sq_dists) > k:
+        nearest = np.argpartition(sq_dists, k - 1)[:k]
+        nearest = nearest[np.argsort(sq_dists[nearest], kind="stable")]
+    else:
+        nearest = np.argsort(sq_dists, kind="stable")
+    out = deltas[nearest].ravel().tolist()
+    return tuple(out) + (None,) * (2 * k - len(out))
+
+
+@register(type="F", name="NEAREST_DISTANCES_K1", params=["POSITION", "POSITIONS"], desc="x, y distance to the nearest object of a category")
+def calc_nearest_distances_k1(a_position: Tuple[int, int], b_positions: CategoryPositions) -> Tuple[int, int]:
+    return _nearest_distances(a_position, b_positions, 1)
+
+
+@register(type="F", name="NEAREST_DISTANCES_K2", params=["POSITION", "POSITIONS"], desc="x, y distances to the 2 nearest objects of a category")
+def calc_nearest_distances_k2(a_position: Tuple[int, int], b_positions: CategoryPositions) -> Tuple[int, int, int, int]:
+    return _nearest_distances(a_position, b_positions, 2)
+
+
+@register(type="F", name="NEAREST_DISTANCES_K3", params=["POSITION", "POSITIONS"], desc="x, y distances to the 3 nearest objects of a category")
+def calc_nearest_distances_k3(a_position: Tuple[int, int], b_positions: CategoryPositions) -> Tuple[int, int, int, int, int, int]:
+    return _nearest_distances(a_position, b_positions, 3)
+
+
+@register(type="F", name="MIN_EUCLIDEAN_DISTANCE", params=["POSITION", "POSITIONS"], desc="euclidean distance to the nearest object of a category")
+def calc_min_euclidean_distance(a_position: Tuple[int, int], b_positions: CategoryPositions) -> Tuple[float]:
+    if None in a_position or not len(b_positions):
+        return None,
+    deltas = b_positions - np.asarray(a_position, dtype=b_positions.dtype)
+    return math.sqrt(np.einsum("ij,ij->i", deltas, deltas).min()),
+
+
+@register(type="F", name="COUNT", params=["POSITIONS"], desc="number of visible objects of a category")
+def get_count(positions: CategoryPositions) -> Tuple[int]:
+    return len(positions),
+
+
+@register(type="F", name="CENTROID", params=["POSITIONS"], desc="mean position of the visible objects of a category")
+def get_centroid(positions: CategoryPositions) -> Tuple[float, float]:
+    if not len(positions):
+        return None, None
+    return tuple(positions.mean(axis=0).tolist())
+
+
+@register(type="F", name="X_RANGE", params=["POSITIONS"], desc="min and max x of the visible objects of a category")
+def get_x_range(positions: CategoryPositions) -> Tuple[int, int]:
+    if not len(positions):
+        return None, None
+    return positions[:, 0].min().item(), positions[:, 0].max().item()
+
+
+@register(type="F", name="Y_RANGE", params=["POSITIONS"], desc="min and max y of the visible objects of a category")
+def get_y_range(positions: CategoryPositions) -> Tuple[int, int]:
+    if not len(positions):
+        return None, None
+    return positions[:, 1].min().item(), positions[:, 1].max().item()
@@ -1,20 +1,37 @@
 """scobi core"""
+import os
 import numpy as np
 from gymnasium import spaces, Env
 import scobi.environments.env_manager as em
-from scobi.utils.game_object import get_wrapper_class
-from scobi.focus import Focus
+from scobi.utils.game_object import get_wrapper_class, ObjectTable
+from scobi.focus import Focus, OBS_BOUND, NORM_CLIP
 from scobi.utils.logging import Logger
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
 from copy import deepcopy
+import pickle
+from scobi.utils.trajectory import TrajectoryRecorder
+from scobi.utils.ns_log import NsReprLogger
+from scobi.utils.running_stats import RunningStats
+
+RESET_POOL_NOOP_MAX = 30
 
 
 class Environment(Env):
-    def __init__(self, env_name, seed=None, focus_dir="resources/focusfiles", focus_file=None, reward=0, hide_properties=False, silent=False, refresh_yaml=True, draw_features=False, hud=False, mode="ram"):
+    def __init__(self, env_name, seed=None, focus_dir="resources/focusfiles", focus_file=None, reward=0, hide_properties=False, silent=False, refresh_yaml=True, draw_features=False, hud=False, mode="ram", reset_pool=0, ns_log_dir=None, obs_dtype="float32", normalize=False, normalization_stats=None, noisy_objects=None, noise_std=3.0, noise_error_rate=0.05, capture_rgb=None, focus_rules=None):
         self.logger = Logger(silent=silent)
+        self._config = {"env_name": env_name, "seed": seed, "focus_file": focus_file, "reward": reward, "hide_properties": hide_properties,
+                        "hud": hud, "mode": mode, "reset_pool": reset_pool, "obs_dtype": obs_dtype,
+                        "normalize": normalize or normalization_stats is not None, "noise_std": noise_std, "noise_error_rate": noise_error_rate,
+                        "focus_rules": focus_rules}
+        # screen frames are only needed for drawing, pure feature envs skip capturing and buffering them
+        if capture_rgb is None:
+            capture_rgb = draw_features
+        elif draw_features and not capture_rgb:
+            self.logger.GeneralError("draw_features requires capture_rgb")
+        self.capture_rgb = capture_rgb
         # set buffer_window=2, s.t. we can build POSITION_HISTORY properties, which are needed by all envs.
-        self.oc_env = em.make(env_name, self.logger, mode, hud=hud, buffer_window_size=2)
+        self.oc_env = em.make(env_name, self.logger, mode, hud=hud, buffer_window_size=2, capture_rgb=capture_rgb)
         self.seed = seed
         self.randomstate = np.random.RandomState(self.seed)
         # TODO: tie to em.make
@@ -25,20 +42,33 @@ class Environment(Env):
 
         self.oc_env.reset(seed=self.seed)
 
-        # not possible anymore
-        # self.noisy_objects = os.environ["SCOBI_OBJ_EXTRACTOR"] == "Noisy_OC_Atari"
-        self.noisy_objects = False
+        # optional pool of pre-captured start states, reset() restores one instead of re-running the emulator reset
+        self.reset_pool_size = reset_pool
+        self._reset_pool = []
+        self._reset_pool_rng = np.random.RandomState(self.seed)
+        self.recorder = None
+        self.ns_logger = None
+
+        # noisy object detection, defaults to the SCOBI_OBJ_EXTRACTOR env var
+        if noisy_objects is None:
+            noisy_objects = os.environ["SCOBI_OBJ_EXTRACTOR"] == "Noisy_OC_Atari"
+        self.noisy_objects = noisy_objects
+        self._config["noisy_objects"] = noisy_objects
 
         # use the initialized slots from OC_Atari (ensures that there are no NoObjects)
         init_objects = self.oc_env._slots
         max_obj_dict = self.oc_env.max_objects_per_cat
         self.did_reset = False
-        self.focus = Focus(env_name, reward, hide_properties, focus_dir, focus_file, init_objects, max_obj_dict, actions, refresh_yaml, self.logger)
+        self.focus = Focus(env_name, reward, hide_properties, focus_dir, focus_file, init_objects, max_obj_dict, actions, refresh_yaml, self.logger, obs_dtype,
+                           focus_rules, em.hud_categories(self.oc_env) if hud else [])
         self.focus_file = self.focus.FOCUSFILEPATH
         self.action_space = spaces.Discrete(len(self.focus.PARSED_ACTIONS))
         self.action_space_description = self.focus.PARSED_ACTIONS
         self.observation_space_description = self.focus.PARSED_PROPERTIES + self.focus.PARSED_FUNCTIONS #this and feature_vector_desc is redundant
         self.feature_vector_description = self.focus.get_feature_vector_description()
+        # object level view of what focus sees, filled on demand (see get_object_table)
+        position_names = [name for meaning, name in self.focus.NS_REPR_LIST if meaning == "POSITION"]
+        self.object_table = ObjectTable(position_names, [self.focus.OBJECT_CATEGORIES[n] for n in position_names], self.focus.pos_idxs)
         self.num_envs = 1
         self.draw_features = draw_features
         self.feature_attribution = []
@@ -61,27 +91,53 @@ class Environment(Env):
             self._reward_composition_func = lambda a, b : b
 
         if self.noisy_objects:
-            self.logger.GeneralInfo("Using noisy object detection (default: std 3, detection error rate 5%)")
+            self.logger.GeneralInfo("Using noisy object detection (std %s, detection error rate %s%%)" % (noise_std, noise_error_rate * 100))
+            self.focus.enable_noise(noise_std, noise_error_rate, self.randomstate)
 
         self.reset()
         self.step(0) # step once to set the feature vector size
-        self.observation_space = spaces.Box(low=-2**63, high=2**63 - 2, shape=(self.focus.OBSERVATION_SIZE,), dtype=np.float32)
+        if normalize or normalization_stats is not None:
+            if self.focus.OBS_DTYPE == np.int16:
+                self.logger.GeneralError("int16 observations cannot be normalized, use float16 or float32")
+            self.observation_space = spaces.Box(low=-NORM_CLIP, high=NORM_CLIP, shape=(self.focus.OBSERVATION_SIZE,), dtype=self.focus.OBS_DTYPE)
+        elif self.focus.OBS_DTYPE == np.float32:
+            self.observation_space = spaces.Box(low=-2**63, high=2**63 - 2, shape=(self.focus.OBSERVATION_SIZE,), dtype=np.float32)
+        elif self.focus.OBS_DTYPE == np.int16: # screen-derived bounds, function features in fixed point
+            self.observation_space = spaces.Box(low=-OBS_BOUND * self.focus.OBS_SCALE, high=OBS_BOUND * self.focus.OBS_SCALE, shape=(self.focus.OBSERVATION_SIZE,), dtype=np.int16)
+        else: # reduced precision, values are clipped to screen-derived bounds by focus
+            self.observation_space = spaces.Box(low=-OBS_BOUND, high=OBS_BOUND, shape=(self.focus.OBSERVATION_SIZE,), dtype=self.focus.OBS_DTYPE)
         self.ale = self.oc_env._env.unwrapped.ale
         self.reset()
         self.did_reset = False # still require user to properly call a (likely seeded) reset()
+        if normalization_stats is not None:
+            # saved stats of a trained agent, frozen for evaluation
+            self.focus.set_normalization_stats(RunningStats.load(normalization_stats))
+            self.focus.normalization_frozen = True
+        elif normalize:
+            # running mean/var normalization replacing VecNormalize, stats start after the init steps above.
+            # the stats only change with set_normalization_stats(), the deltas are merged by the training loop
+            self.focus.init_normalization(self.focus.OBSERVATION_SIZE)
+        if ns_log_dir is not None:
+            # raw ns_repr buffers per step, for offline feature recomputation (see scobi.utils.ns_log)
+            self.ns_logger = NsReprLogger(ns_log_dir, self.oc_env, actions)
 
     def step(self, action):
         if not self.did_reset:
             self.logger.GeneralError("Cannot call env.step() before calling env.reset()")
         elif self.action_space.contains(action):
+            if self.recorder is not None:
+                self.recorder.record_step(action)
             obs, reward, truncated, terminated, info = self.oc_env.step(action)
+            if self.ns_logger is not None:
+                self.ns_logger.log(obs, action, reward, truncated or terminated)
             sco_obs, sco_reward = self.focus.get_feature_vector(obs)
             freeze_mask = self.focus.get_current_freeze_mask()
             if self.draw_features:
                 #for drawing features, we need image here, but obs is ns_repr
                 img_obs = self.oc_env._state_buffer_rgb[-1]
+                self.get_object_table()
                 self.obj_obs = self._draw_objects_overlay(img_obs)
-                self._rel_obs = self._draw_relation_overlay(img_obs, sco_obs, freeze_mask, action)
+                self._rel_obs = self._draw_relation_overlay(img_obs, self.focus.last_raw_obs, freeze_mask, action)
             self.original_obs = obs
             self.original_reward = reward
             self.ep_env_reward_buffer += self.original_reward
@@ -93,6 +149,8 @@ class Environment(Env):
                 self.ep_env_reward_buffer = 0
                 self.reset_ep_reward = True
                 self.focus.reward_subgoals = 0
+                # raw env return of the episode, like the 'episode' key of Monitor (which sees the shaped reward)
+                info["episode_env"] = {"r": self.ep_env_reward}
             final_reward = self._reward_composition_func(sco_reward, reward)
             # self.sco_obs = sco_obs
             return sco_obs, final_reward, truncated, terminated, info # 5
@@ -100,20 +158,112 @@ class Environment(Env):
             raise ValueError("scobi> Action not in action space")
 
     def reset(self, *args, **kwargs):
+        if self.recorder is not None:
+            self.recorder.record_reset(kwargs.get("seed"))
         self.did_reset = True
         # additional scobi reset steps here
         self.focus.reward_threshold = -1
         self.focus.reward_history = [0, 0]
-        obs, info = self.oc_env.reset(*args, **kwargs)
+        if self.reset_pool_size > 0:
+            obs, info = self._reset_from_pool(*args, **kwargs)
+        else:
+            obs, info = self.oc_env.reset(*args, **kwargs)
+        if self.ns_logger is not None:
+            self.ns_logger.log(obs, reset=True)
         sco_obs, _ = self.focus.get_feature_vector(obs)
         return sco_obs, info
+
+    def _reset_from_pool(self, *args, **kwargs):
+        # a seeded reset (or the first one) rebuilds the pool with real resets, so seeding stays as
+        # deterministic as the plain path. unseeded resets restore a random start state from the pool.
+        if kwargs.get("seed") is not None or not self._reset_pool:
+            obs, info = self.oc_env.reset(*args, **kwargs)
+            if kwargs.get("seed") is not None:
+                self._reset_pool_rng = np.random.RandomState(kwargs["seed"])
+            self._reset_pool = [(em.clone_state(self.oc_env), info)]
+            for _ in range(self.reset_pool_size - 1):
+                # ALE resets are (nearly) deterministic, a random number of no-ops after the reset
+                # makes the start states differ, like NoopResetEnv
+                _, pool_info = self.oc_env.reset()
+                for _ in range(self._reset_pool_rng.randint(1, RESET_POOL_NOOP_MAX + 1)):
+                    _, _, terminated, truncated, _ = self.oc_env.step(0)
+                    if terminated or truncated:
+                        _, pool_info = self.oc_env.reset()
+                self._reset_pool.append((em.clone_state(self.oc_env), pool_info))
+            if self.reset_pool_size > 1:
+                obs = em.restore_state(self.oc_env, self._reset_pool[0][0])
+            return obs, info
+        state, info = self._reset_pool[self._reset_pool_rng.randint(len(self._reset_pool))]
+        obs = em.restore_state(self.oc_env, state)
+        return obs, dict(info)
     
+    def get_object_table(self):
+        # objects of the last observation as array rows, positions include the noise focus applied.
+        # with slot caps, rows map to the oc_atari slots focus selected for that step
+        ocgos = self.oc_env.objects
+        self.object_table.update(self.focus.last_ns_obs, [ocgos[i] for i in self.focus.last_slot_rows])
+        return self.object_table
+
+    def get_normalization_stats(self):
+        return self.focus.running_stats
+
+    def get_normalization_delta(self):
+        # samples seen since the last call, merged across envs by the training loop
+        return self.focus.pop_normalization_delta()
+
+    def set_normalization_stats(self, stats):
+        self.focus.set_normalization_stats(stats)
+
+    def freeze_normalization(self, frozen=True):
+        self.focus.normalization_frozen = frozen
+
+    def get_config(self):
+        # constructor arguments needed to rebuild an equivalent env, e.g. for replays
+        return dict(self._config)
+
+    def start_recording(self, keyframe_interval=0):
+        # log resets and actions (+ a state keyframe every keyframe_interval steps) until stop_recording()
+        self.recorder = TrajectoryRecorder(self, keyframe_interval)
+
+    def stop_recording(self, fpath):
+        self.recorder.save(fpath)
+        self.recorder = None
+
+    def _snapshot(self, include_pool=False):
+        snapshot = {
+            "ale": em.clone_state(self.oc_env, include_rng=True),
+            "objects": self.oc_env.objects,
+            "ns_buffer": list(self.oc_env._state_buffer_ns),
+            "reward_state": (self.focus.reward_history, self.focus.reward_threshold, self.focus.reward_subgoals, self.focus.reward_helper_var),
+            "ep_reward_state": (self.ep_env_reward, self.ep_env_reward_buffer, self.reset_ep_reward),
+            "reset_pool_rng": self._reset_pool_rng.get_state(),
+            "randomstate": self.randomstate.get_state(),
+            "normalization": (self.focus.running_stats, self.focus.running_stats_delta, self.focus.normalization_frozen),
+        }
+        if include_pool:
+            snapshot["reset_pool"] = self._reset_pool
+        return pickle.dumps(snapshot)
+
+    def _restore_snapshot(self, data):
+        snapshot = pickle.loads(data)
+        em.restore_state(self.oc_env, snapshot["ale"], snapshot["objects"], snapshot["ns_buffer"])
+        self.focus.reward_history, self.focus.reward_threshold, self.focus.reward_subgoals, self.focus.reward_helper_var = snapshot["reward_state"]
+        self.ep_env_reward, self.ep_env_reward_buffer, self.reset_ep_reward = snapshot["ep_reward_state"]
+        self._reset_pool_rng.set_state(snapshot["reset_pool_rng"])
+        self.randomstate.set_state(snapshot["randomstate"])
+        self.focus.running_stats, self.focus.running_stats_delta, self.focus.normalization_frozen = snapshot["normalization"]
+        if "reset_pool" in snapshot:
+            self._reset_pool = snapshot["reset_pool"]
+        self.did_reset = True
+
     @property
     def unwrapped(self):
         return self.oc_env.unwrapped
 
     def close(self):
         # additional scobi close steps here
+        if self.ns_logger is not None:
+            self.ns_logger.flush()
         self.oc_env.close()
 
     def set_feature_attribution(self, att):
@@ -154,8 +304,8 @@ class Environment(Env):
 
     def _draw_objects_overlay(self, obs_image, action=None):
         obs_mod = deepcopy(obs_image)
-        for obj in self.oc_env.objects:
-            mark_bb(obs_mod, obj.xywh, color=obj.rgb, name=str(obj))
+        for obj in self.object_table.visible_objects():
+            mark_bb(obs_mod, obj.xywh, color=obj.rgb, name=obj.name)
         return obs_mod
 
 
@@ -190,6 +340,8 @@ class Environment(Env):
                         top_features_names[k_idx] = format_feature(feature_name, feature_signature, ii)
                 if 0 in fv_freeze_mask:
                     continue
+                if isinstance(feature_signature, list) and any(isinstance(arg[1], list) for arg in feature_signature):
+                    continue # nested functions have no source object to draw from
                 if feature_name == "POSITION":
                     radius = 2
                     x = fv_entries[0]
@@ -305,6 +457,13 @@ class Environment(Env):
         return features_names
 
 
+def format_arg(arg):
+    # object or category name, nested functions with their arguments
+    if isinstance(arg[1], list):
+        return f"{arg[0]}({', '.join(format_arg(a) for a in arg[1])})"
+    return arg[1]
+
+
 def format_feature(feature_name, feature_signature, ii):
     if feature_name == 'RGB':
         axis = ["R", "G", "B"][ii]
@@ -315,6 +474,16 @@ def format_feature(feature_name, feature_signature, ii):
             return f"{feature_signature}.{axis}"
         axis = ["x", "y"][ii-2]
         return f"{feature_signature}.{axis}[t-1]"
+    if feature_name.startswith("NEAREST_DISTANCES_K"):
+        axis = ["x", "y"][ii % 2]
+        return f"ND{ii // 2 + 1}({format_arg(feature_signature[0])}, {format_arg(feature_signature[1])}).{axis}"
+    elif feature_name == "MIN_EUCLIDEAN_DISTANCE":
+        return f"MinED({format_arg(feature_signature[0])}, {format_arg(feature_signature[1])})"
+    elif feature_name == "COUNT":
+        return f"N({format_arg(feature_signature[0])})"
+    elif feature_name in ["X_RANGE", "Y_RANGE"]:
+        bound = ["min", "max"][ii]
+        return f"{feature_name[0]}R({format_arg(feature_signature[0])}).{bound}"
     axis = ["x", "y"][ii]
     if ii > 3:
         print("feature render formatting error. exiting...")
@@ -322,21 +491,23 @@ def format_feature(feature_name, feature_signature, ii):
     if feature_name == 'POSITION':
         return f"{feature_signature}.{axis}"
     elif feature_name == "EUCLIDEAN_DISTANCE":
-        return f"ED({feature_signature[0][1]}, {feature_signature[1][1]})"
+        return f"ED({format_arg(feature_signature[0])}, {format_arg(feature_signature[1])})"
     elif feature_name == "DISTANCE":
-        return f"D({feature_signature[0][1]}, {feature_signature[1][1]}).{axis}"
+        return f"D({format_arg(feature_signature[0])}, {format_arg(feature_signature[1])}).{axis}"
     elif feature_name == "VELOCITY":
-        return f"V({feature_signature[0][1]}).{axis}"
+        return f"V({format_arg(feature_signature[0])}).{axis}"
     elif feature_name == "DIR_VELOCITY":
-        return f"DV({feature_signature[0][1]}).{axis}"
+        return f"DV({format_arg(feature_signature[0])}).{axis}"
     elif feature_name == "CENTER":
-        return f"C({feature_signature[0][1]}, {feature_signature[1][1]}).{axis}"
+        return f"C({format_arg(feature_signature[0])}, {format_arg(feature_signature[1])}).{axis}"
+    elif feature_name == "CENTROID":
+        return f"CT({format_arg(feature_signature[0])}).{axis}"
     elif feature_name == "ORIENTATION":
         return f"O({feature_signature})"
     elif feature_name == "LINEAR_TRAJECTORY":
-        return f"LT({feature_signature[0][1]}, {feature_signature[1][1]}).{axis}"
+        return f"LT({format_arg(feature_signature[0])}, {format_arg(feature_signature[1])}).{axis}"
     elif feature_name == "COLOR":
-        return f"COL({feature_signature[0][1]})"
+        return f"COL({format_arg(feature_signature[0])})"
     print("feature render formatting error. exiting...")
     exit()
 
@@ -13,4 +13,18 @@ def make(env_name, logger, mode, *args, notify=False,  **kwargs ):
         env = ocgym.make(env_name, mode, *args, notify=notify, **kwargs) 
         # TODO: get env name from OC_atari instance
         logger.GeneralInfo("Environment %s specified. Compatible object extractor %s loaded." % (colored(env_name, "light_cyan"),colored("OC_Atari", "light_cyan")))
-        return env
\ No newline at end of file
+        return env
+
+def clone_state(env, include_rng=False):
+    import scobi.environments.ocgym as ocgym
+    return ocgym.clone_state(env, include_rng)
+
+
+def restore_state(env, state, objects=None, ns_buffer=None):
+    import scobi.environments.ocgym as ocgym
+    return ocgym.restore_state(env, state, objects, ns_buffer)
+
+
+def hud_categories(env):
+    import scobi.environments.ocgym as ocgym
+    return ocgym.hud_categories(env)
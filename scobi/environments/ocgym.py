@@ -1,10 +1,13 @@
 """
 Augmented gym that contain additional info based on ATARIARI wrapper module
 """
+from collections import deque
 import gymnasium as gym
+import numpy as np
 from termcolor import colored
 try:
     from ocatari.core import OCAtari
+    from ocatari.ram.extract_ram_info import init_objects, get_max_objects
 except ImportError as imp_err:
     print(colored("OC-Atari Not found, please install it:", "red"))
     print(colored("https://github.com/k4ntz/OC_Atari", "blue"))
@@ -13,7 +16,40 @@ except ImportError as imp_err:
     #raise imp_err
 
 
-def make(env_name, mode, *args, notify=False, **kwargs):
+def make(env_name, mode, *args, notify=False, capture_rgb=True, **kwargs):
     if notify:
         print(colored("Using AtariARI", "green"))
+    if capture_rgb:
+        kwargs["create_buffer_stacks"] = ["ori"] # fresh list, OCAtari appends to it
+    else:
+        # no rgb state buffer, and let ALE return the RAM instead of rendering the screen on every step.
+        # vision mode reads the screen from ALE directly, so it is not affected.
+        kwargs["create_buffer_stacks"] = []
+        kwargs["obs_type"] = "ram"
     return OCAtari(env_name, mode, *args, **kwargs) 
+
+
+def clone_state(env, include_rng=False):
+    # by default without the rng, so sticky actions keep drawing from the running seed
+    return env._env.unwrapped.ale.cloneState(include_rng=include_rng)
+
+
+def restore_state(env, state, objects=None, ns_buffer=None):
+    # restore a snapshot. without tracked objects and ns buffer, rebuild them the same way OCAtari.reset() does
+    env._env.unwrapped.ale.restoreState(state)
+    if objects is None:
+        env.objects = init_objects(env.game_name, env.hud, vision=env.mode == "vision")
+        env.detect_objects()
+        env._reset_buffer()
+    else:
+        env.objects = objects
+        env._state_buffer_ns = deque(ns_buffer, maxlen=env.buffer_window_size)
+    return np.array(env._state_buffer_ns)
+
+
+def hud_categories(env):
+    # categories OCAtari only tracks with hud=True
+    try:
+        return sorted(set(get_max_objects(env.game_name, True)) - set(get_max_objects(env.game_name, False)))
+    except AttributeError: # game without HUD objects
+        return []
@@ -1,23 +1,51 @@
 from typing import Tuple
+import re
 import yaml
 import numpy as np
 import math
+from statistics import NormalDist
 from pathlib import Path
-from itertools import permutations
-from scobi.concepts import init as concept_init
+from itertools import permutations, product
+from scobi.concepts import init as concept_init, CategoryPositions
 from scobi.utils.decorators import FUNCTIONS
+from scobi.utils.running_stats import RunningStats
 from termcolor import colored
 
+# atari screen size. reduced-precision observations are clipped to OBS_BOUND, which leaves room for
+# positions slightly off-screen and for distances/deltas between any two points on the screen
+SCREEN_WIDTH = 160
+SCREEN_HEIGHT = 210
+OBS_BOUND = 2 * max(SCREEN_WIDTH, SCREEN_HEIGHT)
+OBS_DTYPES = ["float32", "float16", "int16"]
+# int16 keeps the (integer) object properties as they are, function outputs such as distances,
+# centers and velocities are stored as fixed point with 1/INT16_FUNCTION_SCALE pixel resolution
+INT16_FUNCTION_SCALE = 64
+# same defaults as VecNormalize
+NORM_CLIP = 10.0
+NORM_EPSILON = 1e-8
+DEFAULT_FOCUS_RULES = Path(__file__).parent / "resources" / "focus_rules.yaml"
+FOCUS_RULE_KEYS = ["concepts", "hud_relations", "no_relations", "same_category", "anchors", "unordered"]
+# object patterns in focus files: * matches any characters, [a-b] any slot number from a to b
+NAME_PATTERN_RANGE = re.compile(r"\[(\d+)-(\d+)\]")
+
 class Focus():
-    def __init__(self, env_name, reward, hide_properties, fofiles_dir_name, fofile, raw_features, max_obj_dict, actions, refresh_yaml, logger):
+    def __init__(self, env_name, reward, hide_properties, fofiles_dir_name, fofile, raw_features, max_obj_dict, actions, refresh_yaml, logger, obs_dtype="float32", focus_rules=None, hud_categories=()):
         concept_init()
+        if obs_dtype not in OBS_DTYPES:
+            logger.GeneralError("Unknown observation dtype %s. Available: %s" % (obs_dtype, OBS_DTYPES))
+        self.OBS_DTYPE = np.dtype(obs_dtype)
         self.FUNCTION_LIST = []
         self.MAX_NB_OBJECTS = max_obj_dict
         self.INIT_OBJECTS = raw_features
         self.INIT_OBJECT_NAMES = [x.category for x in self.INIT_OBJECTS]
         self.NS_REPR_LIST = []
         self.NS_REPR_TYPES = []
+        self.CATEGORY_REPR_LIST = []
+        self.CATEGORY_REPR_TYPES = []
+        self.USED_CATEGORIES = []
         self.OBJECT_NAMES = []
+        self.OBJECT_CATEGORIES = {}
+        self.HUD_CATEGORIES = set(hud_categories)
 
         self.ACTIONS = actions
         self.ENV_NAME = env_name.split("/")[-1] # handle v5 namespace case
@@ -52,16 +80,30 @@ class Focus():
         self.reward_helper_var = False
         self.HIDE_PROPERTIES = hide_properties
 
-        self.running_stats = []
+        # optional normalization stage, active once init_normalization() was called
+        self.running_stats = None
+        self.running_stats_delta = None # samples since the last pop, to merge stats across envs
+        self.normalization_frozen = False
+        self.last_raw_obs = None
+        self.OBS_SCALE = None # per-feature scale of int16 observations, set with the feature vector size
+        # optional noisy detection stage, active once enable_noise() was called
+        self.noise_random_state = None
+        self.last_ns_obs = None
         self.logger = logger
+        self.FOCUS_RULES = self.load_focus_rules(focus_rules) if focus_rules else None
+        # rule-generated defaults get their own name, so existing default files stay valid
+        default_fofile = "default_focus_" + self.ENV_NAME + ("_rules.yaml" if self.FOCUS_RULES else ".yaml")
+        fofiles_dir_path = Path.cwd() / Path(fofiles_dir_name)
+        # slot caps change the object layout itself, so they are read before anything is generated
+        self.SLOT_CAPS = self.read_slot_caps(fofiles_dir_path / Path(fofile if fofile else default_fofile))
         # self.generate_property_set()
         self.generate_ns_repr_set()
+        self.generate_slot_selection()
         self.generate_history_idxs()
         self.generate_function_set()
         self.last_obs_vector = []
         self.first_pass = True
 
-        fofiles_dir_path = Path.cwd() / Path(fofiles_dir_name)
         fofiles_dir_path.mkdir(exist_ok=True)
         logger.GeneralInfo("Focus file directory: %s." % colored(fofiles_dir_name, "light_green"))
         if fofile: # pruned focus file passed
@@ -74,7 +116,7 @@ class Focus():
             else: # if passed focus file doesnt exist, exit
                 logger.GeneralError("Specified Focus File %s not found!" %  colored(fofile_path.name, "light_green"))
         else: # no pruned focus file passed
-            fofile_path = fofiles_dir_path / Path("default_focus_" + self.ENV_NAME + ".yaml")
+            fofile_path = fofiles_dir_path / Path(default_fofile)
             if not fofile_path.exists(): # default focus file does not exist
                 self.generate_fresh_yaml(fofile_path)
                 logger.GeneralWarning("No Default Focus File found. Auto-generated %s." % colored(fofile_path.name, "light_green"))
@@ -117,8 +159,9 @@ class Focus():
             obj = self.INIT_OBJECTS[self.INIT_OBJECT_NAMES.index(k)]
             # extract meanings and types of ns_repr
             # iterate over number of objects of current kind 
-            for i in range( v):
+            for i in range(self.SLOT_CAPS.get(k, v)):
                 self.OBJECT_NAMES.append(k+str(i+1))
+                self.OBJECT_CATEGORIES[k+str(i+1)] = k
                 ns_meanings = [[meaning, k+str(i+1)] for meaning in obj._ns_meaning]
                 self.NS_REPR_LIST += ns_meanings
                 self.NS_REPR_TYPES += obj._ns_types
@@ -128,7 +171,65 @@ class Focus():
             if ns_repr[0] == "POSITION":
                 self.NS_REPR_LIST.insert(i+1, ["POSITION_HISTORY", ns_repr[1]])
                 self.NS_REPR_TYPES.insert(i+1, Tuple[int, int, int, int])
+        # whole categories as function arguments, not part of the ns_repr (and thus not of the feature vector)
+        for k in self.MAX_NB_OBJECTS.keys():
+            if self.SLOT_CAPS.get(k, self.MAX_NB_OBJECTS[k]) > 0:
+                self.CATEGORY_REPR_LIST.append(["POSITIONS", k])
+                self.CATEGORY_REPR_TYPES.append(CategoryPositions)
+
+
+    def read_slot_caps(self, fpath):
+        if not fpath.exists():
+            return {}
+        with open(fpath, "r") as f:
+            in_dict = yaml.safe_load(f)
+        caps = (in_dict.get("SELECTION") or {}).get("slot_caps") or {}
+        for k, v in caps.items():
+            if k not in self.MAX_NB_OBJECTS:
+                self.logger.FocusFileParserError("Unknown object category in slot caps: %s" % k)
+            if not isinstance(v, int) or not 0 <= v <= self.MAX_NB_OBJECTS[k]:
+                self.logger.FocusFileParserError("Invalid slot cap for %s: %s. Has to be between 0 and %d" % (k, v, self.MAX_NB_OBJECTS[k]))
+        return {k: v for k, v in caps.items() if v < self.MAX_NB_OBJECTS[k]}
 
+    def generate_slot_selection(self):
+        # maps the OC_Atari buffers to the capped layout: uncapped categories keep all their slots,
+        # capped ones get their first k visible slots (in slot order) at every step
+        gather, rows = [], []
+        self.capped_slots = []
+        ns_idx, raw_row = 0, 0
+        for k, v in self.MAX_NB_OBJECTS.items():
+            obj = self.INIT_OBJECTS[self.INIT_OBJECT_NAMES.index(k)]
+            arg_lens = [len(str(t).split('[')[1][:-1].split(',')) for t in obj._ns_types]
+            slot_len = sum(arg_lens)
+            slots = ns_idx + slot_len * np.arange(v)[:, None] + np.arange(slot_len) # (slots, ns entries)
+            slot_rows = raw_row + np.arange(v)
+            cap = self.SLOT_CAPS.get(k, v)
+            if cap < v:
+                pos = sum(arg_lens[:obj._ns_meaning.index("POSITION")])
+                self.capped_slots.append((slice(len(gather), len(gather) + cap * slot_len), slice(len(rows), len(rows) + cap),
+                                          slots, slots[:, pos:pos+2], slot_rows, cap))
+            gather += list(slots[:cap].ravel())
+            rows += list(slot_rows[:cap])
+            ns_idx += v * slot_len
+            raw_row += v
+        self.slot_gather = np.asarray(gather, dtype=np.int64)
+        self.slot_rows = np.asarray(rows, dtype=np.int64)
+        self.last_slot_rows = self.slot_rows
+
+    def select_slots(self, obs):
+        """
+        Compacts the OC_Atari buffers (2, n) to the capped layout. Visibility is decided on the current
+        frame and the previous frame is read from the same slots, so position histories stay consistent.
+        """
+        gather = self.slot_gather.copy()
+        rows = self.slot_rows.copy()
+        for dst, dst_rows, slots, pos, slot_rows, cap in self.capped_slots:
+            visible = np.any(obs[1][pos] != 0, axis=1)
+            order = np.argsort(~visible, kind="stable")[:cap]
+            gather[dst] = slots[order].ravel()
+            rows[dst_rows] = slot_rows[order]
+        self.last_slot_rows = rows
+        return obs[:, gather]
 
     # def generate_property_set(self):
     #     print(PROPERTIES)
@@ -140,20 +241,73 @@ class Focus():
     #     print(self.PROPERTY_LIST)
     #     exit()
 
+    def load_focus_rules(self, focus_rules):
+        fpath = DEFAULT_FOCUS_RULES if focus_rules is True else Path(focus_rules)
+        if not fpath.exists():
+            self.logger.GeneralError("Focus rules file %s not found!" % colored(str(fpath), "light_green"))
+        with open(fpath, "r") as f:
+            rules_dict = yaml.safe_load(f)
+        rules = dict(rules_dict.get("global", {}))
+        rules.update((rules_dict.get("games") or {}).get(self.ENV_NAME.split("-")[0], {}))
+        for k, v in rules.items():
+            if k not in FOCUS_RULE_KEYS:
+                self.logger.GeneralError("Unknown focus rule %s. Available: %s" % (k, FOCUS_RULE_KEYS))
+        concepts = rules.get("concepts", "all")
+        rules["concepts"] = None if concepts == "all" else set(concepts)
+        same_category = rules.get("same_category", True)
+        rules["same_category"] = same_category if isinstance(same_category, bool) else set(same_category)
+        rules["hud_relations"] = rules.get("hud_relations", True)
+        rules["no_relations"] = set(rules.get("no_relations") or [])
+        rules["anchors"] = set(rules.get("anchors") or [])
+        rules["unordered"] = set(rules.get("unordered") or [])
+        self.logger.GeneralInfo("Generating default focus file with rules from %s." % colored(fpath.name, "light_green"))
+        return rules
+
+    def passes_focus_rules(self, func_name, combi):
+        rules = self.FOCUS_RULES
+        if rules["concepts"] is not None and func_name not in rules["concepts"]:
+            return False
+        if func_name in rules["unordered"] and self.NS_REPR_LIST.index(combi[0]) > self.NS_REPR_LIST.index(combi[1]):
+            return False
+        objects = [c[1] for c in combi]
+        if len(objects) < 2:
+            return True
+        categories = [self.OBJECT_CATEGORIES.get(o, o) for o in objects] # category arguments are named by their category
+        if not rules["hud_relations"] and self.HUD_CATEGORIES.intersection(categories):
+            return False
+        if rules["no_relations"].intersection(categories):
+            return False
+        if len(set(categories)) == 1:
+            same = rules["same_category"]
+            if same is not True and (same is False or categories[0] not in same):
+                return False
+        if rules["anchors"] and not rules["anchors"].intersection(categories):
+            return False
+        if rules["anchors"] and combi[-1] in self.CATEGORY_REPR_LIST and categories[0] not in rules["anchors"]:
+            return False # relations to a whole category are only kept from the point of view of an anchor
+        return True
+
     def generate_function_set(self):
+        arg_list = self.NS_REPR_LIST + self.CATEGORY_REPR_LIST
+        arg_types = self.NS_REPR_TYPES + self.CATEGORY_REPR_TYPES
         for k, v in FUNCTIONS.items():
             para_len = len(v["expects"])
             # property_combis = permutations(self.PROPERTY_LIST, para_len)
-            ns_repr_combis = permutations(self.NS_REPR_LIST, para_len)
+            ns_repr_combis = permutations(arg_list, para_len)
             function_sig = [x[0].annotation for x in v["expects"]]
+            # category concepts are opt-in: only generated if the focus rules name them
+            if CategoryPositions in function_sig and not (self.FOCUS_RULES and self.FOCUS_RULES["concepts"] and k in self.FOCUS_RULES["concepts"]):
+                continue
             for combi in ns_repr_combis:
                 # combi_sig_orig = [PROPERTIES[x[0]]["returns"][0] for x in combi]
                 combi_sig = []
                 for c in combi:
-                    idx = self.NS_REPR_LIST.index(c)
-                    combi_sig.append(self.NS_REPR_TYPES[idx])
+                    idx = arg_list.index(c)
+                    combi_sig.append(arg_types[idx])
                 function_sig = [x[0].annotation for x in v["expects"]]
                 if combi_sig == function_sig:
+                    if self.FOCUS_RULES and not self.passes_focus_rules(k, combi):
+                        continue
                     self.FUNCTION_LIST.append([k, list(combi)])
 
     # def get_object_by_name(self, name, objs):
@@ -212,16 +366,50 @@ class Focus():
         return out_dict
 
 
+    def compact_function_list(self, funclist):
+        """
+        Writes a function list with object patterns where their expansion reproduces the list exactly
+        (same entries, same order), tries all objects first, then all objects for the last argument,
+        then a slot range for the last argument.
+        """
+        out = []
+        i = 0
+        while i < len(funclist):
+            fname, args = funclist[i]
+            last_prop, last_obj = args[-1]
+            candidates = [[fname, [[a[0], "*"] for a in args]]]
+            candidates.append([fname, args[:-1] + [[last_prop, "*"]]])
+            category = self.OBJECT_CATEGORIES.get(last_obj)
+            if category is not None:
+                start = int(last_obj[len(category):])
+                end = start
+                while i + end - start + 1 < len(funclist) and funclist[i + end - start + 1] == [fname, args[:-1] + [[last_prop, category + str(end + 1)]]]:
+                    end += 1
+                if end > start:
+                    candidates.append([fname, args[:-1] + [[last_prop, "%s[%d-%d]" % (category, start, end)]]])
+            expansion = [funclist[i]]
+            compact = funclist[i]
+            for candidate in candidates:
+                candidate_expansion = self.expand_functions([self.funclist_to_yaml_dict(candidate)])
+                if funclist[i:i + len(candidate_expansion)] == candidate_expansion:
+                    expansion, compact = candidate_expansion, candidate
+                    break
+            out.append(self.funclist_to_yaml_dict(compact))
+            i += len(expansion)
+        return out
+
     def generate_fresh_yaml(self, fpath):
         yaml_dict = {
             "ENVIRONMENT" : "",
             "AVAILABLE_CONCEPTS" : {
                 "objects" : [],
+                "slots" : {},
                 "actions" : [],
                 # "properties" : [],
                 "functions" : []
             },
             "SELECTION": {
+                "slot_caps" : {},
                 "objects" : [],
                 "actions" : [],
                 # "properties" : [],
@@ -232,15 +420,17 @@ class Focus():
         yaml_dict["ENVIRONMENT"] = self.ENV_NAME
         avail = yaml_dict["AVAILABLE_CONCEPTS"]
         avail["objects"] = self.OBJECT_NAMES #[x.name for x in self.OBJECTS]
+        avail["slots"] = dict(self.MAX_NB_OBJECTS)
         avail["actions"] = [x for x in self.ACTIONS]
         # avail["properties"] = [self.avail_to_yaml_dict(k, v) for k, v in PROPERTIES.items()]
         avail["functions"] =  [self.avail_to_yaml_dict(k, v) for k, v in FUNCTIONS.items()]
 
         use = yaml_dict["SELECTION"]
+        use["slot_caps"] = dict(self.SLOT_CAPS)
         use["objects"] = self.OBJECT_NAMES#[x.name for x in self.OBJECTS]
         use["actions"] = [x for x in self.ACTIONS]
         # use["properties"] = [self.proplist_to_yaml_dict(x) for x in self.PROPERTY_LIST]
-        use["functions"] = [self.funclist_to_yaml_dict(x) for x in self.FUNCTION_LIST]
+        use["functions"] = self.compact_function_list(self.FUNCTION_LIST)
 
         with open(fpath, "w") as f:
             yaml.dump(yaml_dict, f, sort_keys=False)
@@ -277,6 +467,13 @@ class Focus():
             if f[0] not in FUNCTIONS.keys():
                 self.logger.FocusFileParserError("Unknown function in function selection: %s" % f[0])
             for para in f[1]:
+                if isinstance(para[1], list): # nested function, its return type is the argument type
+                    self.validate_functions_signatures([para])
+                    parsed_para_sig.append(FUNCTIONS[para[0]]["returns"][0])
+                    continue
+                if para in self.CATEGORY_REPR_LIST:
+                    parsed_para_sig.append(CategoryPositions)
+                    continue
                 if para not in self.NS_REPR_LIST:
                     self.logger.FocusFileParserError("Unknown property in functions selection: %s" % para[0])
                 if para[1] not in self.OBJECT_NAMES:
@@ -292,6 +489,8 @@ class Focus():
 
 
     def import_objects(self, objs):
+        if objs:
+            objs = [o for pattern in objs for o in self.expand_name_pattern(pattern, self.OBJECT_NAMES)]
         passed, obj = self.validate_objects(objs)
         if passed:
             return objs
@@ -305,25 +504,63 @@ class Focus():
             self.logger.FocusFileParserError("Invalid actions specified in actions selection!")
 
 
-    def import_functions(self ,funcs):
+    def expand_name_pattern(self, pattern, names):
+        # plain names are returned as they are, validation reports unknown ones
+        if "*" not in pattern and not NAME_PATTERN_RANGE.search(pattern):
+            return [pattern]
+        regex, pos = "", 0
+        for m in NAME_PATTERN_RANGE.finditer(pattern):
+            regex += re.escape(pattern[pos:m.start()]).replace(r"\*", ".*")
+            regex += "(?:%s)" % "|".join(str(i) for i in range(int(m[1]), int(m[2]) + 1))
+            pos = m.end()
+        regex += re.escape(pattern[pos:]).replace(r"\*", ".*")
+        regex = re.compile(regex)
+        matches = [n for n in names if regex.fullmatch(n)]
+        if not matches:
+            self.logger.FocusFileParserError("Pattern %s matches no object" % pattern)
+        return matches
+
+    def expand_functions(self, funcs):
+        """
+        Expands focus file function entries to [name, args] lists. An argument is {PROPERTY: Object}
+        or the compact string 'PROPERTY Object', the object can be a pattern (Enemy*, Platform[1-4]),
+        and an argument can be a nested function {FUNCTION: [args]}. Patterns expand to every
+        combination in object order, skipping combinations that use the same argument twice.
+        """
         out = []
-        funcs_to_vali = []
-        properties_to_vali = []
-        objects_to_vali = []
-        if not funcs:
-            return []
         for p in funcs:
             item = list(p.items())[0]
             fname = item[0]
             fparas = item[1]
-            funcs_to_vali.append(fname)
-            para_list = [fname, []]
+            options = []
+            is_pattern = False
             for p in fparas:
+                if isinstance(p, str):
+                    parts = p.split(maxsplit=1)
+                    if len(parts) != 2:
+                        self.logger.FocusFileParserError("Invalid parameter '%s' of function %s. Expected 'PROPERTY Object'" % (p, fname))
+                    p = dict([parts])
                 para_tuple = list(p.items())[0]
-                properties_to_vali.append(para_tuple[0]) # not used ?
-                objects_to_vali.append(para_tuple[1]) # not used ?
-                para_list[1].append(list(para_tuple))
-            out.append(para_list)
+                if isinstance(para_tuple[1], list): # nested function: {FUNCTION: [args]}
+                    options.append(self.expand_functions([p]))
+                    is_pattern = is_pattern or len(options[-1]) > 1
+                    continue
+                names = [x[1] for x in self.CATEGORY_REPR_LIST] if para_tuple[0] == "POSITIONS" else self.OBJECT_NAMES
+                objects = self.expand_name_pattern(str(para_tuple[1]), names)
+                is_pattern = is_pattern or objects != [para_tuple[1]]
+                options.append([[para_tuple[0], o] for o in objects])
+            for combi in product(*options):
+                if is_pattern:
+                    leaves = [tuple(c) for c in combi if not isinstance(c[1], list)]
+                    if len(set(leaves)) < len(leaves):
+                        continue
+                out.append([fname, list(combi)])
+        return out
+
+    def import_functions(self ,funcs):
+        if not funcs:
+            return []
+        out = self.expand_functions(funcs)
         if self.validate_functions_signatures(out):
             return out
         else:
@@ -341,8 +578,8 @@ class Focus():
         self.PARSED_ACTIONS = self.import_actions(sdict["actions"])
         self.PARSED_FUNCTIONS = self.import_functions(sdict["functions"])
         # based on the focus file selection,
-        # construct a single layer computation graph for the feature vector:
-        # 1     FUNC_COMPUTE_LAYER
+        # construct the computation graph for the feature vector:
+        # 1..n  FUNC_COMPUTE_LAYER (function nodes in topological order, shared subfunctions only once)
         parsed_fv_index = 0
 
         for ns_repr_type in self.NS_REPR_TYPES:
@@ -370,33 +607,115 @@ class Focus():
         #         self.FEATURE_VECTOR_BACKMAP.append(parsed_fv_index)
         #     parsed_fv_index += 1
 
+        # categories passed as a whole are appended to the property results, in order of first use,
+        # followed by the results of the function nodes
+        self.generate_category_layer()
+        self.VALUES_BASE = len(self.NS_REPR_LIST) + len(self.USED_CATEGORIES)
+        self.CURRENT_VALUES = [0 for _ in range(self.VALUES_BASE)]
+        self.NODE_IDXS = {}
+        self.FEATURE_FUNC_IDXS = []
         for f in self.PARSED_FUNCTIONS:
             func_name = f[0]
-            input_props = f[1]
-            property_result_idxs = []
-            for p in input_props:
-                property_name = p[0]
-                object_name = p[1]
-                # property_result_idxs.append(prop_name_obj_name_pairs.index((property_name, object_name)))
-                property_result_idxs.append(self.NS_REPR_LIST.index([property_name, object_name]))
-            f = FUNCTIONS[func_name]["object"]
             return_len = len(FUNCTIONS[func_name]["returns"][0].__args__)
             for _ in range(return_len):
                 self.FEATURE_VECTOR_BACKMAP.append(parsed_fv_index)
             parsed_fv_index += 1
-            ol = [0 for _ in range(len(property_result_idxs))]
+            self.FEATURE_FUNC_IDXS.append(self.add_function_node(f))
+        # init compute layer lists
+        # self.PROPERTY_COMPUTE_LAYER_SIZE = len(self.PROPERTY_COMPUTE_LAYER)
+        # self.CURRENT_PROPERTY_COMPUTE_LAYER = [0 for _ in range(self.PROPERTY_COMPUTE_LAYER_SIZE)]
+        self.CURRENT_FUNC_COMPUTE_LAYER = [0 for _ in range(len(self.FEATURE_FUNC_IDXS))]
+
+    def function_node_key(self, f):
+        return (f[0], tuple(self.function_node_key(p) if isinstance(p[1], list) else tuple(p) for p in f[1]))
+
+    def add_function_node(self, f):
+        """
+        Adds function f ([name, args], args may be nested functions) to the compute graph and returns
+        the index of its result in CURRENT_VALUES. Every distinct (sub)function is a single node that is
+        computed once per step, nodes are appended after their inputs, so the list is in topological order.
+        Reward functions can request nodes that are not part of the feature vector the same way.
+        """
+        key = self.function_node_key(f)
+        if key in self.NODE_IDXS:
+            return self.NODE_IDXS[key]
+        func_name = f[0]
+        input_props = f[1]
+        property_result_idxs = []
+        category_args = []
+        for i, p in enumerate(input_props):
+            property_name = p[0]
+            object_name = p[1]
+            # property_result_idxs.append(prop_name_obj_name_pairs.index((property_name, object_name)))
+            if isinstance(object_name, list):
+                property_result_idxs.append(self.add_function_node(p))
+            elif p in self.CATEGORY_REPR_LIST:
+                property_result_idxs.append(len(self.NS_REPR_LIST) + self.USED_CATEGORIES.index(object_name))
+                category_args.append((i, self.category_keep_mask(object_name, input_props)))
+            else:
+                property_result_idxs.append(self.NS_REPR_LIST.index([property_name, object_name]))
+        f = FUNCTIONS[func_name]["object"]
+        ol = [0 for _ in range(len(property_result_idxs))]
+        if category_args:
+            def func(prop_results, f=f, idxs=property_result_idxs, outlist=ol, category_args=category_args):
+                f_in = outlist
+                for i, j in enumerate(idxs):
+                    f_in[i] = prop_results[j]
+                for i, keep in category_args:
+                    xy, visible = f_in[i]
+                    f_in[i] = xy[visible & keep]
+                return f(*f_in)
+        else:
             def func(prop_results, f=f, idxs=property_result_idxs, outlist=ol):
                 f_in = outlist
                 for i, j in enumerate(idxs):
                     f_in[i] = prop_results[j]
                 return f(*f_in)
-            self.FUNC_COMPUTE_LAYER.append(func)
-        # init compute layer lists
-        # self.PROPERTY_COMPUTE_LAYER_SIZE = len(self.PROPERTY_COMPUTE_LAYER)
+        idx = len(self.CURRENT_VALUES)
+        self.FUNC_COMPUTE_LAYER.append(func)
         self.FUNC_COMPUTE_LAYER_SIZE = len(self.FUNC_COMPUTE_LAYER)
-        # self.CURRENT_PROPERTY_COMPUTE_LAYER = [0 for _ in range(self.PROPERTY_COMPUTE_LAYER_SIZE)]
-        self.CURRENT_FUNC_COMPUTE_LAYER = [0 for _ in range(self.FUNC_COMPUTE_LAYER_SIZE)]
-    
+        self.CURRENT_VALUES.append(0)
+        self.NODE_IDXS[key] = idx
+        return idx
+
+    def generate_category_layer(self):
+        # position rows of the categories the selected functions take as a whole
+        self.USED_CATEGORIES = []
+        args = [p for f in self.PARSED_FUNCTIONS for p in f[1]]
+        while args:
+            p = args.pop(0)
+            if isinstance(p[1], list):
+                args += p[1]
+            elif p in self.CATEGORY_REPR_LIST and p[1] not in self.USED_CATEGORIES:
+                self.USED_CATEGORIES.append(p[1])
+        object_categories = [self.OBJECT_CATEGORIES[name] for meaning, name in self.NS_REPR_LIST if meaning == "POSITION"]
+        rows = []
+        self.category_slices = []
+        for c in self.USED_CATEGORIES:
+            c_rows = [i for i, oc in enumerate(object_categories) if oc == c]
+            self.category_slices.append(slice(len(rows), len(rows) + len(c_rows)))
+            rows += c_rows
+        pos_idxs = np.asarray(self.pos_idxs, dtype=np.int64)[rows]
+        self.category_xy_idxs = np.stack([pos_idxs, pos_idxs + 1], axis=1)
+
+    def category_keep_mask(self, category, input_props):
+        # objects never relate to themselves through their own category
+        names = [o for o in self.OBJECT_NAMES if self.OBJECT_CATEGORIES[o] == category]
+        keep = np.ones(len(names), dtype=bool)
+        for p in input_props:
+            if p[1] in names:
+                keep[names.index(p[1])] = False
+        return keep
+
+    def get_category_layer(self, obs):
+        """
+        Positions and visibility of all objects of the used categories, gathered in one pass over
+        the current frame. Returns one (xy, visible) pair per category, in order of USED_CATEGORIES.
+        """
+        xy = obs[1][self.category_xy_idxs].astype(np.float32)
+        visible = np.any(xy != 0, axis=1)
+        return [(xy[s], visible[s]) for s in self.category_slices]
+
     def ns_repr_list_to_func_input(self, ns_repr_list):
         # might be slow
         out_list = []
@@ -446,24 +765,64 @@ class Focus():
         return new_obs
 
 
+    def enable_noise(self, std, error_rate, random_state):
+        self.noise_std = std
+        # a detection is dropped if its standard normal draw falls below this quantile
+        self.noise_dropout_threshold = NormalDist().inv_cdf(error_rate) if error_rate > 0 else -np.inf
+        self.noise_random_state = random_state
+        self.noise_xy_idxs = np.stack([self.pos_idxs, np.add(self.pos_idxs, 1)], axis=1).astype(np.int64)
+
+
+    def add_noise_to_obs(self, obs):
+        """
+        Simulates a noisy object detector on the OC_Atari buffers: gaussian jitter on the positions
+        of both frames, and dropped detections that report the (jittered) previous position instead.
+        Only objects visible in the current frame can be dropped, invisible objects stay untouched.
+        Uses a single RNG call for all objects.
+        """
+        xy = self.noise_xy_idxs
+        z = self.noise_random_state.standard_normal((len(xy), 5))
+        noisy = obs.astype(np.float32)
+        visible_now = np.any(noisy[1][xy] != 0, axis=1)
+        for frame, jitter in ((1, z[:, 0:2]), (0, z[:, 2:4])):
+            coords = noisy[frame][xy]
+            visible = np.any(coords != 0, axis=1, keepdims=True)
+            noisy[frame][xy] = np.where(visible, coords + self.noise_std * jitter, coords)
+        # an object that is not there can't be missed, it must not reappear at its old position
+        dropped = xy[(z[:, 4] < self.noise_dropout_threshold) & visible_now]
+        noisy[1][dropped] = noisy[0][dropped]
+        return noisy
+
+
     def get_feature_vector(self, obs):
-        # evaluate a 2 layer computation graph for the feature vector:
+        # evaluate the computation graph for the feature vector:
         # compute the functions given the properties from the neurosymbolic repres. of OCAtari
         # IN   ns_repres (==property_values)
-        # 1     FUNC_COMPUTE_LAYER
+        # 1..n  FUNC_COMPUTE_LAYER (nested functions before the functions that take them)
         #       function_values
         # OUT   HSTACK(CONCAT(property_values, function_values))
         # Instead of having to compute the properties, we get them from OC_Atari directly
 
         assert obs.shape[0] == 2, "OC_Atari window-buffer size should be 2"
+        if self.capped_slots:
+            obs = self.select_slots(obs)
+        if self.noise_random_state is not None:
+            obs = self.add_noise_to_obs(obs)
+        self.last_ns_obs = obs
         inc_ns_repr_list = self.add_history_to_obs(obs)
 
         self.CURRENT_PROPERTY_COMPUTE_LAYER = self.ns_repr_list_to_func_input(inc_ns_repr_list)
+        values = self.CURRENT_VALUES
+        values[:len(self.CURRENT_PROPERTY_COMPUTE_LAYER)] = self.CURRENT_PROPERTY_COMPUTE_LAYER
+        if self.USED_CATEGORIES:
+            values[len(self.CURRENT_PROPERTY_COMPUTE_LAYER):self.VALUES_BASE] = self.get_category_layer(obs)
 
-        # calc function layer
+        # calc function nodes, then pick the ones in the feature vector
+        base = self.VALUES_BASE
         for i in range(self.FUNC_COMPUTE_LAYER_SIZE):
             f = self.FUNC_COMPUTE_LAYER[i]
-            self.CURRENT_FUNC_COMPUTE_LAYER[i] = f(self.CURRENT_PROPERTY_COMPUTE_LAYER)
+            values[base + i] = f(values)
+        self.CURRENT_FUNC_COMPUTE_LAYER = [values[i] for i in self.FEATURE_FUNC_IDXS]
         if self.first_pass:
             self.first_pass = False
             props = [i for e in self.CURRENT_PROPERTY_COMPUTE_LAYER for i in e]
@@ -476,6 +835,9 @@ class Focus():
                 self.OBSERVATION_SIZE = len(out)
             self.FEATURE_VECTOR_PROPS_SIZE = len(props)
             self.FEATURE_VECTOR_FUNCS_SIZE = len(funcs)
+            if self.OBS_DTYPE == np.int16:
+                scale = np.concatenate([np.ones(len(props)), np.full(len(funcs), INT16_FUNCTION_SCALE)]).astype(np.float32)
+                self.OBS_SCALE = scale[len(props):] if self.HIDE_PROPERTIES else scale
             self.CURRENT_FEATURE_VECTOR_PROPS = [0 for _ in range(self.FEATURE_VECTOR_PROPS_SIZE)]
             self.CURRENT_FEATURE_VECTOR_FUNCS = [0 for _ in range(self.FEATURE_VECTOR_FUNCS_SIZE)]
             self.CURRENT_FREEZE_MASK = [1 for _ in range(self.FEATURE_VECTOR_SIZE)]
@@ -507,7 +869,7 @@ class Focus():
             out = self.last_obs_vector
             if self.HIDE_PROPERTIES:
                 out = out[self.FEATURE_VECTOR_PROPS_SIZE:]
-            return np.asarray(out, dtype=np.float32), reward
+            return self._to_obs(out), reward
 
         # unpack property layer
         idx = 0
@@ -543,7 +905,39 @@ class Focus():
             reward = 0
         if self.HIDE_PROPERTIES:
             out = out[self.FEATURE_VECTOR_PROPS_SIZE:]
-        return np.asarray(out, dtype=np.float32), reward
+        return self._to_obs(out), reward
+
+    def _to_obs(self, out):
+        out = np.asarray(out, dtype=np.float32)
+        self.last_raw_obs = out
+        if self.running_stats is not None:
+            out = self._normalize(out)
+        elif self.OBS_DTYPE != np.float32:
+            out = np.clip(out, -OBS_BOUND, OBS_BOUND)
+            if self.OBS_DTYPE == np.int16:
+                out = np.rint(out * self.OBS_SCALE)
+        return out.astype(self.OBS_DTYPE, copy=False)
+
+    def _normalize(self, out):
+        # all envs normalize with the same (last shared) stats, like VecNormalize. new samples only go
+        # into the delta, the training loop merges the deltas of all envs and shares the result
+        if not self.normalization_frozen:
+            self.running_stats_delta.update(out)
+        out = (out - self.running_stats.mean) / np.sqrt(self.running_stats.var + NORM_EPSILON)
+        return np.clip(out, -NORM_CLIP, NORM_CLIP).astype(np.float32)
+
+    def init_normalization(self, size):
+        self.running_stats = RunningStats(size)
+        self.running_stats_delta = RunningStats(size, epsilon=0)
+
+    def set_normalization_stats(self, stats):
+        self.running_stats = stats.copy()
+        self.running_stats_delta = RunningStats(stats.mean.shape, epsilon=0)
+
+    def pop_normalization_delta(self):
+        delta = self.running_stats_delta
+        self.running_stats_delta = RunningStats(delta.mean.shape, epsilon=0)
+        return delta
     
     def get_feature_vector_description(self):
         # fv = self.PARSED_PROPERTIES + self.PARSED_FUNCTIONS
@@ -641,13 +1035,14 @@ class Focus():
                         flag_velocity_idxs = np.where(fv_backmap == i-1)[0]
             if not (player_position_idxs.any() and flag_center_idxs.any() and flag_velocity_idxs.any()):
                 return None
+            # shares the flag center node with the feature vector
+            flag_distance_node = self.add_function_node(["EUCLIDEAN_DISTANCE", [["POSITION", "Player1"], ["CENTER", [["POSITION", "Flag1"], ["POSITION", "Flag2"]]]]])
             # reward for high player velocity and player decreases euc-distance to center of flag1 and flag2
-            def reward(fv, c_idxs=flag_center_idxs, p_idxs=player_position_idxs, v_idxs=flag_velocity_idxs):
+            def reward(fv, c_idxs=flag_center_idxs, p_idxs=player_position_idxs, v_idxs=flag_velocity_idxs, d_node=flag_distance_node):
                 p_entries = fv[p_idxs[0]:p_idxs[-1]+1]
                 c_entries = fv[c_idxs[0]:c_idxs[-1]+1]
                 v_entries = fv[v_idxs[0]:v_idxs[-1]+1]
-                euc_dist = FUNCTIONS["EUCLIDEAN_DISTANCE"]["object"]
-                player_flag_distance = euc_dist(p_entries, c_entries)[0]
+                player_flag_distance = self.CURRENT_VALUES[d_node][0]
                 self.reward_history[0] = self.reward_history[1]
                 self.reward_history[1] = player_flag_distance
                 delta = self.reward_history[0] - self.reward_history[1] #decrease in distance: positive sign
@@ -2,8 +2,6 @@
 # switch depending on object extractor
 # only ocatari implemented for now
 from scobi.utils.interfaces import GameObjectInterface
-from typing import Tuple
-from ocatari.ram.game_objects import GameObject as Ocatari_GameObject
 import numpy as np
 import os
 
@@ -12,110 +10,123 @@ def get_wrapper_class():
     if not "SCOBI_OBJ_EXTRACTOR" in os.environ:
         os.environ["SCOBI_OBJ_EXTRACTOR"] = "OC_ATARI"
         print("Set env var 'SCOBI_OBJ_EXTRACTOR' as 'OC_Atari'. Other option is 'Noisy_OC_Atari' which can be set manually")
-    if os.environ["SCOBI_OBJ_EXTRACTOR"] == "Noisy_OC_Atari":
-        return NoisyOCAGameObject
-    elif os.environ["SCOBI_OBJ_EXTRACTOR"] == "OC_Atari":
-        return OCAGameObject
-    else:
-        return OCAGameObject
+    # noisy detection is a Focus stage on the ns_repr buffers, both extractors share the table views
+    return ObjectView
     # add other object extractors here and its wrapper classe below
 
 
-# OC Atari GameObject wrapper classes implementing scobi GameObjectInterface
-class OCAGameObject(GameObjectInterface):
-    def __init__(self, ocgo):
-        self._number = 1
-        if issubclass(type(ocgo), Ocatari_GameObject):
-            self.ocgo = ocgo
-        else:
-            incoming_type = type(ocgo)
-            raise ValueError("Incompatible Wrapper, expects OC_Atari GameObject. Got: "+str(incoming_type))
+# OC Atari objects as one array per frame, rows are the slots in ns_repr order
+class ObjectTable():
+    def __init__(self, names, categories, pos_idxs):
+        n = len(names)
+        self.names = names
+        self.categories = categories
+        self.xy_idxs = np.stack([pos_idxs, np.add(pos_idxs, 1)], axis=1).astype(np.int64)
+        self.xy = np.zeros((n, 2), dtype=np.float32)
+        self.prev_xy = np.zeros((n, 2), dtype=np.float32)
+        self.wh = np.zeros((n, 2), dtype=np.float32)
+        self.rgb = np.zeros((n, 3), dtype=np.uint8)
+        self.visible = np.zeros(n, dtype=bool)
+        self.ocgos = [None] * n
+        self.views = [ObjectView(self, i) for i in range(n)] # allocated once, read the arrays on access
 
+    def update(self, ns_frames, ocgos):
+        """
+        fills the table from the (2, n) ns_repr buffers focus computed the features from (noisy, if
+        enabled) and the matching OC_Atari objects, which only provide sizes, colors and orientations
+        """
+        self.prev_xy[:] = ns_frames[0][self.xy_idxs]
+        self.xy[:] = ns_frames[1][self.xy_idxs]
+        self.visible[:] = np.any(self.xy != 0, axis=1)
+        self.ocgos[:] = ocgos[:len(self.views)]
+        self.wh[:] = [o.wh for o in self.ocgos]
+        self.rgb[:] = [o.rgb for o in self.ocgos]
+
+    def centers(self):
+        return self.xy + (self.wh // 2)
+
+    def visible_objects(self):
+        return [self.views[i] for i in np.flatnonzero(self.visible)]
+
+    def __len__(self):
+        return len(self.views)
+
+    def __getitem__(self, i):
+        return self.views[i]
+
+    def __iter__(self):
+        return iter(self.views)
+
+
+# row views implementing the scobi GameObjectInterface
+class ObjectView(GameObjectInterface):
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
 
     @property
     def category(self):
-        return self.ocgo.category
-    
+        return self.table.categories[self.row]
+
     @property
     def number(self):
-        return self._number
-        
+        return int(self.table.names[self.row][len(self.category):])
+
     @number.setter
     def number(self, number):
-        self._number = number
-    
+        self.table.names[self.row] = self.category + str(number)
+
+    @property
+    def name(self):
+        return self.table.names[self.row]
+
     @property
     def xy(self):
-        if len(self.ocgo.xy) != 2:
-            raise ValueError(f"Bad xy dimension from ocatari: {self.name} : {self.ocgo.xy}") #TODO: generalize and improve dimension checks
-        x = self.ocgo.xy[0] + int(self.w / 2)
-        y = self.ocgo.xy[1] + int(self.h / 2)
-        return x, y
+        # center of the bounding box
+        x, y = self.table.xy[self.row]
+        w, h = self.table.wh[self.row]
+        return x + w // 2, y + h // 2
 
     @xy.setter
     def xy(self, xy):
-        if len(self.ocgo.xy) != 2:
-            raise ValueError(f"Bad xy dimension from ocatari: {self.name} : {self.ocgo.xy}")
-        self.ocgo.xy = xy
+        self.table.xy[self.row] = xy
 
     @property
     def h_coords(self):
-        shc = self.ocgo.h_coords
-        if None in shc or len(shc) != 2 or len([*shc[0], *shc[1]]) != 4:
-            raise ValueError(f"Bad h_coords dimension from ocatari: {self.name} : {self.ocgo.h_coords}")
-        ncord = shc[0][0] + int(self.w / 2), shc[0][1] + int(self.h / 2)
-        ocord = shc[1][0] + int(self.w / 2), shc[1][1] + int(self.h / 2)
-        return ncord, ocord
-    
+        x, y = self.table.xy[self.row]
+        px, py = self.table.prev_xy[self.row]
+        w, h = self.table.wh[self.row] // 2
+        return (x + w, y + h), (px + w, py + h)
+
     @property
     def w(self):
-        return self.ocgo.w
+        return self.table.wh[self.row, 0]
 
     @property
     def h(self):
-        return self.ocgo.h
-    
+        return self.table.wh[self.row, 1]
+
     @property
     def xywh(self):
-        return self.ocgo.xywh
+        # integer pixel box for drawing, noisy positions are rounded
+        x, y = np.rint(self.table.xy[self.row]).astype(int)
+        w, h = self.table.wh[self.row].astype(int)
+        return x, y, w, h
+
+    @property
+    def visible(self):
+        return bool(self.table.visible[self.row])
 
     @property
     def rgb(self):
-        if len(self.ocgo.rgb) != 3:
-            raise ValueError(f"Bad rgb dimension from ocatari: {self.name} : {self.ocgo.rgb}")
-        return self.ocgo.rgb
-    
+        return tuple(self.table.rgb[self.row])
+
     @property
     def orientation(self):
-        return self.ocgo.orientation
-    
-
-class NoisyOCAGameObject(OCAGameObject):
-    def __init__(self, ocgo, std, error_rate, random_state):
-        super().__init__(ocgo)
-        self.std = std
-        self.error_rate = error_rate
-        self.random_state = random_state
+        return self.table.ocgos[self.row].orientation
 
-
-    def _add_noise(self, xy):
-        x_noise = self.random_state.normal(0.0, self.std)
-        y_noise = self.random_state.normal(0.0, self.std)
-        return xy[0] + x_noise, xy[1] + y_noise
-
-    @property
-    def xy(self):
-        if self.random_state.rand(1)[0]  <= self.error_rate:
-            x, y = self._add_noise(super().h_coords[1]) # noise and return past coord
-        else:
-            x, y = self._add_noise(super().xy)
-        return x, y
-    
-    @property
-    def h_coords(self):
-        x, y = self._add_noise(super().h_coords[0])
-        x_old, y_old = self._add_noise(super().h_coords[1])
-        if self.random_state.rand(1)[0]  <= self.error_rate:
-            return (x_old, y_old), (x_old, y_old)
-        else:
-            return (x, y), (x_old, y_old)
+    @orientation.setter
+    def orientation(self, o):
+        self.table.ocgos[self.row].orientation = o
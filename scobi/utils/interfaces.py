@@ -3,6 +3,7 @@ from abc import ABC, abstractmethod
 import math
 
 class GameObjectInterface(ABC):
+    __slots__ = ()
     
     @property
     @abstractmethod
@@ -70,7 +71,8 @@ class GameObjectInterface(ABC):
         return str(self.category) + str(self.number)
     
     def distance(self, game_object):
-        return math.sqrt((self.xy[0] - game_object.xy[0])**2 + (self.xy[1] - game_object.xy[1])**2)
+        (x, y), (ox, oy) = self.xy, game_object.xy
+        return math.sqrt((x - ox)**2 + (y - oy)**2)
 
     def x_distance(self, game_object):
         return self.xy[0] - game_object.xy[0]
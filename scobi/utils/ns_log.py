@@ -0,0 +1,141 @@
+# raw ns_repr logs: stream the OCAtari object buffers of an env into chunked .npz files,
+# so that any focus file can be applied to them offline without touching ALE
+import json
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Tuple
+import numpy as np
+from scobi.utils.logging import Logger
+
+LAYOUT_FILE = "layout.json"
+NO_ACTION = -1
+# ns_repr entries of OCAtari objects are int tuples, layout files store them as str(type)
+NS_TYPES = {str(t): t for t in [Tuple[(int,) * n] for n in range(1, 9)]}
+
+
+class NsReprLogger():
+    # a log_dir with chunks of an earlier (interrupted, now resumed) run is continued after its last
+    # chunk, it starts with a reset, so the recomputation sees the episode boundary
+    def __init__(self, log_dir, oc_env, actions, chunk_size=10_000):
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+        existing = [int(f.stem.split("_")[1]) for f in self.log_dir.glob("chunk_*.npz")]
+        self.chunk_idx = max(existing) + 1 if existing else 0
+        self.idx = 0
+        layout = {
+            "env_name": oc_env.env_name,
+            "hud": oc_env.hud,
+            "mode": oc_env.mode,
+            "actions": list(actions),
+            "max_objects_per_cat": dict(oc_env.max_objects_per_cat),
+            "objects": {o.category: {"ns_meaning": list(o._ns_meaning), "ns_types": [str(t) for t in o._ns_types]} for o in oc_env._slots},
+        }
+        layout_file = self.log_dir / LAYOUT_FILE
+        if existing and layout_file.exists():
+            # the chunks of a directory share one layout
+            if load_layout(self.log_dir) != json.loads(json.dumps(layout)):
+                raise ValueError(f"ns_repr log {self.log_dir} was written with another layout (game, hud, mode or actions)")
+        else:
+            with open(layout_file, "w") as f:
+                json.dump(layout, f, indent=2)
+        # keep the dtype OCAtari produces, so that offline features match the online ones exactly
+        ns_buffer = np.asarray(oc_env._state_buffer_ns)
+        self.buffer_shape = ns_buffer.shape
+        self.buffer_dtype = ns_buffer.dtype
+        self._alloc()
+
+    def _alloc(self):
+        self.obs = np.zeros((self.chunk_size, *self.buffer_shape), dtype=self.buffer_dtype)
+        self.actions = np.zeros(self.chunk_size, dtype=np.int16)
+        self.rewards = np.zeros(self.chunk_size, dtype=np.float32)
+        self.dones = np.zeros(self.chunk_size, dtype=bool)
+        self.resets = np.zeros(self.chunk_size, dtype=bool)
+
+    def log(self, obs, action=NO_ACTION, reward=0, done=False, reset=False):
+        i = self.idx
+        self.obs[i] = obs
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.dones[i] = done
+        self.resets[i] = reset
+        self.idx += 1
+        if self.idx == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.idx == 0:
+            return
+        n = self.idx
+        np.savez(self.log_dir / f"chunk_{self.chunk_idx:05d}.npz", obs=self.obs[:n], actions=self.actions[:n],
+                 rewards=self.rewards[:n], dones=self.dones[:n], resets=self.resets[:n])
+        self.chunk_idx += 1
+        self.idx = 0
+
+
+class _LoggedObject():
+    # stands in for the OCAtari slot objects Focus is built from
+    def __init__(self, category, ns_meaning, ns_types):
+        self.category = category
+        self._ns_meaning = ns_meaning
+        unknown = [t for t in ns_types if t not in NS_TYPES]
+        if unknown:
+            raise ValueError(f"unsupported ns_repr types in layout of {category}: {unknown}")
+        self._ns_types = [NS_TYPES[t] for t in ns_types]
+
+
+def load_layout(log_dir):
+    with open(Path(log_dir) / LAYOUT_FILE, "r") as f:
+        return json.load(f)
+
+
+def make_offline_focus(layout, focus_dir, focus_file, reward=0, hide_properties=False, silent=True):
+    from scobi.focus import Focus
+    objects = [_LoggedObject(k, **v) for k, v in layout["objects"].items()]
+    return Focus(layout["env_name"], reward, hide_properties, focus_dir, focus_file, objects,
+                 layout["max_objects_per_cat"], layout["actions"], False, Logger(silent=silent))
+
+
+def _recompute_chunks(args):
+    log_dir, chunk_files, out_dir, focus_dir, focus_file, reward, hide_properties = args
+    focus = make_offline_focus(load_layout(log_dir), focus_dir, focus_file, reward, hide_properties)
+    # frame by frame, Focus keeps state between steps (position history, reward shaping)
+    for chunk_file in chunk_files:
+        data = np.load(chunk_file)
+        obs, resets = data["obs"], data["resets"]
+        shaped_rewards = np.zeros(len(obs), dtype=np.float32)
+        rows = []
+        for i in range(len(obs)):
+            if resets[i]: # mirror Environment.reset()
+                focus.reward_threshold = -1
+                focus.reward_history = [0, 0]
+            fv, shaped_rewards[i] = focus.get_feature_vector(obs[i])
+            rows.append(fv)
+        features = np.asarray(rows, dtype=np.float32)
+        np.savez(Path(out_dir) / Path(chunk_file).name, features=features, shaped_rewards=shaped_rewards,
+                 actions=data["actions"], rewards=data["rewards"], dones=data["dones"], resets=resets)
+    return len(chunk_files)
+
+
+def recompute_features(log_root, out_root, focus_dir, focus_file=None, reward=0, hide_properties=False, workers=None):
+    """
+    applies the Focus pipeline of a focus file to every raw ns_repr log below log_root and writes
+    features (+ shaped rewards, if reward != 0) with the same chunk layout below out_root.
+    the frames of a chunk go through Focus one by one, the parallelism is across chunks:
+    without reward shaping every chunk is independent and processed in parallel, with reward shaping
+    the chunks of one env are processed in order by the same worker.
+    """
+    log_root, out_root = Path(log_root), Path(out_root)
+    log_dirs = sorted(p.parent for p in log_root.rglob(LAYOUT_FILE))
+    jobs = []
+    for log_dir in log_dirs:
+        out_dir = out_root / log_dir.relative_to(log_root)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        chunks = sorted(log_dir.glob("chunk_*.npz"))
+        if reward != 0:
+            jobs.append((log_dir, chunks, out_dir, focus_dir, focus_file, reward, hide_properties))
+        else:
+            jobs += [(log_dir, [c], out_dir, focus_dir, focus_file, reward, hide_properties) for c in chunks]
+    with Pool(workers) as pool:
+        done = sum(pool.imap_unordered(_recompute_chunks, jobs))
+    return done
@@ -0,0 +1,46 @@
+# running mean/variance of feature vectors, mergeable across envs (parallel variance algorithm,
+# same update rule as the RunningMeanStd of stable-baselines3's VecNormalize)
+import numpy as np
+
+
+class RunningStats():
+    def __init__(self, shape, epsilon=1e-4):
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.var = np.ones(shape, dtype=np.float64)
+        self.count = epsilon
+
+    def update(self, x):
+        x = np.asarray(x, dtype=np.float64).reshape(-1, *self.mean.shape)
+        self.update_from_moments(x.mean(axis=0), x.var(axis=0), x.shape[0])
+
+    def update_from_moments(self, batch_mean, batch_var, batch_count):
+        if batch_count == 0:
+            return
+        if self.count == 0:
+            self.mean, self.var, self.count = np.array(batch_mean, dtype=np.float64), np.array(batch_var, dtype=np.float64), batch_count
+            return
+        delta = batch_mean - self.mean
+        total_count = self.count + batch_count
+        m2 = self.var * self.count + batch_var * batch_count + np.square(delta) * self.count * batch_count / total_count
+        self.mean = self.mean + delta * batch_count / total_count
+        self.var = m2 / total_count
+        self.count = total_count
+
+    def merge(self, other):
+        self.update_from_moments(other.mean, other.var, other.count)
+
+    def copy(self):
+        stats = RunningStats(self.mean.shape, self.count)
+        stats.mean, stats.var = self.mean.copy(), self.var.copy()
+        return stats
+
+    def save(self, fpath):
+        with open(fpath, "wb") as f:
+            np.savez(f, mean=self.mean, var=self.var, count=self.count)
+
+    @staticmethod
+    def load(fpath):
+        data = np.load(fpath)
+        stats = RunningStats(data["mean"].shape, float(data["count"]))
+        stats.mean, stats.var = data["mean"], data["var"]
+        return stats
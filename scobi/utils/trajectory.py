@@ -0,0 +1,92 @@
+# compact episode recordings: seed + action sequence (+ optional state keyframes)
+# frames, objects and feature vectors are regenerated on demand by replaying them in a fresh env
+import pickle
+from copy import deepcopy
+import numpy as np
+
+RESET_EVENT = -1
+NO_SEED = -1
+
+
+class TrajectoryRecorder():
+    def __init__(self, env, keyframe_interval=0):
+        self.env = env
+        self.keyframe_interval = keyframe_interval
+        self.events = [] # action index per step, RESET_EVENT for resets
+        self.reset_seeds = []
+        self.steps = 0
+        # replay always starts from this snapshot, so recordings may start at any point of a run
+        self.keyframe_events = [0]
+        self.keyframe_steps = [0]
+        self.keyframes = [env._snapshot(include_pool=True)]
+
+    def record_reset(self, seed):
+        self.events.append(RESET_EVENT)
+        self.reset_seeds.append(NO_SEED if seed is None else seed)
+
+    def record_step(self, action):
+        if self.keyframe_interval and self.steps and self.steps % self.keyframe_interval == 0:
+            self.keyframe_events.append(len(self.events))
+            self.keyframe_steps.append(self.steps)
+            self.keyframes.append(self.env._snapshot())
+        self.events.append(int(action))
+        self.steps += 1
+
+    def save(self, fpath):
+        offsets = np.cumsum([0] + [len(k) for k in self.keyframes])
+        with open(fpath, "wb") as f:
+            np.savez_compressed(f,
+                                env_config=np.frombuffer(pickle.dumps(self.env.get_config()), dtype=np.uint8),
+                                events=np.asarray(self.events, dtype=np.int16),
+                                reset_seeds=np.asarray(self.reset_seeds, dtype=np.int64),
+                                keyframe_events=np.asarray(self.keyframe_events, dtype=np.int64),
+                                keyframe_steps=np.asarray(self.keyframe_steps, dtype=np.int64),
+                                keyframe_offsets=offsets.astype(np.int64),
+                                keyframe_blob=np.frombuffer(b"".join(self.keyframes), dtype=np.uint8))
+
+
+class TrajectoryReplayer():
+    def __init__(self, fpath, focus_dir="resources/focusfiles", silent=True):
+        from scobi.core import Environment
+        data = np.load(fpath)
+        self.env_config = pickle.loads(data["env_config"].tobytes())
+        self.events = data["events"]
+        self.reset_seeds = data["reset_seeds"]
+        self.keyframe_events = data["keyframe_events"]
+        self.keyframe_steps = data["keyframe_steps"]
+        offsets = data["keyframe_offsets"]
+        blob = data["keyframe_blob"].tobytes()
+        self.keyframes = [blob[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+        self.env = Environment(focus_dir=focus_dir, silent=silent, refresh_yaml=False, **self.env_config)
+        self.step_events = np.where(self.events != RESET_EVENT)[0]
+
+    def __len__(self):
+        return len(self.step_events)
+
+    def replay(self, start=0, stop=None):
+        """
+        yields (frame, objects, feature_vector) after each recorded step in [start, stop).
+        seeks to the closest keyframe before start and silently replays the remaining steps.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return
+        kf = np.searchsorted(self.keyframe_steps, start, side="right") - 1
+        self.env._restore_snapshot(self.keyframes[kf])
+        step = self.keyframe_steps[kf]
+        reset_idx = np.count_nonzero(self.events[:self.keyframe_events[kf]] == RESET_EVENT)
+        for event in self.events[self.keyframe_events[kf]:]:
+            if event == RESET_EVENT:
+                seed = self.reset_seeds[reset_idx]
+                reset_idx += 1
+                self.env.reset(seed=None if seed == NO_SEED else int(seed))
+                continue
+            sco_obs, _, _, _, _ = self.env.step(int(event))
+            if step >= start:
+                yield self.env.oc_env.getScreenRGB(), deepcopy(self.env.oc_env.objects), sco_obs
+            step += 1
+            if step >= stop:
+                return
+
+    def close(self):
+        self.env.close()
@@ -0,0 +1,322 @@
+"""
+scobi micro benchmarks. run from the repository root, e.g.:
+    python -m scripts.benchmark reset -g Pong Kangaroo --pool 16
+    python -m scripts.benchmark precision -g Seaquest
+    python -m scripts.benchmark rgb -g Pong Skiing
+    python -m scripts.benchmark modes --steps 1000
+    python -m scripts.benchmark placement -g Pong Seaquest -env 16
+results are printed and written as json to resources/benchmarks/<benchmark>.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+from scobi import Environment
+from scobi.focus import OBS_DTYPES, OBS_BOUND
+
+PAPER_GAMES = ["Asterix", "Bowling", "Boxing", "Freeway", "Kangaroo", "Pong", "Seaquest", "Skiing", "Tennis"]
+BENCHMARK_DIR = Path("resources/benchmarks")
+FOCUS_DIR = "resources/focusfiles"
+
+
+def _env_str(game):
+    return "ALE/" + game + "-v5"
+
+
+def _save_report(name, report):
+    BENCHMARK_DIR.mkdir(parents=True, exist_ok=True)
+    out_path = BENCHMARK_DIR / f"{name}.json"
+    with open(out_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved to {out_path}")
+
+
+def _rollout(env, actions, seed):
+    # fixed action sequence, resetting unseeded on episode end like Monitor/EpisodicLifeEnv do
+    obs, _ = env.reset(seed=seed)
+    trace = [obs]
+    for a in actions:
+        obs, _, truncated, terminated, _ = env.step(int(a))
+        trace.append(obs)
+        if truncated or terminated:
+            obs, _ = env.reset()
+            trace.append(obs)
+    return np.asarray(trace)
+
+
+def bench_reset(opts):
+    report = {}
+    for game in opts.games:
+        report[game] = {}
+        actions = np.random.RandomState(opts.seed).randint(0, 3, size=opts.steps)
+        for pool in [0, opts.pool]:
+            env = Environment(_env_str(game), seed=opts.seed, focus_dir=FOCUS_DIR, silent=True, refresh_yaml=False, reset_pool=pool)
+            env.reset(seed=opts.seed)
+            start = time.perf_counter()
+            for _ in range(opts.resets):
+                env.reset()
+            latency = (time.perf_counter() - start) / opts.resets
+            trace_a = _rollout(env, actions, opts.seed)
+            trace_b = _rollout(env, actions, opts.seed)
+            env.close()
+            twin = Environment(_env_str(game), seed=opts.seed, focus_dir=FOCUS_DIR, silent=True, refresh_yaml=False, reset_pool=pool)
+            trace_c = _rollout(twin, actions, opts.seed)
+            twin.close()
+            key = "pool" if pool else "default"
+            report[game][key] = {
+                "pool_size": pool,
+                "reset_latency_ms": latency * 1000,
+                "deterministic_same_env": bool(np.array_equal(trace_a, trace_b)),
+                "deterministic_fresh_env": bool(np.array_equal(trace_a, trace_c)),
+            }
+        default, pooled = report[game]["default"], report[game]["pool"]
+        print(f"{game:10s} reset default {default['reset_latency_ms']:7.3f} ms | pool {pooled['reset_latency_ms']:7.3f} ms"
+              f" | speedup {default['reset_latency_ms'] / pooled['reset_latency_ms']:5.1f}x"
+              f" | deterministic {pooled['deterministic_same_env'] and pooled['deterministic_fresh_env']}")
+    _save_report("reset_pool", report)
+
+
+def bench_precision(opts):
+    # memory of the observations an agent sees over a rollout, per dtype, on the default focus files
+    report = {}
+    for game in opts.games:
+        report[game] = {}
+        actions = np.random.RandomState(opts.seed).randint(0, 3, size=opts.steps)
+        reference = None
+        for dtype in OBS_DTYPES:
+            env = Environment(_env_str(game), seed=opts.seed, focus_dir=FOCUS_DIR, silent=True, refresh_yaml=False, obs_dtype=dtype)
+            trace = _rollout(env, actions, opts.seed)
+            # int16 function features are fixed point, compared in pixels
+            values = trace / env.focus.OBS_SCALE if env.focus.OBS_SCALE is not None else trace.astype(np.float64)
+            env.close()
+            if reference is None:
+                reference = values
+                in_bounds = np.abs(reference) <= OBS_BOUND
+            # entries beyond the bounds are clipped on purpose, so the error is measured on the others
+            report[game][dtype] = {
+                "observation_size": trace.shape[1],
+                "bytes_per_obs": trace[0].nbytes,
+                "rollout_mb": trace.nbytes / 2**20,
+                "max_abs_error": float(np.max(np.abs(values - reference)[in_bounds])),
+                "clipped_fraction": float(1 - np.mean(in_bounds)) if dtype != "float32" else 0.0,
+            }
+        base = report[game]["float32"]["rollout_mb"]
+        print(f"{game:10s} obs size {report[game]['float32']['observation_size']:5d} | "
+              + " | ".join(f"{d} {report[game][d]['rollout_mb']:7.2f} MB ({base / report[game][d]['rollout_mb']:.1f}x, "
+                           f"max err {report[game][d]['max_abs_error']:.3f}, clipped {report[game][d]['clipped_fraction']:.2%})"
+                           for d in OBS_DTYPES))
+    _save_report("precision", report)
+
+
+def bench_rgb(opts):
+    # step rate with and without screen capture, features are the same either way
+    report = {}
+    for game in opts.games:
+        report[game] = {}
+        actions = np.random.RandomState(opts.seed).randint(0, 3, size=opts.steps)
+        traces = {}
+        for capture in [True, False]:
+            env = Environment(_env_str(game), seed=opts.seed, focus_dir=FOCUS_DIR, silent=True, refresh_yaml=False, capture_rgb=capture)
+            start = time.perf_counter()
+            traces[capture] = _rollout(env, actions, opts.seed)
+            elapsed = time.perf_counter() - start
+            # the emulator + object extraction part alone, without the feature pass
+            env.oc_env.reset(seed=opts.seed)
+            start = time.perf_counter()
+            for a in actions:
+                _, _, truncated, terminated, _ = env.oc_env.step(int(a))
+                if truncated or terminated:
+                    env.oc_env.reset()
+            oc_elapsed = time.perf_counter() - start
+            env.close()
+            report[game]["capture" if capture else "no_capture"] = {"steps_per_second": opts.steps / elapsed,
+                                                                     "ocatari_steps_per_second": opts.steps / oc_elapsed}
+        report[game]["identical_features"] = bool(np.array_equal(traces[True], traces[False]))
+        on, off = report[game]["capture"], report[game]["no_capture"]
+        print(f"{game:10s} env steps/s {on['steps_per_second']:8.1f} -> {off['steps_per_second']:8.1f}"
+              f" ({off['steps_per_second'] / on['steps_per_second']:4.2f}x) | ocatari only {on['ocatari_steps_per_second']:8.1f}"
+              f" -> {off['ocatari_steps_per_second']:8.1f} ({off['ocatari_steps_per_second'] / on['ocatari_steps_per_second']:4.2f}x)"
+              f" | identical features {report[game]['identical_features']}")
+    _save_report("rgb_capture", report)
+
+
+MODES = ["ram", "vision", "both"]
+
+
+def _run_mode(args):
+    # runs in a fresh worker process, so peak memory belongs to this configuration only
+    game, mode, hud, steps, seed = args
+    try:
+        focus_dir = str(Path(FOCUS_DIR, mode, "hud" if hud else "no_hud")) # default focus files differ by mode and hud
+        start = time.perf_counter()
+        env = Environment(_env_str(game), seed=seed, focus_dir=focus_dir, silent=True, refresh_yaml=False, hud=hud, mode=mode)
+        init_time = time.perf_counter() - start
+        actions = np.random.RandomState(seed).randint(0, env.action_space.n, size=steps)
+        env.reset(seed=seed)
+        ns_obs = []
+        step_time = 0
+        for a in actions:
+            start = time.perf_counter()
+            _, _, truncated, terminated, _ = env.step(int(a))
+            step_time += time.perf_counter() - start
+            ns_obs.append(np.array(env.oc_env._state_buffer_ns))
+            if truncated or terminated:
+                env.reset()
+        # feature pass alone, on the recorded ns_repr buffers
+        start = time.perf_counter()
+        for obs in ns_obs:
+            env.focus.get_feature_vector(obs)
+        feature_time = time.perf_counter() - start
+        result = {
+            "viable": True,
+            "init_s": init_time,
+            "steps_per_second": steps / step_time,
+            "feature_ms": feature_time / steps * 1000,
+            "extraction_ms": max(step_time - feature_time, 0) / steps * 1000,
+            "observation_size": int(env.observation_space.shape[0]),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+        env.close()
+    except BaseException as e: # Logger.GeneralError exits
+        result = {"viable": False, "error": f"{type(e).__name__}: {e}"}
+    return game, mode, hud, result
+
+
+def bench_modes(opts):
+    configs = [(game, mode, hud, opts.steps, opts.seed) for game in opts.games for mode in opts.modes for hud in [False, True]]
+    for mode in opts.modes:
+        for hud in ["hud", "no_hud"]:
+            Path(FOCUS_DIR, mode, hud).mkdir(parents=True, exist_ok=True)
+    report = {game: {mode: {} for mode in opts.modes} for game in opts.games}
+    for config in configs:
+        with Pool(1) as pool:
+            game, mode, hud, result = pool.apply(_run_mode, (config,))
+        report[game][mode]["hud" if hud else "no_hud"] = result
+        if result["viable"]:
+            print(f"{game:10s} {mode:6s} hud={hud!s:5s} {result['steps_per_second']:8.1f} steps/s | features {result['feature_ms']:6.3f} ms"
+                  f" | extraction {result['extraction_ms']:6.3f} ms | obs {result['observation_size']:6d} | peak rss {result['peak_rss_mb']:7.1f} MB")
+        else:
+            print(f"{game:10s} {mode:6s} hud={hud!s:5s} not viable: {result['error']}")
+    for game in opts.games:
+        viable = [(r["steps_per_second"], mode, hud) for mode, runs in report[game].items() for hud, r in runs.items() if r["viable"]]
+        if viable:
+            _, mode, hud = max(viable)
+            report[game]["fastest"] = {"mode": mode, "hud": hud == "hud"}
+    _save_report("modes", report)
+
+
+def _run_placement(game, pin, n_envs, learner_cores, timesteps, seed, results):
+    # ppo training throughput of train.py's object-centric setup, in a fresh process per configuration
+    try:
+        import torch as th
+        from stable_baselines3 import PPO
+        from stable_baselines3.common.atari_wrappers import EpisodicLifeEnv
+        from stable_baselines3.common.monitor import Monitor
+        from stable_baselines3.common.vec_env import SubprocVecEnv, VecNormalize
+        from utils.placement import format_layout, pin_learner, pinned, plan_placement
+
+        def make_env(rank):
+            def _init():
+                env = Environment(_env_str(game), seed=seed + rank, focus_dir=FOCUS_DIR, silent=True, refresh_yaml=False)
+                return Monitor(EpisodicLifeEnv(env=env))
+            return _init
+
+        plan = plan_placement(n_envs, 0, learner_cores) if pin else None
+        env_fns = [pinned(make_env(i), [plan["train"][i]]) if pin else make_env(i) for i in range(n_envs)]
+        env = VecNormalize(SubprocVecEnv(env_fns, start_method="fork"), norm_reward=False)
+        if pin:
+            pin_learner(plan["learner"])
+        model = PPO("MlpPolicy", env, n_steps=2048, n_epochs=3, batch_size=256, learning_rate=0.001, clip_range=0.1, vf_coef=1,
+                    ent_coef=0.01, policy_kwargs=dict(activation_fn=th.nn.ReLU, net_arch=dict(pi=[64, 64], vf=[64, 64])), seed=seed)
+        start = time.perf_counter()
+        model.learn(total_timesteps=timesteps)
+        elapsed = time.perf_counter() - start
+        env.close()
+        result = {"timesteps_per_second": model.num_timesteps / elapsed, "torch_threads": th.get_num_threads(),
+                  "layout": format_layout(plan) if pin else "default"}
+    except BaseException as e: # Logger.GeneralError exits
+        result = {"error": f"{type(e).__name__}: {e}"}
+    results.put(result)
+
+
+def bench_placement(opts):
+    # default placement vs. pinned workers + reserved learner cores, one fresh process each
+    ctx = mp.get_context("fork")
+    report = {"usable_cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()}
+    timesteps = opts.rollouts * 2048 * opts.environments
+    for game in opts.games:
+        Environment(_env_str(game), seed=opts.seed, focus_dir=FOCUS_DIR, silent=True).close() # default focus file
+        report[game] = {}
+        for pin in [False, True]:
+            results = ctx.Queue()
+            # not a Pool worker, those may not start the env subprocesses
+            process = ctx.Process(target=_run_placement, args=(game, pin, opts.environments, opts.learner_cores, timesteps, opts.seed, results))
+            process.start()
+            result = results.get()
+            process.join()
+            report[game]["pinned" if pin else "default"] = result
+            if "error" in result:
+                print(f"{game:10s} {'pinned' if pin else 'default'} failed: {result['error']}")
+            elif pin:
+                print(result["layout"])
+        default, pinned = report[game]["default"], report[game]["pinned"]
+        if "error" not in default and "error" not in pinned:
+            print(f"{game:10s} {opts.environments} envs | default {default['timesteps_per_second']:8.1f} steps/s ({default['torch_threads']} torch threads)"
+                  f" | pinned {pinned['timesteps_per_second']:8.1f} steps/s ({pinned['torch_threads']} torch threads)"
+                  f" | speedup {pinned['timesteps_per_second'] / default['timesteps_per_second']:4.2f}x")
+    _save_report("placement", report)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    reset_parser = subparsers.add_parser("reset", help="reset latency and seeding determinism with and without a reset pool")
+    reset_parser.add_argument("-g", "--games", nargs="+", default=PAPER_GAMES, help="games to benchmark")
+    reset_parser.add_argument("--pool", type=int, default=16, help="reset pool size to compare against the default path")
+    reset_parser.add_argument("--resets", type=int, default=100, help="number of timed resets")
+    reset_parser.add_argument("--steps", type=int, default=2000, help="steps of the determinism rollout")
+    reset_parser.add_argument("-s", "--seed", type=int, default=0, help="seed")
+    reset_parser.set_defaults(func=bench_reset)
+
+    precision_parser = subparsers.add_parser("precision", help="rollout memory and accuracy of the reduced-precision observation modes")
+    precision_parser.add_argument("-g", "--games", nargs="+", default=["Asterix", "Kangaroo", "Seaquest"], help="games to benchmark (large default focus files)")
+    precision_parser.add_argument("--steps", type=int, default=5000, help="rollout length")
+    precision_parser.add_argument("-s", "--seed", type=int, default=0, help="seed")
+    precision_parser.set_defaults(func=bench_precision)
+
+    rgb_parser = subparsers.add_parser("rgb", help="step rate with and without rgb frame capture")
+    rgb_parser.add_argument("-g", "--games", nargs="+", default=PAPER_GAMES, help="games to benchmark")
+    rgb_parser.add_argument("--steps", type=int, default=5000, help="steps per rollout")
+    rgb_parser.add_argument("-s", "--seed", type=int, default=0, help="seed")
+    rgb_parser.set_defaults(func=bench_rgb)
+
+    modes_parser = subparsers.add_parser("modes", help="step rate, feature time and memory per object extraction mode, with and without HUD")
+    modes_parser.add_argument("-g", "--games", nargs="+", default=PAPER_GAMES, help="games to benchmark")
+    modes_parser.add_argument("-m", "--modes", nargs="+", default=MODES, choices=MODES, help="extraction modes to benchmark")
+    modes_parser.add_argument("--steps", type=int, default=2000, help="steps per configuration")
+    modes_parser.add_argument("-s", "--seed", type=int, default=0, help="seed")
+    modes_parser.set_defaults(func=bench_modes)
+
+    placement_parser = subparsers.add_parser("placement", help="ppo training throughput with default placement vs. pinned env workers and learner cores (Linux)")
+    placement_parser.add_argument("-g", "--games", nargs="+", default=["Pong", "Seaquest"], help="games to benchmark")
+    placement_parser.add_argument("-env", "--environments", type=int, default=max(os.cpu_count() - 2, 1), help="training envs (default: all cores but two)")
+    placement_parser.add_argument("--learner-cores", type=int, default=2, help="cores reserved for the learner when pinned")
+    placement_parser.add_argument("--rollouts", type=int, default=2, help="ppo rollouts (2048 steps per env) per configuration")
+    placement_parser.add_argument("-s", "--seed", type=int, default=0, help="seed")
+    placement_parser.set_defaults(func=bench_placement)
+
+    opts = parser.parse_args()
+    Path(FOCUS_DIR).mkdir(parents=True, exist_ok=True)
+    opts.func(opts)
+
+
+if __name__ == "__main__":
+    main()
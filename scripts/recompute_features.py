@@ -0,0 +1,33 @@
+"""
+applies a focus file to raw ns_repr logs (recorded with Environment(ns_log_dir=...) or train.py --ns-log)
+without running the emulator or the policy. run from the repository root, e.g.:
+    python -m scripts.recompute_features -i resources/ns_logs/Pong_seed0_reward-env_oc -f resources/focusfiles -p pruned_pong.yaml
+"""
+import argparse
+import time
+from pathlib import Path
+
+from scobi.utils.ns_log import recompute_features
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", type=str, required=True, help="ns_repr log directory (searched recursively for env logs)")
+    parser.add_argument("-o", "--output", type=str, required=False, help="output directory, '<input>-features' if omitted")
+    parser.add_argument("-f", "--focus_dir", type=str, default="resources/focusfiles", help="focus file directory")
+    parser.add_argument("-p", "--focus_file", type=str, required=False, help="focus file to apply, default focus file if omitted")
+    parser.add_argument("-r", "--reward", type=str, required=False, choices=["env", "human", "mixed"], help="also recompute shaped rewards")
+    parser.add_argument("-x", "--exclude_properties", action="store_true", help="exclude properties from feature vector")
+    parser.add_argument("-w", "--workers", type=int, required=False, help="number of worker processes, all cores if omitted")
+    opts = parser.parse_args()
+
+    reward_mode = {"human": 1, "mixed": 2}.get(opts.reward, 0)
+    output = opts.output or opts.input.rstrip("/") + "-features"
+    Path(opts.focus_dir).mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    n_chunks = recompute_features(opts.input, output, opts.focus_dir, opts.focus_file, reward_mode, opts.exclude_properties, opts.workers)
+    print(f"Recomputed {n_chunks} chunks in {time.perf_counter() - start:.2f}s. Saved under {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,63 @@
-import subprocess
-import os
+"""
+trains all paper agents and extracts their viper trees on the local cores. run from the repository root:
+    python -m scripts.run_all_experiments_ns --cores 32
+the queue lives in resources/scheduler, running the command again after a restart continues it
+(interrupted trainings resume from their newest checkpoint). job logs: resources/scheduler/logs
+"""
+import argparse
+
+from utils.scheduler import Scheduler
 
 seeds = [0, 1, 2]
 experiments = ["Asterix", "Bowling", "Boxing", "Freeway", "Kangaroo", "Pong", "Seaquest", "Skiing", "Tennis"]
 
-# Goal: three running processes (one for each seed, each with different GPU)
 
-def build_train_command(game, seed):
-    reward = "human" if game in ["Skiing", "Kangaroo", "Pong"] else "env"
+def _reward(game):
+    return "human" if game in ["Skiing", "Kangaroo", "Pong"] else "env"
+
+
+def build_train_command(game, seed, n_envs):
     hud = game in ["Kangaroo", "Seaquest"]
-    # command = f"python run_experiment.py -g {game} -s {seed} -env 8 -r {reward} --progress -p default"
-    dev = 11 - seed
-    command= ["uv", "run", "train.py", "-g", game, "-s", str(seed), "-env", "8", "-r", reward, "--progress", "-p", "default"]
+    command = ["uv", "run", "train.py", "-g", game, "-s", str(seed), "-env", str(n_envs), "-r", _reward(game), "-p", "default"]
     if hud:
         command += ["--hud"]
-    command_dev = (command, dev)
-    return command_dev
+    return command
 
-def build_viper_command(game, seed):
-    reward = "human" if game in ["Skiing", "Kangaroo", "Pong"] else "env"
-    dev = 11 - seed
-    game_string = game + "_seed" + str(seed) + "_reward-" + reward + "_oc_pruned" 
-    command= ["uv", "run", "viper_extract.py", "-i", game_string, "-r", "viper"]
-    command_dev = (command, dev)
-    return command_dev
-
-
-# Function to execute a single command
-def run_command(command_dev):
-    process_id = os.getpid()  # Get the current process ID
-    command = command_dev[0]
-    device = command_dev[1]
-    print(f"Executor PID: {process_id}, device: {device}, command: {command}")
-    try:
-        env = os.environ.copy()
-        env["CUDA_VISIBLE_DEVICES"] = str(device)
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
-        stdout, stderr = process.communicate()  # Wait for the process to finish
-        if process.returncode == 0:
-            return f"Executor PID: {process_id}, Output: {stdout.strip()}, Errors: {stderr.strip()}"
-        else:
-            return f"Executor PID: {process_id}, Command failed with return code {process.returncode}, Errors: {stderr.strip()}"
-    except Exception as e:
-        return f"Executor PID: {process_id}, Command failed with error: {str(e)}"
-
-# Start three separate processes, each working through its assigned commands
-if __name__ == "__main__":
-    command_devs = []
-    devices = []
-    for e in experiments:
-        for s in seeds:
-            command_dev = build_viper_command(e, s)
-            command_devs.append(command_dev)
 
-    from concurrent.futures import ProcessPoolExecutor
+def build_viper_command(game, seed):
+    game_string = game + "_seed" + str(seed) + "_reward-" + _reward(game) + "_oc_pruned"
+    return ["uv", "run", "viper_extract.py", "-i", game_string, "-r", "viper"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--games", nargs="+", default=experiments, help="games to run")
+    parser.add_argument("-s", "--seeds", nargs="+", type=int, default=seeds, help="seeds to run")
+    parser.add_argument("--jobs", nargs="+", default=["train", "viper"], choices=["train", "viper"], help="job types to queue, viper jobs wait for their training")
+    parser.add_argument("-env", "--environments", type=int, default=8, help="training envs per train job")
+    parser.add_argument("--cores", type=int, default=None, help="core budget (default: all cores)")
+    parser.add_argument("--queue-dir", type=str, default="resources/scheduler", help="queue and log directory")
+    parser.add_argument("--retry", action="store_true", help="queue failed and skipped jobs again")
+    parser.add_argument("--status", action="store_true", help="print the queue and exit")
+    opts = parser.parse_args()
+
+    scheduler = Scheduler(opts.queue_dir, cores=opts.cores)
+    if opts.status:
+        scheduler.status()
+        return
+    if opts.retry:
+        scheduler.retry()
+    for game in opts.games:
+        for seed in opts.seeds:
+            train_id = f"train_{game}_seed{seed}"
+            if "train" in opts.jobs:
+                scheduler.add(train_id, build_train_command(game, seed, opts.environments))
+            if "viper" in opts.jobs:
+                after = [train_id] if "train" in opts.jobs else []
+                scheduler.add(f"viper_{game}_seed{seed}", build_viper_command(game, seed), after=after)
+    scheduler.run()
+    scheduler.status()
 
-    with ProcessPoolExecutor(max_workers=3) as executor:
-        results = list(executor.map(run_command, command_devs))
 
-    # Print results
-    for i, result in enumerate(results):
-        print(f"Command {i + 1}: {result}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import multiprocessing
+import socket
+import threading
+from pathlib import Path
+
+import numpy as np
+import torch as th
+from stable_baselines3 import PPO
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.logger import configure
+
+from scobi import Environment
+from utils.distributed import ActorServer, RemoteActorsVecEnv, learn, run_actor
+
+N_STEPS, N_ENVS_PER_ACTOR, N_ACTORS = 16, 1, 2
+AUTHKEY = b"test key"
+
+
+class _RolloutCheck(BaseCallback):
+    """values the actors sent against the learner's policy, which they should have got before the rollout"""
+    def __init__(self):
+        super().__init__()
+        self.value_errors = []
+        self.first_weights = None
+
+    def _on_rollout_end(self) -> None:
+        buffer = self.model.rollout_buffer
+        with th.no_grad():
+            values = self.model.policy.predict_values(th.as_tensor(buffer.observations.reshape(-1, *buffer.obs_shape)))
+        self.value_errors.append(float(np.abs(values.numpy().reshape(buffer.values.shape) - buffer.values).max()))
+        if self.first_weights is None:
+            self.first_weights = {k: v.clone() for k, v in self.model.policy.state_dict().items()}
+
+    def _on_step(self) -> bool:
+        return True
+
+
+def _unauthenticated_peer(sock, result):
+    # a wrong answer to the challenge, the learner closes the connection without unpickling anything
+    with sock:
+        sock.recv(64)
+        sock.sendall(b"\x00" * 64)
+        result.append(sock.recv(64))
+
+
+def test_learner_and_two_actors_on_localhost(tmp_path):
+    env_kwargs = dict(env_name="ALE/Pong-v5", focus_file=None, hide_properties=False, reward=0, hud=False, mode="ram",
+                      reset_pool=0, obs_dtype="float32", noisy_objects=None, noise_std=3.0, noise_error_rate=0.05, focus_rules=None)
+    env = Environment(seed=0, focus_dir=str(tmp_path), normalize=True, silent=True, **env_kwargs)
+    observation_space, action_space = env.observation_space, env.action_space
+    focus_file = Path(env.focus_file)
+    env.close()
+    env_kwargs["focus_file"] = focus_file.name
+
+    server = ActorServer("127.0.0.1", 0, AUTHKEY)
+    rejected = []
+    # connects before the actors, so it is accepted first
+    intruder = threading.Thread(target=_unauthenticated_peer, args=(socket.create_connection(("127.0.0.1", server.port)), rejected))
+    intruder.start()
+    ctx = multiprocessing.get_context("fork")
+    actors = [ctx.Process(target=run_actor, args=("127.0.0.1", server.port, N_ENVS_PER_ACTOR, AUTHKEY), daemon=True)
+              for _ in range(N_ACTORS)]
+    try:
+        for p in actors:
+            p.start()
+        server.accept(N_ACTORS)
+        intruder.join(timeout=30)
+        assert rejected == [b""]
+        assert server.n_envs == [N_ENVS_PER_ACTOR] * N_ACTORS
+
+        n_envs = sum(server.n_envs)
+        model = PPO("MlpPolicy", RemoteActorsVecEnv(n_envs, observation_space, action_space), n_steps=N_STEPS,
+                    batch_size=N_STEPS * n_envs, n_epochs=1, learning_rate=1e-3, seed=0, device="cpu")
+        model.set_logger(configure(str(tmp_path / "log"), ["csv"]))
+        server.configure({"env_kwargs": env_kwargs, "focus_file_text": focus_file.read_text(), "seed": 0,
+                          "policy_class": model.policy_class, "policy_kwargs": model.policy_kwargs,
+                          "gamma": model.gamma, "n_steps": N_STEPS})
+        check = _RolloutCheck()
+        learn(model, server, 3 * N_STEPS * n_envs, [check])
+    finally:
+        server.close()
+        for p in actors:
+            p.join(timeout=60)
+
+    assert model.num_timesteps == 3 * N_STEPS * n_envs
+    assert all(p.exitcode == 0 for p in actors)
+    # segments of both actors arrived, with the weights after every update
+    assert len(check.value_errors) == 3
+    assert max(check.value_errors) < 1e-4
+    assert any(not th.equal(v, check.first_weights[k]) for k, v in model.policy.state_dict().items())
+    # one normalization delta per actor with the last segments
+    assert len(model.get_env().deltas) == N_ACTORS
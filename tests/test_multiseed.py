@@ -0,0 +1,61 @@
+import numpy as np
+import torch as th
+from stable_baselines3 import PPO
+from stable_baselines3.common.callbacks import CallbackList
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.logger import configure
+
+from utils.multiseed import MultiSeedPPO
+
+N_STEPS, N_ENVS = 32, 2
+
+
+def _model(seed, log_path):
+    # one minibatch of the whole rollout, so the update does not depend on the shuffle
+    model = PPO("MlpPolicy", make_vec_env("CartPole-v1", n_envs=N_ENVS, seed=seed), n_steps=N_STEPS,
+               batch_size=N_STEPS * N_ENVS, n_epochs=1, learning_rate=3e-4, ent_coef=0.01, vf_coef=1,
+               policy_kwargs=dict(activation_fn=th.nn.ReLU, net_arch=dict(pi=[16, 16], vf=[16, 16])),
+               seed=seed, device="cpu")
+    model.set_logger(configure(str(log_path), ["csv"]))
+    return model
+
+
+def test_one_update_matches_sb3_ppo(tmp_path):
+    seeds = [0, 1]
+    models = [_model(seed, tmp_path / f"multiseed{seed}") for seed in seeds]
+    references = [_model(seed, tmp_path / f"sb3{seed}") for seed in seeds]
+    for model, reference in zip(models, references):
+        for p, q in zip(model.policy.parameters(), reference.policy.parameters()):
+            assert th.equal(p, q)
+
+    trainer = MultiSeedPPO(models)
+    trainer.learn(N_STEPS * N_ENVS, [CallbackList([]) for _ in seeds])
+    assert trainer.num_timesteps == N_STEPS * N_ENVS
+
+    for k, (model, reference) in enumerate(zip(models, references)):
+        # the rollout of seed k, updated by stable-baselines3's PPO
+        buffer = reference.rollout_buffer
+        buffer.reset()
+        buffer.observations[:] = trainer.obs_buf[:, k]
+        buffer.actions[:] = trainer.actions_buf[:, k, :, None]
+        buffer.rewards[:] = trainer.rewards_buf[:, k]
+        buffer.episode_starts[:] = trainer.starts_buf[:, k]
+        buffer.values[:] = trainer.values_buf[:, k]
+        buffer.log_probs[:] = trainer.log_probs_buf[:, k]
+        buffer.full = True
+        with th.no_grad():
+            last_values = reference.policy.predict_values(th.as_tensor(trainer.last_obs[k]))
+        buffer.compute_returns_and_advantage(last_values, trainer.last_episode_starts[k])
+        np.testing.assert_allclose(buffer.advantages, trainer.advantages_buf[:, k], rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(buffer.returns, trainer.returns_buf[:, k], rtol=1e-5, atol=1e-5)
+        reference.train()
+
+        for p, q in zip(model.policy.parameters(), reference.policy.parameters()):
+            np.testing.assert_allclose(p.detach().numpy(), q.detach().numpy(), atol=1e-6)
+            # the exported Adam state, so a saved seed resumes with it
+            state, reference_state = model.policy.optimizer.state[p], reference.policy.optimizer.state[q]
+            assert float(state["step"]) == float(reference_state["step"]) == 1
+            np.testing.assert_allclose(state["exp_avg"].numpy(), reference_state["exp_avg"].numpy(), rtol=1e-4, atol=1e-7)
+            np.testing.assert_allclose(state["exp_avg_sq"].numpy(), reference_state["exp_avg_sq"].numpy(), rtol=1e-4, atol=1e-10)
+        for key in ["train/loss", "train/value_loss", "train/entropy_loss", "train/approx_kl"]:
+            assert np.isfinite(model.logger.name_to_value[key])
@@ -0,0 +1,38 @@
+import numpy as np
+from stable_baselines3 import PPO
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env import VecNormalize
+
+from scobi.utils.running_stats import RunningStats
+from utils.rollout_dataset import RolloutDataset, RolloutDatasetCallback, normalize_obs, unnormalize_obs
+
+
+def test_ring_buffer_keeps_newest_samples(tmp_path):
+    dataset = RolloutDataset(tmp_path, capacity=5, obs_shape=(2,))
+    for start in [0, 3]:
+        n = np.arange(start, start + 3)
+        dataset.append(start + 3, obs=np.stack([n, n], axis=1), actions=n, log_probs=n, values=n)
+    loaded = RolloutDataset(tmp_path).load()
+    assert loaded["actions"].tolist() == [1, 2, 3, 4, 5]
+    assert RolloutDataset(tmp_path).meta["timesteps"] == 6
+
+
+def test_scobi_normalization_round_trip():
+    stats = RunningStats((3,))
+    stats.update(np.random.default_rng(0).normal([10, -5, 100], [2, 0.5, 30], size=(100, 3)))
+    raw = np.array([[9.0, -5.5, 130.0], [12.0, -4.0, 70.0]], dtype=np.float32)
+    normalized = normalize_obs(raw, scobi_stats=stats)
+    np.testing.assert_allclose(unnormalize_obs(normalized, scobi_stats=stats), raw, rtol=1e-5)
+
+
+def test_callback_stores_unnormalized_observations(tmp_path):
+    env = VecNormalize(make_vec_env("CartPole-v1", n_envs=2, seed=0), norm_reward=False)
+    model = PPO("MlpPolicy", env, n_steps=32, batch_size=64, n_epochs=1, device="cpu", seed=0)
+    model.learn(32 * 2 * 3, callback=[RolloutDatasetCallback(str(tmp_path), 1000, start_timesteps=100)])
+    dataset = RolloutDataset(tmp_path)
+    assert len(dataset) == 32 * 2 * 2
+    assert dataset.meta["timesteps"] == model.num_timesteps
+    # the last rollout, normalized with the final stats, is what the policy was updated on
+    obs = np.asarray(dataset.load(64)["obs"])
+    buffer_obs = model.rollout_buffer.observations.reshape(2, 32, -1).swapaxes(0, 1).reshape(64, -1)
+    np.testing.assert_allclose(normalize_obs(obs, vec_normalize=env), buffer_obs, atol=1e-5)
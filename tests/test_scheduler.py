@@ -0,0 +1,94 @@
+import json
+import os
+import sys
+import time
+
+from utils.scheduler import DONE, FAILED, PENDING, RUNNING, SKIPPED, Scheduler, _pid_alive, _process_start_time
+
+
+def _python(code):
+    return [sys.executable, "-c", code]
+
+
+def _wait(scheduler, timeout=30):
+    deadline = time.time() + timeout
+    while scheduler.step():
+        assert time.time() < deadline, "scheduler did not finish"
+        time.sleep(0.05)
+
+
+def test_jobs_are_packed_onto_the_core_budget(tmp_path):
+    scheduler = Scheduler(tmp_path, cores=4, poll_interval=0.05)
+    for i in range(3):
+        scheduler.add(f"job{i}", _python("import time; time.sleep(1)"), cores=2)
+    scheduler.step()
+    assert [job["status"] for job in scheduler.jobs] == [RUNNING, RUNNING, PENDING]
+    assert scheduler.used_cores() == 4
+    _wait(scheduler)
+    assert all(job["status"] == DONE for job in scheduler.jobs)
+
+
+def test_job_larger_than_budget_runs_alone(tmp_path):
+    scheduler = Scheduler(tmp_path, cores=2, poll_interval=0.05)
+    scheduler.add("small", _python("import time; time.sleep(0.5)"), cores=1)
+    scheduler.add("large", _python("pass"), cores=8)
+    assert scheduler.jobs[1]["cores"] == 2
+    scheduler.step()
+    assert [job["status"] for job in scheduler.jobs] == [RUNNING, PENDING]
+    _wait(scheduler)
+    assert all(job["status"] == DONE for job in scheduler.jobs)
+
+
+def test_dependents_of_failed_job_are_skipped(tmp_path):
+    scheduler = Scheduler(tmp_path, cores=4, poll_interval=0.05)
+    scheduler.add("train", _python("import sys; sys.exit(3)"))
+    scheduler.add("eval", _python("pass"), after=["train"])
+    scheduler.add("viper", _python("pass"), after=["eval"])
+    _wait(scheduler)
+    statuses = {job["id"]: job["status"] for job in scheduler.jobs}
+    assert statuses == {"train": FAILED, "eval": SKIPPED, "viper": SKIPPED}
+    assert scheduler.jobs[0]["returncode"] == 3
+
+    scheduler.retry()
+    assert all(job["status"] == PENDING for job in scheduler.jobs)
+
+
+def test_restarted_scheduler_adopts_running_jobs(tmp_path):
+    first = Scheduler(tmp_path, cores=4)
+    first.add("ok", _python("import time; time.sleep(1)"))
+    first.add("crash", _python("import sys, time; time.sleep(1); sys.exit(5)"))
+    first.step()
+    del first
+
+    # a new scheduler does not know the processes, only the queue and the exit status files
+    second = Scheduler(tmp_path, cores=4, poll_interval=0.05)
+    assert second.processes == {}
+    assert all(job["status"] == RUNNING for job in second.jobs)
+    _wait(second)
+    statuses = {job["id"]: (job["status"], job["returncode"]) for job in second.jobs}
+    assert statuses == {"ok": (DONE, 0), "crash": (FAILED, 5)}
+
+
+def test_job_finished_while_scheduler_was_down(tmp_path):
+    first = Scheduler(tmp_path, cores=4)
+    first.add("crash", _python("import sys; sys.exit(2)"))
+    first.step()
+    first.processes["crash"].wait()
+    del first
+
+    second = Scheduler(tmp_path, cores=4, poll_interval=0.05)
+    _wait(second)
+    assert second.jobs[0]["status"] == FAILED
+    assert second.jobs[0]["returncode"] == 2
+
+
+def test_reused_pid_is_not_adopted(tmp_path):
+    # a running job whose pid now belongs to another process (this one, started at another time)
+    job = {"id": "train", "command": ["train.py", "-g", "Pong"], "cores": 5, "after": [], "status": RUNNING,
+           "pid": os.getpid(), "pid_start": _process_start_time(os.getpid()) - 1, "returncode": None,
+           "log": str(tmp_path / "logs" / "train.log"), "started": 0, "finished": None}
+    (tmp_path / "queue.json").write_text(json.dumps([job]))
+    assert _pid_alive(os.getpid())
+    scheduler = Scheduler(tmp_path, cores=8)
+    assert scheduler.jobs[0]["status"] == PENDING
+    assert scheduler.jobs[0]["command"][-1] == "--resume"
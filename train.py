@@ -11,27 +11,34 @@ import torch as th
 from rtpt import RTPT
 from stable_baselines3 import PPO
 from stable_baselines3.common.atari_wrappers import EpisodicLifeEnv, AtariWrapper
-from stable_baselines3.common.callbacks import CheckpointCallback, EveryNTimesteps, BaseCallback, CallbackList, \
-    EvalCallback
+from stable_baselines3.common.callbacks import EveryNTimesteps, BaseCallback, CallbackList, EvalCallback
 from stable_baselines3.common.env_checker import check_env
 from stable_baselines3.common.env_util import make_vec_env
 from stable_baselines3.common.logger import configure
 from stable_baselines3.common.monitor import Monitor
 from stable_baselines3.common.utils import set_random_seed
-from stable_baselines3.common.vec_env import SubprocVecEnv, VecNormalize, VecTransposeImage
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecNormalize, VecTransposeImage
 
 import utils.parser.parser
 from scobi import Environment
+from scobi.utils.running_stats import RunningStats
+from utils.async_eval import AsyncEvalCallback
+from utils.autotune import autotune_envs
+from utils.checkpointing import AsyncCheckpointCallback, CheckpointWriter, checkpoint_path, checkpoint_steps, latest_checkpoint, model_bytes, \
+    running_stats_bytes, save_env_config, vec_normalize_bytes
 from utils.model_card import ModelCard
+from utils.placement import format_layout, pin_learner, pin_processes, pinned, placement_supported, plan_placement
+from utils.rollout_dataset import RolloutDatasetCallback
 
 MULTIPROCESSING_START_METHOD = "spawn" if os.name == 'nt' else "fork"  # 'nt' == Windows
 
 class RtptCallback(BaseCallback):
-    def __init__(self, exp_name, max_iter, verbose=0):
+    def __init__(self, exp_name, max_iter, iteration_start=0, verbose=0):
         super(RtptCallback, self).__init__(verbose)
         self.rtpt = RTPT(name_initials="AA",
             experiment_name=exp_name,
-            max_iterations=max_iter)
+            max_iterations=max_iter,
+            iteration_start=iteration_start)
         self.rtpt.start()
 
     def _on_step(self) -> bool:
@@ -44,16 +51,16 @@ class TensorboardCallback(BaseCallback):
     Custom callback for plotting additional values in tensorboard.
     """
 
-    def __init__(self, n_envs, verbose=0):
-        self.n_envs = n_envs
+    def __init__(self, verbose=0):
         self.buffer = deque(maxlen=100) #ppo default stat window
         super().__init__(verbose)
 
     def _on_step(self) -> bool:
-        ep_rewards = self.training_env.get_attr("ep_env_reward", range(self.n_envs))
-        for rew in ep_rewards:
-            if rew is not None:
-                self.buffer.extend([rew])
+        # envs report the raw env return with the step info at episode end, no extra calls to the workers
+        for info in self.locals["infos"]:
+            if "episode_env" in info:
+                self.buffer.append(info["episode_env"]["r"])
+        return True
 
 
     def on_rollout_end(self) -> None:
@@ -63,21 +70,78 @@ class TensorboardCallback(BaseCallback):
         self.logger.record("rollout/ep_env_rew_mean", np.mean(list(self.buffer)))
 
 
+class ScobiNormalizationCallback(BaseCallback):
+    """
+    Merges the scobi normalization stats of all training envs after every rollout and shares them
+    with the training and evaluation envs. Replaces VecNormalize when training with --scobi-norm.
+    eval_env is None with --async-eval, the eval process gets the stats with each snapshot.
+    The stats are saved whenever num_timesteps // save_freq advances, like AsyncCheckpointCallback.
+    """
+
+    def __init__(self, eval_env, save_freq, save_path, writer, verbose=0):
+        super().__init__(verbose)
+        self.eval_env = eval_env
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.writer = writer
+        self.stats = None
+        self.last_save = 0
+
+    def _init_callback(self) -> None:
+        os.makedirs(self.save_path, exist_ok=True)
+
+    def _on_training_start(self) -> None:
+        self.last_save = self.model.num_timesteps // self.save_freq
+
+    def _on_rollout_end(self) -> None:
+        deltas = self.training_env.env_method("get_normalization_delta")
+        if self.stats is None:
+            self.stats = RunningStats(deltas[0].mean.shape)
+        for delta in deltas:
+            self.stats.merge(delta)
+        self.training_env.env_method("set_normalization_stats", self.stats)
+        if self.eval_env is not None:
+            self.eval_env.env_method("set_normalization_stats", self.stats)
+
+    def shared_stats(self):
+        """copy of the stats the envs normalize with, their initial ones before the first rollout end"""
+        if self.stats is not None:
+            return self.stats.copy()
+        stats = self.training_env.env_method("get_normalization_stats", indices=[0])[0]
+        return stats.copy() if stats is not None else RunningStats(self.training_env.observation_space.shape)
+
+    def _on_step(self) -> bool:
+        if self.stats is not None and self.num_timesteps // self.save_freq > self.last_save:
+            self.last_save = self.num_timesteps // self.save_freq
+            fpath = os.path.join(self.save_path, f"model_scobi_normalization_{self.num_timesteps}_steps.npz")
+            self.writer.submit({fpath: running_stats_bytes(self.stats)})
+        return True
+
+
 class SaveBestModelCallback(BaseCallback):
-    def __init__(self, save_path: str, rgb=False):
+    def __init__(self, save_path: str, writer, rgb=False, scobi_norm_env=None):
         super(SaveBestModelCallback, self).__init__()
         self.save_path = save_path
+        self.writer = writer
         self.rgb = rgb
+        self.scobi_norm_env = scobi_norm_env # env with the stats the best model was evaluated with
         self.vec_path_name = os.path.join(self.save_path, "best_vecnormalize.pkl")
+        self.scobi_norm_path_name = os.path.join(self.save_path, "best_scobi_normalization.npz")
 
     def _init_callback(self) -> None:
         if self.save_path is not None:
             os.makedirs(self.save_path, exist_ok=True)
 
     def _on_step(self) -> bool:
-        if not self.rgb:
-            self.model.get_vec_normalize_env().save(self.vec_path_name)
-        self.model.save(os.path.join(self.save_path, "best_model"))
+        # snapshot now, write in the background
+        files = {os.path.join(self.save_path, "best_model.zip"): model_bytes(self.model)}
+        if self.scobi_norm_env is not None:
+            stats = self.scobi_norm_env.env_method("get_normalization_stats", indices=[0])[0]
+            files[self.scobi_norm_path_name] = running_stats_bytes(stats)
+        elif not self.rgb:
+            files[self.vec_path_name] = vec_normalize_bytes(self.model.get_vec_normalize_env())
+        self.writer.submit(files)
+        return True
 
 def linear_schedule(initial_value: float) -> Callable[[float], float]:
     def func(progress_remaining: float) -> float:
@@ -85,11 +149,13 @@ def linear_schedule(initial_value: float) -> Callable[[float], float]:
     return func
 
 
-def _create_modelcard(flags, location):
+def _create_modelcard(flags, location, resume=False):
     if flags['rgb'] == 'used': obs = 'rgbv5'
     else: obs = 'object centric'
-    model_card = ModelCard(flags['game'], flags['environments'], obs, flags['prune'], flags['seed'], flags['reward'])
-    model_card.create_card(location)
+    model_card = ModelCard(flags['game'], flags['environments'], obs, flags['prune'], flags['seed'], flags['reward'], flags['obs_dtype'])
+    # a resumed run keeps the card of the interrupted one, it is updated at the end of training
+    if not (resume and model_card.restore(location)):
+        model_card.create_card(location)
     return model_card
 
 # Helper function to get the correct checkpoint location with the correct version specified
@@ -103,13 +169,42 @@ def _get_directory(path, exp_name):
             return versioned_dir
         version_counter += 1
 
+# Helper function to find the experiment directory to continue with --resume
+def _get_resume_directory(path, exp_name, resume):
+    if resume is True:
+        return path / f"{exp_name}{utils.parser.parser.get_highest_version(exp_name)}"
+    return Path(resume) if Path(resume).is_dir() else path / resume
+
+# Continues evaluations.npz up to the resumed checkpoint, and the best mean reward and keep_best scores of the interrupted run
+def _restore_eval_history(eval_callback, writer, ckpt_path, steps):
+    eval_log = ckpt_path / "evaluations.npz"
+    if not eval_log.exists():
+        return
+    data = np.load(eval_log)
+    timesteps, mean_rewards = data["timesteps"], np.mean(data["results"], axis=1)
+    keep = timesteps <= steps
+    eval_callback.evaluations_timesteps = timesteps[keep].tolist()
+    eval_callback.evaluations_results = data["results"][keep].tolist()
+    eval_callback.evaluations_length = data["ep_lengths"][keep].tolist()
+    # best_model.zip may come from an evaluation after the checkpoint, only a better model may replace it
+    eval_callback.best_mean_reward = float(np.max(mean_rewards))
+    if keep.any():
+        eval_callback.last_mean_reward = float(mean_rewards[keep][-1])
+    ckpt_dir = ckpt_path / "training_checkpoints"
+    scores = {}
+    for s in checkpoint_steps(ckpt_dir, "model"):
+        scored = timesteps <= s # a checkpoint is scored with the last evaluation before it
+        if scored.any():
+            scores[s] = float(mean_rewards[scored][-1])
+    writer.restore_scores(str(ckpt_dir), "model", scores)
+
 def main():
     flags_dictionary = utils.parser.parser.parse_train()
 
     print(flags_dictionary)
 
     exp_name = flags_dictionary["exp_name"]
-    n_envs = int(flags_dictionary["environments"])
+    n_envs = flags_dictionary["environments"] # upper bound with --autotune-envs
     n_eval_envs = 4
     n_eval_episodes = 8
     eval_env_seed = (int(flags_dictionary["seed"]) + 42) * 2 #different seeds for eval
@@ -118,10 +213,20 @@ def main():
     eval_frequency = 500_000
     rtpt_frequency = 100_000
 
-    log_path = _get_directory(Path("resources/training_logs"), exp_name)
-    ckpt_path = _get_directory(Path("resources/checkpoints"), exp_name)
+    if flags_dictionary["resume"]:
+        # same checkpoint and tensorboard directories as the interrupted run
+        ckpt_path = _get_resume_directory(Path("resources/checkpoints"), exp_name, flags_dictionary["resume"])
+        if not ckpt_path.is_dir():
+            print(f"No experiment directory {ckpt_path} to resume, starting a new run")
+        log_path = Path("resources/training_logs", ckpt_path.name)
+    else:
+        log_path = _get_directory(Path("resources/training_logs"), exp_name)
+        ckpt_path = _get_directory(Path("resources/checkpoints"), exp_name)
+    ns_log_path = Path("resources/ns_logs", ckpt_path.name) if flags_dictionary["ns_log"] else None
     log_path.mkdir(parents=True, exist_ok=True)
     ckpt_path.mkdir(parents=True, exist_ok=True)
+    # observation settings for eval.py, render_agent.py and viper_extract.py
+    save_env_config(ckpt_path, flags_dictionary)
 
     if flags_dictionary["pruned_ff_name"] is None :
         focus_dir = ckpt_path
@@ -136,11 +241,12 @@ def main():
         'reward': flags_dictionary["reward"],
         'prune': flags_dictionary["pruned_ff_name"],
         'exclude_properties': flags_dictionary["hide_properties"],
-        'rgb': rgb_info
+        'rgb': rgb_info,
+        'obs_dtype': flags_dictionary["obs_dtype"]
     }
-    model_card = _create_modelcard(flags, ckpt_path)
+    model_card = _create_modelcard(flags, ckpt_path, resume=bool(flags_dictionary["resume"]))
 
-    def make_env(rank: int = 0, seed: int = 0, silent=False, refresh=True) -> Callable:
+    def make_env(rank: int = 0, seed: int = 0, silent=False, refresh=True, ns_log=True) -> Callable:
         def _init() -> gym.Env:
             env = Environment(flags_dictionary["env"],
                               seed=seed + rank,
@@ -151,7 +257,15 @@ def main():
                               reward=flags_dictionary["reward_mode"],
                               refresh_yaml=refresh,
                               hud=flags_dictionary["hud"],
-                              mode = flags_dictionary["mode"]
+                              mode = flags_dictionary["mode"],
+                              reset_pool=flags_dictionary["reset_pool"],
+                              ns_log_dir=ns_log_path / f"env{rank}" if ns_log_path and ns_log else None,
+                              obs_dtype=flags_dictionary["obs_dtype"],
+                              normalize=flags_dictionary["scobi_norm"],
+                              noisy_objects=flags_dictionary["noisy"],
+                              noise_std=flags_dictionary["noise_std"],
+                              noise_error_rate=flags_dictionary["noise_error_rate"],
+                              focus_rules=flags_dictionary["focus_rules"]
                               )
             env = EpisodicLifeEnv(env=env)
             env = Monitor(env)
@@ -170,7 +284,15 @@ def main():
                               silent=silent,
                               reward=0, #always env reward for eval
                               refresh_yaml=refresh,
-                              hud=flags_dictionary["hud"])
+                              hud=flags_dictionary["hud"],
+                              mode=flags_dictionary["mode"],
+                              reset_pool=flags_dictionary["reset_pool"],
+                              obs_dtype=flags_dictionary["obs_dtype"],
+                              normalize=flags_dictionary["scobi_norm"],
+                              noisy_objects=flags_dictionary["noisy"],
+                              noise_std=flags_dictionary["noise_std"],
+                              noise_error_rate=flags_dictionary["noise_error_rate"],
+                              focus_rules=flags_dictionary["focus_rules"])
             env = Monitor(env)
             env.reset(seed=seed + rank)
             return env
@@ -178,6 +300,33 @@ def main():
         set_random_seed(seed)
         return _init
 
+    if not flags_dictionary["rgb"]:
+        # check if compatible gym env
+        monitor = make_env()()
+        check_env(monitor.env)
+        del monitor
+
+    if flags_dictionary["autotune_envs"]:
+        # timed rollouts of this game and focus file, the fastest env count is used and recorded in the model card
+        autotune = autotune_envs(lambda n: SubprocVecEnv([make_env(rank=i, seed=int(flags_dictionary["seed"]), silent=True, refresh=False, ns_log=False) for i in range(n)],
+                                                          start_method=MULTIPROCESSING_START_METHOD), max_envs=n_envs)
+        n_envs = autotune["n_envs"]
+        print(f"Autotune picked {n_envs} envs ({autotune['cpus']} usable cpus)")
+        model_card.n_envs = n_envs
+        model_card.autotune = autotune
+        model_card.create_card(ckpt_path)
+
+    placement = None
+    if flags_dictionary["placement"]:
+        # one core per env worker (a single eval process with --async-eval), the learner keeps its own cores
+        if not placement_supported():
+            print("CPU pinning is not supported on this platform, only thread counts are limited")
+        placement = plan_placement(n_envs, 1 if flags_dictionary["async_eval"] else n_eval_envs, flags_dictionary["learner_cores"])
+        print(format_layout(placement))
+
+    def place(env_fn, kind, rank):
+        return pinned(env_fn, [placement[kind][rank]]) if placement else env_fn
+
     # preprocessing based on atari wrapper of the openai baseline implementation (https://github.com/openai/baselines/blob/master/baselines/ppo1/run_atari.py)
     if flags_dictionary["rgb"]:
         # NoopResetEnv not required, because v5 has sticky actions, and also frame_skip=5, so also not required to set in wrapper (1 means no frameskip). no reward clipping, because scobots dont clip as well
@@ -186,48 +335,122 @@ def main():
         train_env = VecTransposeImage(train_env) #required for PyTorch convolution layers.
         # disable EpisodicLifeEnv, ClipRewardEnv for evaluation
         eval_wrapper_params = {"noop_max" : 0, "frame_skip" : 1, "screen_size": 84, "terminal_on_life_loss": False, "clip_reward" : False} # remaining values are part of AtariWrapper
-        eval_env = make_vec_env(flags_dictionary["env"], n_envs=n_eval_envs, seed=eval_env_seed, wrapper_class=AtariWrapper, wrapper_kwargs=eval_wrapper_params, vec_env_cls=SubprocVecEnv, vec_env_kwargs={"start_method" :"fork"})
-        eval_env = VecTransposeImage(eval_env) #required for PyTorch convolution layers.
+        # with --async-eval the eval envs live in the eval process, stepped sequentially there
+        make_async_eval_env = place(lambda: VecTransposeImage(make_vec_env(flags_dictionary["env"], n_envs=n_eval_envs, seed=eval_env_seed, wrapper_class=AtariWrapper, wrapper_kwargs=eval_wrapper_params, vec_env_cls=DummyVecEnv)), "eval", 0)
+        if not flags_dictionary["async_eval"]:
+            eval_env = make_vec_env(flags_dictionary["env"], n_envs=n_eval_envs, seed=eval_env_seed, wrapper_class=AtariWrapper, wrapper_kwargs=eval_wrapper_params, vec_env_cls=SubprocVecEnv, vec_env_kwargs={"start_method" :"fork"})
+            eval_env = VecTransposeImage(eval_env) #required for PyTorch convolution layers.
+        if placement:
+            # make_vec_env builds the env factories itself, so its workers are pinned from outside
+            pin_processes([p.pid for p in train_env.unwrapped.processes], placement["train"])
+            if not flags_dictionary["async_eval"]:
+                pin_processes([p.pid for p in eval_env.unwrapped.processes], placement["eval"])
     else:
-        # check if compatible gym env
-        monitor = make_env()()
-        check_env(monitor.env)
-        del monitor
         # silent init and dont refresh default yaml file because it causes spam and issues with multiprocessing
-        eval_env = VecNormalize(SubprocVecEnv([make_eval_env(rank=i, seed=eval_env_seed, silent=True, refresh=False) for i in range(n_eval_envs)], start_method=MULTIPROCESSING_START_METHOD), norm_reward=False, training=False)
-        train_env = VecNormalize(SubprocVecEnv([make_env(rank=i, seed=int(flags_dictionary["seed"]), silent=True, refresh=False) for i in range(n_envs)], start_method=MULTIPROCESSING_START_METHOD), norm_reward=False)
+        make_async_eval_env = place(lambda: DummyVecEnv([make_eval_env(rank=i, seed=eval_env_seed, silent=True, refresh=False) for i in range(n_eval_envs)]), "eval", 0)
+        if not flags_dictionary["async_eval"]:
+            eval_env = SubprocVecEnv([place(make_eval_env(rank=i, seed=eval_env_seed, silent=True, refresh=False), "eval", i) for i in range(n_eval_envs)], start_method=MULTIPROCESSING_START_METHOD)
+        train_env = SubprocVecEnv([place(make_env(rank=i, seed=int(flags_dictionary["seed"]), silent=True, refresh=False), "train", i) for i in range(n_envs)], start_method=MULTIPROCESSING_START_METHOD)
+        if flags_dictionary["scobi_norm"]:
+            # scobi normalizes inside the envs, eval envs only use the merged stats of the training envs
+            if not flags_dictionary["async_eval"]:
+                eval_env.env_method("freeze_normalization")
+        else:
+            if not flags_dictionary["async_eval"]:
+                eval_env = VecNormalize(eval_env, norm_reward=False, training=False)
+            train_env = VecNormalize(train_env, norm_reward=False)
+
+    if placement:
+        pin_learner(placement["learner"])
 
     rtpt_iters = training_timestamps // rtpt_frequency
-    save_bm = SaveBestModelCallback(ckpt_path, rgb=flags_dictionary["rgb_exp"])
-    eval_callback = EvalCallback(
-        eval_env,
-        callback_on_new_best=save_bm,
-        n_eval_episodes=n_eval_episodes,
-        best_model_save_path=str(ckpt_path),
-        log_path=str(ckpt_path),
-        eval_freq=max(eval_frequency // n_envs, 1),
-        deterministic=True,
-        render=False)
-
-    checkpoint_callback = CheckpointCallback(
-        save_freq= max(checkpoint_frequency // n_envs, 1),
+    scobi_norm = flags_dictionary["scobi_norm"] and not flags_dictionary["rgb_exp"]
+    ckpt_dir = ckpt_path / "training_checkpoints"
+    resume_steps = None
+    if flags_dictionary["resume"]:
+        # only checkpoints whose normalization stats were written as well
+        if flags_dictionary["rgb_exp"]:
+            required = [("", "zip")]
+        elif scobi_norm:
+            required = [("", "zip"), ("scobi_normalization", "npz")]
+        else:
+            required = [("", "zip"), ("vecnormalize", "pkl")]
+        resume_steps = latest_checkpoint(ckpt_dir, "model", required)
+        if resume_steps is None:
+            print(f"No training checkpoint in {ckpt_dir}, starting from scratch")
+        else:
+            print(f"Resuming from the checkpoint at {resume_steps} steps")
+            if scobi_norm:
+                resume_stats = RunningStats.load(checkpoint_path(ckpt_dir, "model", resume_steps, "scobi_normalization", "npz"))
+                train_env.env_method("set_normalization_stats", resume_stats)
+            elif not flags_dictionary["rgb_exp"]:
+                train_env = VecNormalize.load(checkpoint_path(ckpt_dir, "model", resume_steps, "vecnormalize", "pkl"), train_env.venv)
+    # checkpoints and best models are written from a background thread
+    checkpoint_writer = CheckpointWriter(keep_last=flags_dictionary["keep_checkpoints"], keep_best=flags_dictionary["keep_best_checkpoints"])
+    scobi_norm_callback = None
+    if scobi_norm:
+        scobi_norm_callback = ScobiNormalizationCallback(
+            None if flags_dictionary["async_eval"] else eval_env,
+            save_freq=checkpoint_frequency,
+            save_path=str(os.path.join(ckpt_path, 'training_checkpoints')),
+            writer=checkpoint_writer)
+        if resume_steps is not None:
+            scobi_norm_callback.stats = resume_stats
+    if flags_dictionary["async_eval"]:
+        # training continues while the eval process evaluates the snapshot, it also saves the best model
+        eval_callback = AsyncEvalCallback(
+            make_async_eval_env,
+            eval_freq=eval_frequency,
+            n_eval_episodes=n_eval_episodes,
+            save_path=str(ckpt_path),
+            writer=checkpoint_writer,
+            scobi_norm_fn=scobi_norm_callback.shared_stats if scobi_norm else None,
+            deterministic=True,
+            start_method=MULTIPROCESSING_START_METHOD)
+    else:
+        save_bm = SaveBestModelCallback(ckpt_path, checkpoint_writer, rgb=flags_dictionary["rgb_exp"], scobi_norm_env=eval_env if scobi_norm else None)
+        eval_callback = EvalCallback(
+            eval_env,
+            callback_on_new_best=save_bm,
+            n_eval_episodes=n_eval_episodes,
+            best_model_save_path=None, # save_bm writes best_model.zip in the background
+            log_path=str(ckpt_path),
+            eval_freq=max(eval_frequency // n_envs, 1),
+            deterministic=True,
+            render=False)
+    if resume_steps is not None:
+        _restore_eval_history(eval_callback, checkpoint_writer, ckpt_path, resume_steps)
+
+    # runs after the eval callback, so a checkpoint at an eval step is scored with its own evaluation
+    checkpoint_callback = AsyncCheckpointCallback(
+        save_freq=checkpoint_frequency,
         save_path=str(os.path.join(ckpt_path,'training_checkpoints')),
+        writer=checkpoint_writer,
         name_prefix="model",
-        save_replay_buffer=True,
-        save_vecnormalize=True)
+        save_vecnormalize=True,
+        score_fn=lambda: eval_callback.last_mean_reward)
 
     rtpt_callback = RtptCallback(
         exp_name=exp_name,
-        max_iter=rtpt_iters)
+        max_iter=rtpt_iters,
+        iteration_start=(resume_steps or 0) // rtpt_frequency)
 
     n_callback = EveryNTimesteps(
         n_steps=rtpt_frequency,
         callback=rtpt_callback)
+    n_callback.last_time_trigger = resume_steps or 0
 
-    tb_callback = TensorboardCallback(n_envs=n_envs)
-    cbl = [checkpoint_callback, eval_callback, n_callback, tb_callback]
+    tb_callback = TensorboardCallback()
+    cbl = [eval_callback, checkpoint_callback, n_callback, tb_callback]
     if flags_dictionary["rgb_exp"]: #remove tb callback if rgb
         cbl = cbl[:-1]
+    if scobi_norm_callback is not None:
+        cbl.append(scobi_norm_callback)
+    if flags_dictionary["rollout_dataset"] is not None:
+        # the newest rollouts on disk, e.g. for viper_extract.py --dataset
+        cbl.append(RolloutDatasetCallback(str(ckpt_path / "rollout_dataset"), flags_dictionary["rollout_dataset"],
+                                          start_timesteps=int(flags_dictionary["rollout_dataset_start"] * training_timestamps),
+                                          scobi_norm=scobi_norm))
     cb_list = CallbackList(cbl)
     new_logger = configure(str(log_path), ["tensorboard"])
 
@@ -276,6 +499,10 @@ def main():
             env=train_env,
             policy_kwargs=pkwargs,
             verbose=1)
+    if resume_steps is not None:
+        # policy and optimizer state, the lr and clip range schedules continue from num_timesteps
+        model.set_parameters(checkpoint_path(ckpt_dir, "model", resume_steps), exact_match=True)
+        model.num_timesteps = resume_steps
     model.set_logger(new_logger)
     print(model.policy)
     print(f"Experiment name: {exp_name}")
@@ -284,7 +511,9 @@ def main():
     if flags_dictionary["pruned_ff_name"] is not None:
         focus_file_path = Path(flags_dictionary["focus_dir"]) / flags_dictionary["pruned_ff_name"]
         shutil.copy(focus_file_path, ckpt_path / focus_file_path.name)
-    model.learn(total_timesteps=training_timestamps, callback=cb_list, progress_bar=flags_dictionary["progress"])
+    model.learn(total_timesteps=training_timestamps - model.num_timesteps, callback=cb_list, progress_bar=flags_dictionary["progress"],
+                reset_num_timesteps=resume_steps is None)
+    checkpoint_writer.close()
 
     model_card.update_card(ckpt_path, model.num_timesteps, training_timestamps, model.sde_sample_freq, n_eval_episodes,
                            model.gae_lambda, model.n_steps, model.batch_size, model.ent_coef, model.gamma,
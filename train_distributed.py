@@ -0,0 +1,224 @@
+import multiprocessing
+import os
+import secrets
+import shutil
+from pathlib import Path
+from typing import Callable
+
+import gymnasium as gym
+import torch as th
+from rtpt import RTPT
+from stable_baselines3 import PPO
+from stable_baselines3.common.env_checker import check_env
+from stable_baselines3.common.logger import configure
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.utils import set_random_seed
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+import utils.parser.parser
+from scobi import Environment
+from train import MULTIPROCESSING_START_METHOD, ScobiNormalizationCallback, linear_schedule, _create_modelcard, _get_directory
+from utils.async_eval import AsyncEvalCallback
+from utils.checkpointing import AsyncCheckpointCallback, CheckpointWriter, save_env_config
+from utils.distributed import AUTHKEY_VAR, ActorServer, RemoteActorsVecEnv, authkey_from_env, learn, run_actor
+from utils.rollout_dataset import RolloutDatasetCallback
+
+
+# Object-centric PPO with the settings of train.py, the envs are stepped by actor processes that
+# connect over TCP (--local-actors on this machine, the rest with actor.py on other machines). The
+# learner trains on their rollouts and sends the new weights back. scobi normalization is always used,
+# the learner merges the stats of all actors.
+def main():
+    flags_dictionary = utils.parser.parser.parse_train(distributed=True)
+
+    print(flags_dictionary)
+
+    if flags_dictionary["rgb"]:
+        print("Distributed training ships object-centric rollouts, rgb agents are trained with train.py")
+        return
+    if flags_dictionary["resume"]:
+        print("--resume is not supported for distributed training")
+        return
+    if flags_dictionary["local_actors"] > flags_dictionary["actors"]:
+        print("--local-actors is larger than --actors")
+        return
+    # actors authenticate with a shared key before the learner unpickles their messages, local actors
+    # get a random one if none is set
+    authkey = authkey_from_env()
+    if authkey is None:
+        if flags_dictionary["actors"] > flags_dictionary["local_actors"]:
+            print(f"Remote actors need a shared key, set {AUTHKEY_VAR} for the learner and the actors")
+            return
+        authkey = secrets.token_bytes(32)
+
+    exp_name = flags_dictionary["exp_name"]
+    seed = int(flags_dictionary["seed"])
+    n_eval_envs = 4
+    n_eval_episodes = 8
+    n_steps = 2048
+    eval_env_seed = (seed + 42) * 2 #different seeds for eval
+    training_timestamps = 20_000_000
+    checkpoint_frequency = 1_000_000
+    eval_frequency = 500_000
+    adam_step_size = 0.001
+    if flags_dictionary["game"] in ["Bowling", "Tennis"]:
+        adam_step_size = 0.00025
+
+    log_path = _get_directory(Path("resources/training_logs"), exp_name)
+    ckpt_path = _get_directory(Path("resources/checkpoints"), exp_name)
+    log_path.mkdir(parents=True, exist_ok=True)
+    ckpt_path.mkdir(parents=True, exist_ok=True)
+    # observation settings for eval.py, render_agent.py and viper_extract.py
+    save_env_config(ckpt_path, flags_dictionary)
+    focus_dir = ckpt_path if flags_dictionary["pruned_ff_name"] is None else flags_dictionary["focus_dir"]
+    if flags_dictionary["pruned_ff_name"] is not None:
+        focus_file_path = Path(flags_dictionary["focus_dir"]) / flags_dictionary["pruned_ff_name"]
+        shutil.copy(focus_file_path, ckpt_path / focus_file_path.name)
+
+    # constructor arguments of the actor envs, seed, focus dir and normalization are set by the actors
+    env_kwargs = dict(env_name=flags_dictionary["env"],
+                      focus_file=flags_dictionary["pruned_ff_name"],
+                      hide_properties=flags_dictionary["hide_properties"],
+                      reward=flags_dictionary["reward_mode"],
+                      hud=flags_dictionary["hud"],
+                      mode=flags_dictionary["mode"],
+                      reset_pool=flags_dictionary["reset_pool"],
+                      obs_dtype=flags_dictionary["obs_dtype"],
+                      noisy_objects=flags_dictionary["noisy"],
+                      noise_std=flags_dictionary["noise_std"],
+                      noise_error_rate=flags_dictionary["noise_error_rate"],
+                      focus_rules=flags_dictionary["focus_rules"])
+
+    def make_eval_env(rank: int = 0, seed: int = 0) -> Callable:
+        def _init() -> gym.Env:
+            env = Environment(flags_dictionary["env"],
+                              seed=seed + rank,
+                              focus_dir=focus_dir,
+                              focus_file=flags_dictionary["pruned_ff_name"],
+                              hide_properties=flags_dictionary["hide_properties"],
+                              silent=True,
+                              reward=0, #always env reward for eval
+                              refresh_yaml=False,
+                              hud=flags_dictionary["hud"],
+                              mode=flags_dictionary["mode"],
+                              reset_pool=flags_dictionary["reset_pool"],
+                              obs_dtype=flags_dictionary["obs_dtype"],
+                              normalize=True,
+                              noisy_objects=flags_dictionary["noisy"],
+                              noise_std=flags_dictionary["noise_std"],
+                              noise_error_rate=flags_dictionary["noise_error_rate"],
+                              focus_rules=flags_dictionary["focus_rules"])
+            env = Monitor(env)
+            env.reset(seed=seed + rank)
+            return env
+        set_random_seed(seed)
+        return _init
+
+    # writes the default focus file the actors get, checks the env and gives the spaces for PPO
+    env = Environment(seed=seed, focus_dir=focus_dir, normalize=True, **env_kwargs)
+    check_env(env)
+    observation_space, action_space = env.observation_space, env.action_space
+    focus_file = Path(env.focus_file)
+    env.close()
+    env_kwargs["focus_file"] = focus_file.name
+
+    # listen before the local actors connect
+    server = ActorServer(flags_dictionary["host"], flags_dictionary["port"], authkey)
+    connect_host = "127.0.0.1" if flags_dictionary["host"] in ["", "0.0.0.0"] else flags_dictionary["host"]
+    ctx = multiprocessing.get_context(MULTIPROCESSING_START_METHOD)
+    local_actors = [ctx.Process(target=run_actor, args=(connect_host, flags_dictionary["port"], int(flags_dictionary["environments"]), authkey), daemon=True)
+                    for _ in range(flags_dictionary["local_actors"])]
+    for p in local_actors:
+        p.start()
+    print(f"Waiting for {flags_dictionary['actors']} actors on port {flags_dictionary['port']}...")
+    server.accept(flags_dictionary["actors"])
+    n_envs = sum(server.n_envs)
+    # callbacks run once per rollout of n_steps * n_envs timesteps
+    rollout_size = n_steps * n_envs
+
+    flags = {
+        'game': flags_dictionary["game"],
+        'seed': seed,
+        'environments': n_envs,
+        'reward': flags_dictionary["reward"],
+        'prune': flags_dictionary["pruned_ff_name"],
+        'exclude_properties': flags_dictionary["hide_properties"],
+        'rgb': 'not used',
+        'obs_dtype': flags_dictionary["obs_dtype"]
+    }
+    model_card = _create_modelcard(flags, ckpt_path)
+
+    model = PPO(
+        "MlpPolicy",
+        n_steps=n_steps,
+        learning_rate=linear_schedule(adam_step_size),
+        n_epochs=3,
+        batch_size=32*8,
+        gamma=0.99,
+        gae_lambda=0.95,
+        clip_range=linear_schedule(0.1),
+        vf_coef=1,
+        ent_coef=0.01,
+        env=RemoteActorsVecEnv(n_envs, observation_space, action_space),
+        policy_kwargs=dict(activation_fn=th.nn.ReLU, net_arch=dict(pi=[64, 64], vf=[64, 64])),
+        seed=seed,
+        device="cpu",
+        verbose=1)
+    model.set_logger(configure(str(log_path), ["tensorboard"]))
+    server.configure({"env_kwargs": env_kwargs,
+                      "focus_file_text": focus_file.read_text(),
+                      "seed": seed,
+                      "policy_class": model.policy_class,
+                      "policy_kwargs": model.policy_kwargs,
+                      "gamma": model.gamma,
+                      "n_steps": n_steps})
+
+    checkpoint_writer = CheckpointWriter(keep_last=flags_dictionary["keep_checkpoints"], keep_best=flags_dictionary["keep_best_checkpoints"])
+    scobi_norm_callback = ScobiNormalizationCallback(
+        None,
+        save_freq=checkpoint_frequency,
+        save_path=str(os.path.join(ckpt_path, 'training_checkpoints')),
+        writer=checkpoint_writer)
+    eval_callback = AsyncEvalCallback(
+        lambda: DummyVecEnv([make_eval_env(rank=i, seed=eval_env_seed) for i in range(n_eval_envs)]),
+        eval_freq=eval_frequency,
+        n_eval_episodes=n_eval_episodes,
+        save_path=str(ckpt_path),
+        writer=checkpoint_writer,
+        scobi_norm_fn=scobi_norm_callback.shared_stats,
+        deterministic=True,
+        start_method=MULTIPROCESSING_START_METHOD)
+    checkpoint_callback = AsyncCheckpointCallback(
+        save_freq=checkpoint_frequency,
+        save_path=str(os.path.join(ckpt_path, 'training_checkpoints')),
+        writer=checkpoint_writer,
+        name_prefix="model",
+        save_vecnormalize=True,
+        score_fn=lambda: eval_callback.last_mean_reward)
+
+    callbacks = [eval_callback, checkpoint_callback, scobi_norm_callback]
+    if flags_dictionary["rollout_dataset"] is not None:
+        # the rollouts of all actors, in the learner's checkpoint directory
+        callbacks.append(RolloutDatasetCallback(str(ckpt_path / "rollout_dataset"), flags_dictionary["rollout_dataset"],
+                                                start_timesteps=int(flags_dictionary["rollout_dataset_start"] * training_timestamps),
+                                                scobi_norm=True))
+
+    rtpt = RTPT(name_initials="AA", experiment_name=exp_name, max_iterations=training_timestamps // rollout_size)
+    rtpt.start()
+    print(model.policy)
+    print(f"Experiment name: {exp_name}")
+    print(f"Started distributed {type(model).__name__} training with {len(server.actors)} actors ({n_envs} envs) and {n_eval_envs} evaluators...")
+    try:
+        learn(model, server, training_timestamps, callbacks, rtpt=rtpt)
+    finally:
+        server.close()
+        for p in local_actors:
+            p.join()
+    checkpoint_writer.close()
+
+    model_card.update_card(ckpt_path, model.num_timesteps, training_timestamps, model.sde_sample_freq, n_eval_episodes,
+                           model.gae_lambda, model.n_steps, model.batch_size, model.ent_coef, model.gamma,
+                           model.policy_class.__name__)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import os
+import shutil
+from pathlib import Path
+from typing import Callable
+
+import gymnasium as gym
+import torch as th
+from rtpt import RTPT
+from stable_baselines3 import PPO
+from stable_baselines3.common.atari_wrappers import EpisodicLifeEnv
+from stable_baselines3.common.callbacks import CallbackList
+from stable_baselines3.common.logger import configure
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.utils import set_random_seed
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecNormalize
+
+import utils.parser.parser
+from scobi import Environment
+from train import MULTIPROCESSING_START_METHOD, ScobiNormalizationCallback, linear_schedule, _create_modelcard, _get_directory
+from utils.async_eval import AsyncEvalCallback
+from utils.checkpointing import AsyncCheckpointCallback, CheckpointWriter, save_env_config
+from utils.multiseed import MultiSeedPPO
+
+
+# Trains one object-centric PPO agent per seed (-s 0 1 2) in a single process, with the settings of
+# train.py. Each seed gets its own envs, checkpoint and tensorboard directory, evaluation runs in one
+# eval process per seed (like train.py --async-eval).
+def main():
+    flags_dictionary = utils.parser.parser.parse_train(multi_seed=True)
+
+    print(flags_dictionary)
+
+    if flags_dictionary["rgb"]:
+        print("Multi-seed training stacks MLP policies, rgb agents are trained with train.py")
+        return
+    if flags_dictionary["resume"]:
+        print("--resume is not supported for multi-seed training, resume the seeds with train.py")
+        return
+
+    seeds = [int(s) for s in flags_dictionary["seed"]]
+    exp_names = flags_dictionary["exp_names"]
+    n_envs = int(flags_dictionary["environments"])
+    n_eval_envs = 4
+    n_eval_episodes = 8
+    n_steps = 2048
+    training_timestamps = 20_000_000
+    checkpoint_frequency = 1_000_000
+    eval_frequency = 500_000
+    # callbacks run once per rollout of n_steps * n_envs timesteps
+    rollout_size = n_steps * n_envs
+    adam_step_size = 0.001
+    if flags_dictionary["game"] in ["Bowling", "Tennis"]:
+        adam_step_size = 0.00025
+
+    def make_env(focus_dir, rank: int = 0, seed: int = 0, silent=False, refresh=True, ns_log_path=None) -> Callable:
+        def _init() -> gym.Env:
+            env = Environment(flags_dictionary["env"],
+                              seed=seed + rank,
+                              focus_dir=focus_dir,
+                              focus_file=flags_dictionary["pruned_ff_name"],
+                              hide_properties=flags_dictionary["hide_properties"],
+                              silent=silent,
+                              reward=flags_dictionary["reward_mode"],
+                              refresh_yaml=refresh,
+                              hud=flags_dictionary["hud"],
+                              mode = flags_dictionary["mode"],
+                              reset_pool=flags_dictionary["reset_pool"],
+                              ns_log_dir=ns_log_path / f"env{rank}" if ns_log_path else None,
+                              obs_dtype=flags_dictionary["obs_dtype"],
+                              normalize=flags_dictionary["scobi_norm"],
+                              noisy_objects=flags_dictionary["noisy"],
+                              noise_std=flags_dictionary["noise_std"],
+                              noise_error_rate=flags_dictionary["noise_error_rate"],
+                              focus_rules=flags_dictionary["focus_rules"]
+                              )
+            env = EpisodicLifeEnv(env=env)
+            env = Monitor(env)
+            env.reset(seed=seed + rank)
+            return env
+        set_random_seed(seed)
+        return _init
+
+    def make_eval_env(focus_dir, rank: int = 0, seed: int = 0) -> Callable:
+        def _init() -> gym.Env:
+            env = Environment(flags_dictionary["env"],
+                              seed=seed + rank,
+                              focus_dir=focus_dir,
+                              focus_file=flags_dictionary["pruned_ff_name"],
+                              hide_properties=flags_dictionary["hide_properties"],
+                              silent=True,
+                              reward=0, #always env reward for eval
+                              refresh_yaml=False,
+                              hud=flags_dictionary["hud"],
+                              mode=flags_dictionary["mode"],
+                              reset_pool=flags_dictionary["reset_pool"],
+                              obs_dtype=flags_dictionary["obs_dtype"],
+                              normalize=flags_dictionary["scobi_norm"],
+                              noisy_objects=flags_dictionary["noisy"],
+                              noise_std=flags_dictionary["noise_std"],
+                              noise_error_rate=flags_dictionary["noise_error_rate"],
+                              focus_rules=flags_dictionary["focus_rules"])
+            env = Monitor(env)
+            env.reset(seed=seed + rank)
+            return env
+        set_random_seed(seed)
+        return _init
+
+    # checkpoints and best models of all seeds are written from one background thread
+    checkpoint_writer = CheckpointWriter(keep_last=flags_dictionary["keep_checkpoints"], keep_best=flags_dictionary["keep_best_checkpoints"])
+    models, callbacks, ckpt_paths, model_cards = [], [], [], []
+    for seed, exp_name in zip(seeds, exp_names):
+        log_path = _get_directory(Path("resources/training_logs"), exp_name)
+        ckpt_path = _get_directory(Path("resources/checkpoints"), exp_name)
+        ns_log_path = Path("resources/ns_logs", ckpt_path.name) if flags_dictionary["ns_log"] else None
+        log_path.mkdir(parents=True, exist_ok=True)
+        ckpt_path.mkdir(parents=True, exist_ok=True)
+        # observation settings for eval.py, render_agent.py and viper_extract.py
+        save_env_config(ckpt_path, flags_dictionary)
+        focus_dir = ckpt_path if flags_dictionary["pruned_ff_name"] is None else flags_dictionary["focus_dir"]
+        flags = {
+            'game': flags_dictionary["game"],
+            'seed': seed,
+            'environments': flags_dictionary["environments"],
+            'reward': flags_dictionary["reward"],
+            'prune': flags_dictionary["pruned_ff_name"],
+            'exclude_properties': flags_dictionary["hide_properties"],
+            'rgb': 'not used',
+            'obs_dtype': flags_dictionary["obs_dtype"]
+        }
+        model_cards.append(_create_modelcard(flags, ckpt_path))
+        ckpt_paths.append(ckpt_path)
+        if flags_dictionary["pruned_ff_name"] is not None:
+            focus_file_path = Path(flags_dictionary["focus_dir"]) / flags_dictionary["pruned_ff_name"]
+            shutil.copy(focus_file_path, ckpt_path / focus_file_path.name)
+
+        # writes the default focus file of this seed's directory before the silent workers read it
+        make_env(focus_dir)().close()
+        train_env = SubprocVecEnv([make_env(focus_dir, rank=i, seed=seed, silent=True, refresh=False, ns_log_path=ns_log_path) for i in range(n_envs)], start_method=MULTIPROCESSING_START_METHOD)
+        scobi_norm = flags_dictionary["scobi_norm"]
+        if not scobi_norm:
+            train_env = VecNormalize(train_env, norm_reward=False)
+        eval_env_seed = (seed + 42) * 2 #different seeds for eval
+        make_async_eval_env = lambda focus_dir=focus_dir, eval_env_seed=eval_env_seed: DummyVecEnv([make_eval_env(focus_dir, rank=i, seed=eval_env_seed) for i in range(n_eval_envs)])
+
+        # the same PPO as train.py, it holds env, hyperparameters, logger and the exported policy
+        model = PPO(
+            "MlpPolicy",
+            n_steps=n_steps,
+            learning_rate=linear_schedule(adam_step_size),
+            n_epochs=3,
+            batch_size=32*8,
+            gamma=0.99,
+            gae_lambda=0.95,
+            clip_range=linear_schedule(0.1),
+            vf_coef=1,
+            ent_coef=0.01,
+            env=train_env,
+            policy_kwargs=dict(activation_fn=th.nn.ReLU, net_arch=dict(pi=[64, 64], vf=[64, 64])),
+            seed=seed,
+            device="cpu",
+            verbose=1)
+        model.set_logger(configure(str(log_path), ["tensorboard"]))
+
+        cbl = []
+        scobi_norm_callback = None
+        if scobi_norm:
+            scobi_norm_callback = ScobiNormalizationCallback(
+                None,
+                save_freq=checkpoint_frequency,
+                save_path=str(os.path.join(ckpt_path, 'training_checkpoints')),
+                writer=checkpoint_writer)
+        eval_callback = AsyncEvalCallback(
+            make_async_eval_env,
+            eval_freq=eval_frequency,
+            n_eval_episodes=n_eval_episodes,
+            save_path=str(ckpt_path),
+            writer=checkpoint_writer,
+            scobi_norm_fn=scobi_norm_callback.shared_stats if scobi_norm else None,
+            deterministic=True,
+            start_method=MULTIPROCESSING_START_METHOD)
+        cbl.append(eval_callback)
+        cbl.append(AsyncCheckpointCallback(
+            save_freq=checkpoint_frequency,
+            save_path=str(os.path.join(ckpt_path, 'training_checkpoints')),
+            writer=checkpoint_writer,
+            name_prefix="model",
+            save_vecnormalize=True,
+            score_fn=lambda c=eval_callback: c.last_mean_reward))
+        if scobi_norm_callback is not None:
+            cbl.append(scobi_norm_callback)
+        models.append(model)
+        callbacks.append(CallbackList(cbl))
+
+    trainer = MultiSeedPPO(models)
+    rtpt = RTPT(name_initials="AA", experiment_name=exp_names[0], max_iterations=training_timestamps // rollout_size)
+    rtpt.start()
+    print(models[0].policy)
+    print(f"Experiments: {', '.join(exp_names)}")
+    print(f"Started multi-seed PPO training of {len(seeds)} seeds with {n_envs} actors and {n_eval_envs} evaluators each...")
+    trainer.learn(training_timestamps, callbacks, rtpt=rtpt)
+    checkpoint_writer.close()
+
+    for model, model_card, ckpt_path in zip(models, model_cards, ckpt_paths):
+        model_card.update_card(ckpt_path, trainer.num_timesteps, training_timestamps, model.sde_sample_freq, n_eval_episodes,
+                               model.gae_lambda, model.n_steps, model.batch_size, model.ent_coef, model.gamma,
+                               model.policy_class.__name__)
+
+if __name__ == '__main__':
+    main()
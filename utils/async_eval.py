@@ -0,0 +1,162 @@
+"""
+Out-of-process evaluation for train.py: the learner sends snapshots (policy, normalizer state) to an
+eval worker and keeps training, results come back to the learner's logger and best model handling.
+"""
+import io
+import multiprocessing as mp
+import os
+import pickle
+import queue
+import traceback
+
+import numpy as np
+import torch as th
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.evaluation import evaluate_policy
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+
+from utils.checkpointing import model_bytes, running_stats_bytes, vec_normalize_bytes
+
+
+def _eval_worker(algo_class, make_eval_env, n_eval_episodes, deterministic, jobs, results):
+    th.set_num_threads(1) # the learner keeps the cores
+    eval_env = make_eval_env.var()
+    scobi_norm_frozen = False
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        try:
+            model = algo_class.load(io.BytesIO(job["model"]), device="cpu")
+            env = eval_env
+            if job["vec_normalize"] is not None:
+                env = pickle.loads(job["vec_normalize"])
+                env.set_venv(eval_env)
+                env.training = False
+                env.norm_reward = False
+            if job["scobi_norm"] is not None:
+                if not scobi_norm_frozen:
+                    eval_env.env_method("freeze_normalization")
+                    scobi_norm_frozen = True
+                eval_env.env_method("set_normalization_stats", job["scobi_norm"])
+            rewards, lengths = evaluate_policy(model, env, n_eval_episodes=n_eval_episodes, deterministic=deterministic,
+                                               return_episode_rewards=True, warn=False)
+            results.put(("result", job["timesteps"], rewards, lengths))
+        except Exception:
+            results.put(("error", job["timesteps"], traceback.format_exc(), None))
+    eval_env.close()
+
+
+class AsyncEvalCallback(BaseCallback):
+    """
+    Replaces EvalCallback + SaveBestModelCallback. Whenever num_timesteps // eval_freq advances (so a
+    resumed run keeps the timestep grid) a snapshot is sent to the eval process, unless max_in_flight
+    snapshots are still being evaluated (then this evaluation is skipped).
+    Finished evaluations are logged with the timesteps of their snapshot (eval/mean_reward, ...) and
+    appended to evaluations.npz. A new best snapshot is written as best_model.zip plus its normalizer
+    state (best_vecnormalize.pkl or best_scobi_normalization.npz) through the checkpoint writer.
+
+    make_eval_env: picklable (by cloudpickle) function that builds the eval VecEnv in the worker, without
+    VecNormalize. scobi_norm_fn: returns a copy of the current merged scobi normalization stats, if used
+    (snapshots are pickled by a queue feeder thread, so they must not change after being sent).
+    """
+    def __init__(self, make_eval_env, eval_freq, n_eval_episodes, save_path, writer, scobi_norm_fn=None,
+                 deterministic=True, max_in_flight=2, start_method=None, verbose=1):
+        super().__init__(verbose)
+        self.make_eval_env = make_eval_env
+        self.eval_freq = eval_freq
+        self.n_eval_episodes = n_eval_episodes
+        self.save_path = save_path
+        self.writer = writer
+        self.scobi_norm_fn = scobi_norm_fn
+        self.deterministic = deterministic
+        self.max_in_flight = max_in_flight
+        self.start_method = start_method
+        self.in_flight = {} # timesteps -> snapshot, kept until its result arrives
+        self.best_mean_reward = -np.inf
+        self.last_mean_reward = -np.inf
+        self.evaluations_timesteps = []
+        self.evaluations_results = []
+        self.evaluations_length = []
+        self.process = None
+        self.last_eval = 0
+
+    def _on_training_start(self) -> None:
+        if self.eval_freq > 0:
+            self.last_eval = self.model.num_timesteps // self.eval_freq
+
+    def _init_callback(self) -> None:
+        os.makedirs(self.save_path, exist_ok=True)
+        ctx = mp.get_context(self.start_method)
+        self.jobs = ctx.Queue()
+        self.results = ctx.Queue()
+        self.process = ctx.Process(target=_eval_worker, name="async-eval", daemon=True,
+                                   args=(type(self.model), CloudpickleWrapper(self.make_eval_env), self.n_eval_episodes,
+                                         self.deterministic, self.jobs, self.results))
+        self.process.start()
+
+    def _snapshot(self):
+        vec_normalize = self.model.get_vec_normalize_env()
+        return {
+            "timesteps": self.num_timesteps,
+            "model": model_bytes(self.model),
+            "vec_normalize": vec_normalize_bytes(vec_normalize) if vec_normalize is not None else None,
+            "scobi_norm": self.scobi_norm_fn() if self.scobi_norm_fn is not None else None,
+        }
+
+    def _on_step(self) -> bool:
+        self._collect_results()
+        if self.eval_freq > 0 and self.num_timesteps // self.eval_freq > self.last_eval:
+            self.last_eval = self.num_timesteps // self.eval_freq
+            if len(self.in_flight) >= self.max_in_flight:
+                if self.verbose >= 1:
+                    print(f"Eval process busy, skipping evaluation at {self.num_timesteps} timesteps")
+            else:
+                snapshot = self._snapshot()
+                self.in_flight[snapshot["timesteps"]] = snapshot
+                self.jobs.put(snapshot)
+        return True
+
+    def _collect_results(self, block=False):
+        while self.in_flight:
+            try:
+                kind, timesteps, rewards, lengths = self.results.get(block=block)
+            except queue.Empty:
+                return
+            snapshot = self.in_flight.pop(timesteps)
+            if kind == "error":
+                raise RuntimeError(f"async evaluation at {timesteps} timesteps failed:\n{rewards}")
+            self._on_result(snapshot, rewards, lengths)
+
+    def _on_result(self, snapshot, rewards, lengths):
+        timesteps = snapshot["timesteps"]
+        self.evaluations_timesteps.append(timesteps)
+        self.evaluations_results.append(rewards)
+        self.evaluations_length.append(lengths)
+        np.savez(os.path.join(self.save_path, "evaluations"), timesteps=self.evaluations_timesteps,
+                 results=self.evaluations_results, ep_lengths=self.evaluations_length)
+        mean_reward, std_reward = np.mean(rewards), np.std(rewards)
+        mean_ep_length = np.mean(lengths)
+        self.last_mean_reward = mean_reward
+        if self.verbose >= 1:
+            print(f"Eval num_timesteps={timesteps}, episode_reward={mean_reward:.2f} +/- {std_reward:.2f}")
+        self.logger.record("eval/mean_reward", float(mean_reward))
+        self.logger.record("eval/mean_ep_length", float(mean_ep_length))
+        self.logger.record("time/total_timesteps", timesteps, exclude="tensorboard")
+        self.logger.dump(timesteps)
+        if mean_reward > self.best_mean_reward:
+            if self.verbose >= 1:
+                print("New best mean reward!")
+            self.best_mean_reward = mean_reward
+            files = {os.path.join(self.save_path, "best_model.zip"): snapshot["model"]}
+            if snapshot["scobi_norm"] is not None:
+                files[os.path.join(self.save_path, "best_scobi_normalization.npz")] = running_stats_bytes(snapshot["scobi_norm"])
+            elif snapshot["vec_normalize"] is not None:
+                files[os.path.join(self.save_path, "best_vecnormalize.pkl")] = snapshot["vec_normalize"]
+            self.writer.submit(files)
+
+    def _on_training_end(self) -> None:
+        # the last evaluations still count
+        self._collect_results(block=True)
+        self.jobs.put(None)
+        self.process.join()
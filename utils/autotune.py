@@ -0,0 +1,68 @@
+"""
+Picks the number of training envs for this machine: short timed rollouts of the actual game and
+focus file at increasing env counts, stepped by a policy of train.py's size like during training.
+"""
+import os
+import time
+
+import numpy as np
+import torch as th
+
+
+def candidate_env_counts(max_envs=None):
+    """1, 2, 4, ... and the number of usable cores"""
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    max_envs = max_envs or cores
+    counts = [n for n in [2 ** i for i in range(16)] if n < max_envs] + [max_envs]
+    return counts, cores
+
+
+def _mlp(sizes):
+    layers = []
+    for n_in, n_out in zip(sizes[:-1], sizes[1:]):
+        layers += [th.nn.Linear(n_in, n_out), th.nn.ReLU()]
+    return th.nn.Sequential(*layers[:-1])
+
+
+def time_rollout(vec_env, steps, warmup_steps=16):
+    """env steps per second and learner utilization (share of the time spent in the policy forward pass)"""
+    obs_dim, n_actions = vec_env.observation_space.shape[0], vec_env.action_space.n
+    # pi and vf nets of train.py's MlpPolicy
+    pi, vf = _mlp([obs_dim, 64, 64, n_actions]), _mlp([obs_dim, 64, 64, 1])
+    obs = vec_env.reset()
+    learner_time = 0
+    for step in range(warmup_steps + steps):
+        if step == warmup_steps:
+            start, learner_time = time.perf_counter(), 0
+        learner_start = time.perf_counter()
+        with th.no_grad():
+            obs_t = th.as_tensor(np.asarray(obs, dtype=np.float32))
+            logits, _ = pi(obs_t), vf(obs_t)
+            actions = th.distributions.Categorical(logits=logits).sample().numpy()
+        learner_time += time.perf_counter() - learner_start
+        obs, _, _, _ = vec_env.step(actions)
+    elapsed = time.perf_counter() - start
+    return vec_env.num_envs * steps / elapsed, learner_time / elapsed
+
+
+def autotune_envs(make_vec_env, steps=256, max_envs=None, tolerance=0.9):
+    """
+    make_vec_env(n_envs) -> VecEnv. Tries increasing env counts and stops once the throughput falls
+    below tolerance * best. The PPO update costs the same per sample for every env count, so the
+    count with the most env steps per second also trains fastest.
+    returns {"n_envs", "cpus", "results": [{"n_envs", "steps_per_second", "learner_utilization"}]}
+    """
+    counts, cores = candidate_env_counts(max_envs)
+    results = []
+    for n_envs in counts:
+        vec_env = make_vec_env(n_envs)
+        try:
+            steps_per_second, utilization = time_rollout(vec_env, steps)
+        finally:
+            vec_env.close()
+        results.append({"n_envs": n_envs, "steps_per_second": steps_per_second, "learner_utilization": utilization})
+        print(f"autotune: {n_envs:3d} envs {steps_per_second:9.1f} steps/s, learner busy {utilization:6.1%}")
+        if steps_per_second < tolerance * max(r["steps_per_second"] for r in results):
+            break
+    best = max(results, key=lambda r: r["steps_per_second"])
+    return {"n_envs": best["n_envs"], "cpus": cores, "results": results}
@@ -0,0 +1,220 @@
+"""
+Background checkpointing for train.py: the learner only serializes policy and normalizer state into
+memory, a writer thread puts the bytes on disk and applies the retention policy afterwards.
+File names match stable-baselines3's CheckpointCallback, so checkpoints load the usual way.
+"""
+import io
+import json
+import os
+import pickle
+import queue
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from stable_baselines3.common.callbacks import BaseCallback
+
+# <prefix>_<steps>_steps.zip, <prefix>_vecnormalize_<steps>_steps.pkl, <prefix>_scobi_normalization_<steps>_steps.npz
+CHECKPOINT_FILE = re.compile(r"^(?P<prefix>.+?)_(?:(?P<kind>[a-z_]+)_)?(?P<steps>\d+)_steps\.(?:zip|pkl|npz)$")
+# Environment arguments of the training run that change the observations, with the Environment
+# defaults. eval.py, render_agent.py and viper_extract.py use the saved ones unless a flag is given
+ENV_CONFIG_FILE = "env_config.json"
+ENV_CONFIG_DEFAULTS = {"mode": "ram", "hud": False, "obs_dtype": "float32", "focus_rules": None,
+                       "noisy_objects": None, "noise_std": 3.0, "noise_error_rate": 0.05}
+
+
+def model_bytes(model):
+    buffer = io.BytesIO()
+    model.save(buffer)
+    return buffer.getvalue()
+
+
+def vec_normalize_bytes(vec_normalize):
+    # same as VecNormalize.save, which pickles the wrapper without its venv
+    return pickle.dumps(vec_normalize)
+
+
+def running_stats_bytes(stats):
+    # same npz layout as RunningStats.save
+    buffer = io.BytesIO()
+    np.savez(buffer, mean=stats.mean, var=stats.var, count=stats.count)
+    return buffer.getvalue()
+
+
+def save_env_config(directory, flags_dictionary):
+    config = {"mode": flags_dictionary["mode"],
+              "hud": flags_dictionary["hud"],
+              "obs_dtype": flags_dictionary["obs_dtype"],
+              "focus_rules": flags_dictionary["focus_rules"],
+              "noisy_objects": flags_dictionary["noisy"],
+              "noise_std": flags_dictionary["noise_std"],
+              "noise_error_rate": flags_dictionary["noise_error_rate"]}
+    with open(Path(directory) / ENV_CONFIG_FILE, "w") as f:
+        json.dump(config, f, indent=2)
+
+
+def load_env_config(directory, overrides=None):
+    """
+    Environment kwargs of a checkpoint directory: the saved ones (Environment defaults for runs without
+    env_config.json), overridden by the entries of overrides that are not None
+    """
+    config = dict(ENV_CONFIG_DEFAULTS)
+    fpath = Path(directory) / ENV_CONFIG_FILE
+    if fpath.exists():
+        with open(fpath, "r") as f:
+            config.update(json.load(f))
+    else:
+        print(f"No {ENV_CONFIG_FILE} in {directory}, using the given flags and Environment defaults")
+    config.update({k: v for k, v in (overrides or {}).items() if v is not None})
+    return config
+
+
+def checkpoint_path(directory, prefix, steps, kind="", extension="zip"):
+    kind = f"{kind}_" if kind else ""
+    return os.path.join(directory, f"{prefix}_{kind}{steps}_steps.{extension}")
+
+
+def latest_checkpoint(directory, prefix="model", required=(("", "zip"),)):
+    """steps of the newest checkpoint that has all required (kind, extension) files, None if there is none"""
+    for steps in reversed(checkpoint_steps(directory, prefix)):
+        if all(os.path.exists(checkpoint_path(directory, prefix, steps, kind, ext)) for kind, ext in required):
+            return steps
+    return None
+
+
+def checkpoint_steps(directory, prefix="model"):
+    """steps of all checkpoints of a prefix in a directory, ascending"""
+    steps = set()
+    for f in Path(directory).glob(f"{prefix}_*_steps.*"):
+        m = CHECKPOINT_FILE.match(f.name)
+        if m and m["prefix"] == prefix:
+            steps.add(int(m["steps"]))
+    return sorted(steps)
+
+
+class CheckpointWriter():
+    """
+    Writes in-memory snapshots from a background thread. Files are written to a temporary name and
+    renamed, so a crash never leaves a truncated checkpoint behind. The queue is bounded, if the disk
+    falls behind by more than max_pending snapshots, submit() blocks instead of piling up memory.
+
+    Retention (per checkpoint directory and prefix): keep_last keeps the newest N checkpoints, keep_best
+    additionally keeps the K best scored ones. None keeps everything.
+    """
+    def __init__(self, keep_last=None, keep_best=0, max_pending=2):
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.scores = {} # (directory, prefix) -> {steps: score}
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, files, retention=None, score=None):
+        """
+        files: {path: bytes}. retention: (directory, prefix, steps) of a periodic checkpoint, which
+        triggers the retention policy once its files are written, score ranks it for keep_best.
+        """
+        self._raise_error()
+        self.queue.put((files, retention, score))
+
+    def restore_scores(self, directory, prefix, scores):
+        """keep_best scores {steps: score} of checkpoints written before a resume"""
+        self.scores.setdefault((str(directory), prefix), {}).update(scores)
+
+    def flush(self):
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("checkpoint writer failed") from error
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+            try:
+                files, retention, score = job
+                for path, data in files.items():
+                    tmp_path = f"{path}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+                if retention is not None:
+                    self._apply_retention(*retention, score)
+            except Exception as e: # reported to the learner on its next submit/flush
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _apply_retention(self, directory, prefix, steps, score):
+        scores = self.scores.setdefault((str(directory), prefix), {})
+        if score is not None:
+            scores[steps] = score
+        if self.keep_last is None:
+            return
+        all_steps = checkpoint_steps(directory, prefix)
+        keep = set(all_steps[-self.keep_last:]) if self.keep_last > 0 else set()
+        if self.keep_best:
+            keep.update(sorted(scores, key=scores.get, reverse=True)[:self.keep_best])
+        for f in Path(directory).glob(f"{prefix}_*_steps.*"):
+            m = CHECKPOINT_FILE.match(f.name)
+            if m and m["prefix"] == prefix and int(m["steps"]) not in keep:
+                f.unlink()
+        for s in list(scores):
+            if s not in keep:
+                del scores[s]
+
+
+class AsyncCheckpointCallback(BaseCallback):
+    """
+    Drop-in for CheckpointCallback (same file names) that only snapshots into memory on the learner.
+    score_fn returns the score of the current model for keep_best, e.g. the last mean eval reward.
+    PPO has no replay buffer, so there is none to save. save_freq is in timesteps: a checkpoint is
+    written whenever num_timesteps // save_freq advances, so a resumed run keeps the grid of the first.
+    """
+    def __init__(self, save_freq, save_path, writer, name_prefix="model", save_vecnormalize=False, score_fn=None, verbose=0):
+        super().__init__(verbose)
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.writer = writer
+        self.name_prefix = name_prefix
+        self.save_vecnormalize = save_vecnormalize
+        self.score_fn = score_fn
+        self.last_save = 0
+
+    def _init_callback(self) -> None:
+        os.makedirs(self.save_path, exist_ok=True)
+
+    def _on_training_start(self) -> None:
+        self.last_save = self.model.num_timesteps // self.save_freq
+
+    def _checkpoint_path(self, kind="", extension="zip"):
+        return checkpoint_path(self.save_path, self.name_prefix, self.num_timesteps, kind, extension)
+
+    def _on_step(self) -> bool:
+        if self.num_timesteps // self.save_freq > self.last_save:
+            self.last_save = self.num_timesteps // self.save_freq
+            files = {self._checkpoint_path(): model_bytes(self.model)}
+            vec_normalize = self.model.get_vec_normalize_env()
+            if self.save_vecnormalize and vec_normalize is not None:
+                files[self._checkpoint_path("vecnormalize", "pkl")] = vec_normalize_bytes(vec_normalize)
+            score = self.score_fn() if self.score_fn is not None else None
+            self.writer.submit(files, retention=(self.save_path, self.name_prefix, self.num_timesteps), score=score)
+            if self.verbose >= 2:
+                print(f"Queued model checkpoint {self._checkpoint_path()}")
+        return True
+
+    def _on_training_end(self) -> None:
+        self.writer.flush()
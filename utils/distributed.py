@@ -0,0 +1,355 @@
+"""
+Actor-learner training over plain TCP for train_distributed.py: actor processes (on this or other
+machines) step scobi envs with a copy of the policy and send rollout segments to the learner, which
+trains PPO on them and sends the new weights back before the next rollout.
+
+Messages are zlib compressed pickles with a length prefix. Unpickling runs arbitrary code, so both
+sides first prove that they know the shared key (AUTHKEY_VAR, HMAC challenge-response), nothing is
+unpickled before. The messages themselves are neither signed nor encrypted, keep the learner inside a
+trusted network.
+"""
+import hmac
+import os
+import pickle
+import secrets
+import socket
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import torch as th
+from stable_baselines3.common.atari_wrappers import EpisodicLifeEnv
+from stable_baselines3.common.callbacks import CallbackList
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.utils import safe_mean
+from stable_baselines3.common.vec_env import DummyVecEnv, VecEnv
+
+from scobi import Environment
+from scobi.utils.running_stats import RunningStats
+
+HEADER = struct.Struct("!Q")
+AUTHKEY_VAR = "SCOBI_DISTRIBUTED_KEY"
+NONCE_SIZE = 32
+HANDSHAKE_TIMEOUT = 10 # seconds a connecting peer gets to authenticate
+
+
+def authkey_from_env():
+    key = os.environ.get(AUTHKEY_VAR)
+    return key.encode() if key else None
+
+
+def _digest(authkey, role, nonce):
+    return hmac.new(authkey, role + nonce, "sha256").digest()
+
+
+def authenticate_actor(sock, authkey):
+    """learner side of the handshake, raises ConnectionError if the peer does not know authkey"""
+    nonce = secrets.token_bytes(NONCE_SIZE)
+    sock.sendall(nonce)
+    answer = _recv_exactly(sock, 2 * NONCE_SIZE)
+    if not hmac.compare_digest(bytes(answer[:NONCE_SIZE]), _digest(authkey, b"actor", nonce)):
+        raise ConnectionError("actor failed to authenticate")
+    sock.sendall(_digest(authkey, b"learner", bytes(answer[NONCE_SIZE:])))
+
+
+def authenticate_learner(sock, authkey):
+    """actor side of the handshake, raises ConnectionError if the learner does not know authkey"""
+    nonce = secrets.token_bytes(NONCE_SIZE)
+    challenge = bytes(_recv_exactly(sock, NONCE_SIZE))
+    sock.sendall(_digest(authkey, b"actor", challenge) + nonce)
+    if not hmac.compare_digest(bytes(_recv_exactly(sock, NONCE_SIZE)), _digest(authkey, b"learner", nonce)):
+        raise ConnectionError("learner failed to authenticate")
+
+
+def send_message(sock, message):
+    payload = zlib.compress(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL), 1)
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, n_bytes):
+    buffer = bytearray(n_bytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < n_bytes:
+        n = sock.recv_into(view[received:], n_bytes - received)
+        if n == 0:
+            raise ConnectionError("connection closed by peer")
+        received += n
+    return buffer
+
+
+def recv_message(sock):
+    size, = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    return pickle.loads(zlib.decompress(_recv_exactly(sock, size)))
+
+
+def _configure(sock):
+    # segments and weights are sent in one piece, do not wait for more data
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class RemoteActorsVecEnv(VecEnv):
+    """
+    Stand-in VecEnv of the learner for the envs of all actors: gives PPO its spaces and env count and
+    carries the scobi normalization between actors and ScobiNormalizationCallback. Stepping happens
+    on the actors.
+    """
+    def __init__(self, num_envs, observation_space, action_space):
+        super().__init__(num_envs, observation_space, action_space)
+        self.deltas = []  # normalization deltas of the last segments, one per actor
+        self.stats = None  # merged stats, sent to the actors with the next weights
+
+    def reset(self):
+        return np.zeros((self.num_envs, *self.observation_space.shape), dtype=self.observation_space.dtype)
+
+    def step_async(self, actions):
+        raise NotImplementedError("the envs are stepped by the actors")
+
+    def step_wait(self):
+        raise NotImplementedError("the envs are stepped by the actors")
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        if attr_name == "render_mode":
+            return [None for _ in self._get_indices(indices)]
+        raise AttributeError(f"{attr_name} is only available on the actors")
+
+    def set_attr(self, attr_name, value, indices=None):
+        raise AttributeError(f"{attr_name} is only available on the actors")
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        if method_name == "get_normalization_delta":
+            deltas, self.deltas = self.deltas, []
+            return deltas
+        if method_name == "get_normalization_stats":
+            return [self.stats for _ in self._get_indices(indices)]
+        if method_name == "set_normalization_stats":
+            self.stats = method_args[0].copy()
+            return [None for _ in self._get_indices(indices)]
+        raise NotImplementedError(f"{method_name} is only available on the actors")
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+class ActorServer():
+    """
+    accepts the actors and talks to all of them, actor i owns envs rank_offsets[i] .. + n_envs[i].
+    Connections that do not authenticate with authkey are closed before anything is unpickled.
+    """
+    def __init__(self, host, port, authkey):
+        self.server = socket.create_server((host, port))
+        self.authkey = authkey
+        self.actors = []
+        self.n_envs = []
+
+    @property
+    def port(self):
+        return self.server.getsockname()[1]
+
+    def accept(self, n_actors):
+        while len(self.actors) < n_actors:
+            conn, address = self.server.accept()
+            conn = _configure(conn)
+            try:
+                conn.settimeout(HANDSHAKE_TIMEOUT)
+                authenticate_actor(conn, self.authkey)
+                conn.settimeout(None)
+            except (ConnectionError, OSError) as e:
+                print(f"rejected connection from {address[0]}: {e}")
+                conn.close()
+                continue
+            hello = recv_message(conn)
+            self.actors.append(conn)
+            self.n_envs.append(int(hello["n_envs"]))
+            print(f"actor {len(self.actors) - 1} connected from {address[0]} with {hello['n_envs']} envs")
+        self.server.close()
+
+    @property
+    def rank_offsets(self):
+        return list(np.cumsum([0] + self.n_envs[:-1]))
+
+    def configure(self, config):
+        # same config for all actors, each gets its own env ranks
+        for conn, offset in zip(self.actors, self.rank_offsets):
+            send_message(conn, dict(config, rank_offset=int(offset)))
+
+    def broadcast(self, message):
+        # pickle and compress once for all actors
+        payload = zlib.compress(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        for conn in self.actors:
+            conn.sendall(HEADER.pack(len(payload)) + payload)
+
+    def gather(self):
+        """segments of all actors in actor order, the actors collect in parallel"""
+        return [recv_message(conn) for conn in self.actors]
+
+    def close(self):
+        for conn in self.actors:
+            try:
+                send_message(conn, {"stop": True})
+            except OSError:
+                pass
+            conn.close()
+
+
+def weights_message(model, stats):
+    return {"weights": {k: v.cpu() for k, v in model.policy.state_dict().items()}, "stats": stats}
+
+
+def fill_rollout_buffer(model, segments):
+    """
+    puts the segments of all actors (env axis in actor order) into the rollout buffer of model and
+    computes returns and advantages like PPO.collect_rollouts. returns the episode infos
+    """
+    def cat(key):
+        return np.concatenate([s[key] for s in segments], axis=1)
+    obs, actions, rewards = cat("obs"), cat("actions"), cat("rewards")
+    episode_starts, values, log_probs = cat("episode_starts"), cat("values"), cat("log_probs")
+    rollout_buffer = model.rollout_buffer
+    rollout_buffer.reset()
+    for step in range(obs.shape[0]):
+        rollout_buffer.add(obs[step], actions[step], rewards[step], episode_starts[step],
+                           th.as_tensor(values[step]), th.as_tensor(log_probs[step]))
+    last_values = th.as_tensor(np.concatenate([s["last_values"] for s in segments]))
+    dones = np.concatenate([s["dones"] for s in segments])
+    rollout_buffer.compute_returns_and_advantage(last_values=last_values, dones=dones)
+    return [info for s in segments for info in s["infos"]]
+
+
+def learn(model, server, total_timesteps, callbacks, rtpt=None):
+    """
+    PPO.learn with the rollouts collected by the actors of server. model.env is a RemoteActorsVecEnv.
+    Callbacks run once per rollout (on_step) and get on_rollout_end before the update.
+    """
+    env = model.get_env()
+    total_timesteps, callback = model._setup_learn(total_timesteps, CallbackList(callbacks))
+    callback.on_training_start(locals(), globals())
+    ep_env_buffer = deque(maxlen=100)
+    start_time = time.time_ns()
+    iteration = 0
+    while model.num_timesteps < total_timesteps:
+        # the actors collect with the weights and normalization after the last update
+        server.broadcast(weights_message(model, env.stats))
+        callback.on_rollout_start()
+        segments = server.gather()
+        env.deltas = [s["normalization_delta"] for s in segments if s["normalization_delta"] is not None]
+        infos = fill_rollout_buffer(model, segments)
+        model._update_info_buffer(infos)
+        ep_env_buffer.extend(info["episode_env"]["r"] for info in infos if "episode_env" in info)
+        model.num_timesteps += model.n_steps * env.num_envs
+        iteration += 1
+        callback.update_locals(locals())
+        callback.on_rollout_end()
+        model._update_current_progress_remaining(model.num_timesteps, total_timesteps)
+        model.train()
+        fps = int(model.num_timesteps / max((time.time_ns() - start_time) / 1e9, 1e-8))
+        if model.ep_info_buffer:
+            model.logger.record("rollout/ep_rew_mean", safe_mean([ep["r"] for ep in model.ep_info_buffer]))
+            model.logger.record("rollout/ep_len_mean", safe_mean([ep["l"] for ep in model.ep_info_buffer]))
+        if ep_env_buffer:
+            model.logger.record("rollout/ep_env_rew_mean", np.mean(ep_env_buffer))
+        model.logger.record("time/iterations", iteration, exclude="tensorboard")
+        model.logger.record("time/fps", fps)
+        model.logger.record("time/total_timesteps", model.num_timesteps, exclude="tensorboard")
+        model.logger.dump(step=model.num_timesteps)
+        if not callback.on_step():
+            break
+        if rtpt is not None:
+            rtpt.step()
+    callback.on_training_end()
+
+
+def _make_actor_env(env_kwargs, focus_dir, rank, seed):
+    def _init():
+        env = Environment(seed=seed + rank, focus_dir=focus_dir, silent=True, refresh_yaml=False, normalize=True, **env_kwargs)
+        env = EpisodicLifeEnv(env=env)
+        env = Monitor(env)
+        env.reset(seed=seed + rank)
+        return env
+    return _init
+
+
+def collect_segment(policy, env, last_obs, last_episode_starts, n_steps, gamma):
+    """n_steps of every env with the current policy, like PPO.collect_rollouts"""
+    n_envs = env.num_envs
+    segment = {"obs": np.zeros((n_steps, n_envs, *last_obs.shape[1:]), dtype=np.float32),
+               "actions": np.zeros((n_steps, n_envs), dtype=np.int64),
+               "rewards": np.zeros((n_steps, n_envs), dtype=np.float32),
+               "episode_starts": np.zeros((n_steps, n_envs), dtype=np.float32),
+               "values": np.zeros((n_steps, n_envs), dtype=np.float32),
+               "log_probs": np.zeros((n_steps, n_envs), dtype=np.float32),
+               "infos": []}
+    for step in range(n_steps):
+        with th.no_grad():
+            actions, values, log_probs = policy(th.as_tensor(last_obs, dtype=th.float32))
+        actions = actions.numpy()
+        new_obs, rewards, dones, infos = env.step(actions)
+        for idx, done in enumerate(dones):
+            # bootstrap truncated episodes, like stable-baselines3
+            if done and infos[idx].get("terminal_observation") is not None and infos[idx].get("TimeLimit.truncated", False):
+                terminal_obs = th.as_tensor(np.asarray(infos[idx]["terminal_observation"], dtype=np.float32)[None])
+                with th.no_grad():
+                    rewards[idx] += gamma * policy.predict_values(terminal_obs)[0].item()
+        segment["infos"] += [{k: info[k] for k in ["episode", "episode_env"] if k in info} for info in infos
+                             if "episode" in info or "episode_env" in info]
+        segment["obs"][step] = last_obs
+        segment["actions"][step] = actions
+        segment["rewards"][step] = rewards
+        segment["episode_starts"][step] = last_episode_starts
+        segment["values"][step] = values.flatten().numpy()
+        segment["log_probs"][step] = log_probs.numpy()
+        last_obs, last_episode_starts = new_obs, dones.astype(np.float32)
+    with th.no_grad():
+        segment["last_values"] = policy.predict_values(th.as_tensor(last_obs, dtype=th.float32)).flatten().numpy()
+    segment["dones"] = last_episode_starts
+    return segment, last_obs, last_episode_starts
+
+
+def run_actor(host, port, n_envs, authkey=None):
+    """connects to the learner and collects rollout segments until the learner stops, authkey defaults to AUTHKEY_VAR"""
+    authkey = authkey or authkey_from_env()
+    if authkey is None:
+        raise ValueError(f"no key to authenticate with the learner, set {AUTHKEY_VAR}")
+    # the learner trains, one thread per actor process is enough for the forward passes
+    th.set_num_threads(1)
+    sock = _configure(socket.create_connection((host, port)))
+    authenticate_learner(sock, authkey)
+    send_message(sock, {"n_envs": n_envs})
+    config = recv_message(sock)
+    with tempfile.TemporaryDirectory() as focus_dir:
+        # the learner's focus file, so all actors see the same features
+        Path(focus_dir, config["env_kwargs"]["focus_file"]).write_text(config["focus_file_text"])
+        env = DummyVecEnv([_make_actor_env(config["env_kwargs"], focus_dir, config["rank_offset"] + i, config["seed"]) for i in range(n_envs)])
+        policy = config["policy_class"](env.observation_space, env.action_space, lambda _: 0.0, **config["policy_kwargs"])
+        policy.set_training_mode(False)
+        last_obs = env.reset()
+        last_episode_starts = np.ones(n_envs, dtype=np.float32)
+        print(f"actor with envs {config['rank_offset']}..{config['rank_offset'] + n_envs - 1} (pid {os.getpid()}) started")
+        try:
+            while True:
+                message = recv_message(sock)
+                if message.get("stop"):
+                    break
+                policy.load_state_dict(message["weights"])
+                if message["stats"] is not None:
+                    env.env_method("set_normalization_stats", message["stats"])
+                segment, last_obs, last_episode_starts = collect_segment(policy, env, last_obs, last_episode_starts, config["n_steps"], config["gamma"])
+                # one normalization delta per actor, the learner merges them
+                delta = None
+                for d in env.env_method("get_normalization_delta"):
+                    if delta is None:
+                        delta = RunningStats(d.mean.shape, 0)
+                    delta.merge(d)
+                segment["normalization_delta"] = delta
+                send_message(sock, segment)
+        finally:
+            env.close()
+            sock.close()
@@ -4,7 +4,7 @@ import yaml
 
 
 class ModelCard:
-    def __init__(self, game="", envs="", obs="", prune="", seed="", reward=""):
+    def __init__(self, game="", envs="", obs="", prune="", seed="", reward="", obs_dtype="float32"):
         self.game = game
         self.num_timesteps = ""
         self.total_timesteps = ""
@@ -18,9 +18,11 @@ class ModelCard:
         self.gamma = ""
         self.policy = ""
         self.obs_type = obs
+        self.obs_dtype = obs_dtype
         self.pruned = prune
         self.seed = seed
         self.reward_func = reward
+        self.autotune = None # result of train.py --autotune-envs
 
     def load_card(self, path):
         try:
@@ -36,6 +38,26 @@ class ModelCard:
         except Exception as e:
             print(f"Error reading {path}: {e}")
 
+    def restore(self, path):
+        """fields of the card in path written by an earlier (e.g. interrupted) run, False if there is none"""
+        readme_path = os.path.join(path, "README.md")
+        if not os.path.exists(readme_path):
+            return False
+        loaded = self.load_card(readme_path)
+        if loaded is None:
+            return False
+        model = loaded[0].get("model") or {}
+        for attr, key in [("num_timesteps", "num_timesteps"), ("total_timesteps", "total_timesteps"), ("sde_sample_freq", "sde_sample_freq"),
+                          ("n_envs", "n_envs"), ("n_epochs", "n_epochs"), ("gae_lambda", "gae_lambda"), ("n_steps", "n_steps"),
+                          ("batch_size", "batch_size"), ("gamma", "gamma"), ("ent_coef", "ent_coef")]:
+            if model.get(key) is not None:
+                setattr(self, attr, model[key])
+        autotune = model.get("n_envs_autotune")
+        if autotune:
+            self.autotune = {"n_envs": self.n_envs, "cpus": autotune["cpus"],
+                             "results": [{"n_envs": n, "steps_per_second": sps} for n, sps in autotune["steps_per_second"].items()]}
+        return True
+
     def create_card(self, path):
         yaml_metadata = (
                 f"---\n"
@@ -49,6 +71,7 @@ class ModelCard:
                 f"  seed: {self.seed}\n"
                 f"  reward_function: {self.reward_func}\n"
                 f"  observation_type: {self.obs_type}\n"
+                f"  observation_dtype: {self.obs_dtype}\n"
                 f"  pruned: {self.pruned}\n"
                 f"  normalized: Yes\n"
                 f"  num_timesteps: {self.num_timesteps}\n"
@@ -61,6 +84,7 @@ class ModelCard:
                 f"  batch_size: {self.batch_size}\n"
                 f"  gamma: {self.gamma}\n"
                 f"  ent_coef: {self.ent_coef}\n"
+                f"{self._autotune_metadata()}"
                 f"license: mit\n"
                 f"---\n"
             )
@@ -72,6 +96,7 @@ class ModelCard:
                 f"- **Seed**: {self.seed}\n"
                 f"- **Reward Function**: {self.reward_func}\n"
                 f"- **Observation Type**: {self.obs_type}\n"
+                f"- **Observation Dtype**: {self.obs_dtype}\n"
                 f"- **Pruned**: {self.pruned}\n\n"
                 f"## Training Details\n"
                 f"- **Framework**: Stable-Baselines3 (SB3)\n"
@@ -86,6 +111,7 @@ class ModelCard:
                 f"- **Batch Size**: {self.batch_size}\n"
                 f"- **Gamma**: {self.gamma}\n"
                 f"- **Ent_coef**: {self.ent_coef}\n"
+                f"{self._autotune_readme()}"
                 f"- **Reward Details**: {self.reward_func}\n\n"
                 f"## Usage\n"
                 f"For more detailed usage, visit https://github.com/k4ntz/SCoBots and its README which explains in detail how to use SCoBots\n\n"
@@ -99,6 +125,19 @@ class ModelCard:
         with open(readme_path, "w") as f:
             f.write(full_readme)
 
+    def _autotune_metadata(self):
+        if self.autotune is None:
+            return ""
+        steps_per_second = ", ".join(f"{r['n_envs']}: {r['steps_per_second']:.1f}" for r in self.autotune["results"])
+        return (f"  n_envs_autotune:\n"
+                f"    cpus: {self.autotune['cpus']}\n"
+                f"    steps_per_second: {{{steps_per_second}}}\n")
+
+    def _autotune_readme(self):
+        if self.autotune is None:
+            return ""
+        return f"- **Number of Environments Autotuned**: fastest of {', '.join(str(r['n_envs']) for r in self.autotune['results'])} on {self.autotune['cpus']} cpus\n"
+
     def update_card(self, path, num_steps="", total_steps="", sde_freq="", epochs="", lamba="",
                     n_steps="", batch="", coef="", gamma="", policy=""):
         self.num_timesteps = num_steps
@@ -0,0 +1,292 @@
+"""
+PPO for several seeds in one process. Every seed keeps its own policy, optimizer state and env set,
+but the parameters of all seeds are stacked, so a rollout step or a minibatch update of all seeds
+is a single batched forward and backward pass instead of one small pass per seed.
+The update is the one of stable-baselines3's PPO, applied to each seed independently.
+"""
+import time
+from collections import deque
+
+import numpy as np
+import torch as th
+from torch import nn
+from torch.distributions import Categorical
+from torch.nn import functional as F
+
+
+def _linear_layers(module):
+    return [m for m in module.modules() if isinstance(m, nn.Linear)]
+
+
+class StackedMlpPolicy(nn.Module):
+    """
+    K stable-baselines3 MlpPolicies (same net_arch, separate pi/vf nets, discrete actions) as one
+    module, layer weights have the shape (K, in, out). Built from the policies, so each seed starts
+    from the initialization stable-baselines3 gives it, export() writes a seed back for saving.
+    """
+    def __init__(self, policies):
+        super().__init__()
+        self.n_seeds = len(policies)
+        self.activation = policies[0].activation_fn()
+        self.pi_w, self.pi_b = self._stack([_linear_layers(p.mlp_extractor.policy_net) for p in policies])
+        self.vf_w, self.vf_b = self._stack([_linear_layers(p.mlp_extractor.value_net) for p in policies])
+        self.action_w, self.action_b = self._stack([[p.action_net] for p in policies])
+        self.value_w, self.value_b = self._stack([[p.value_net] for p in policies])
+
+    @staticmethod
+    def _stack(seed_layers):
+        # seed_layers[k][i]: layer i of seed k
+        weights, biases = nn.ParameterList(), nn.ParameterList()
+        for layers in zip(*seed_layers):
+            weights.append(nn.Parameter(th.stack([l.weight.detach().t() for l in layers]).contiguous()))
+            biases.append(nn.Parameter(th.stack([l.bias.detach().unsqueeze(0) for l in layers]).contiguous()))
+        return weights, biases
+
+    def _mlp(self, x, weights, biases):
+        for w, b in zip(weights, biases):
+            x = self.activation(th.baddbmm(b, x, w))
+        return x
+
+    def forward(self, obs):
+        """obs: (K, batch, obs_dim) -> action logits (K, batch, n_actions), values (K, batch)"""
+        logits = th.baddbmm(self.action_b[0], self._mlp(obs, self.pi_w, self.pi_b), self.action_w[0])
+        values = th.baddbmm(self.value_b[0], self._mlp(obs, self.vf_w, self.vf_b), self.value_w[0])
+        return logits, values.squeeze(-1)
+
+    def predict_values(self, k, obs):
+        """values of seed k only, obs: (batch, obs_dim)"""
+        x = obs
+        for w, b in zip(self.vf_w, self.vf_b):
+            x = self.activation(th.addmm(b[k], x, w[k]))
+        return th.addmm(self.value_b[0][k], x, self.value_w[0][k]).squeeze(-1)
+
+    def export(self, k, policy, optimizer=None):
+        """
+        copies the parameters of seed k into a stable-baselines3 policy and, if optimizer (the Adam over
+        the stacked parameters) is given, seed k's Adam state into policy.optimizer, so a saved model
+        resumes with it
+        """
+        pairs = [(_linear_layers(policy.mlp_extractor.policy_net), self.pi_w, self.pi_b),
+                 (_linear_layers(policy.mlp_extractor.value_net), self.vf_w, self.vf_b),
+                 ([policy.action_net], self.action_w, self.action_b),
+                 ([policy.value_net], self.value_w, self.value_b)]
+        with th.no_grad():
+            for layers, weights, biases in pairs:
+                for layer, w, b in zip(layers, weights, biases):
+                    layer.weight.copy_(w[k].t())
+                    layer.bias.copy_(b[k, 0])
+                    if optimizer is not None:
+                        _export_adam_state(optimizer, w, policy.optimizer, layer.weight, lambda t: t[k].t())
+                        _export_adam_state(optimizer, b, policy.optimizer, layer.bias, lambda t: t[k, 0])
+
+
+def _export_adam_state(optimizer, stacked, target_optimizer, param, seed_slice):
+    state = optimizer.state.get(stacked)
+    if not state:
+        return
+    target_optimizer.state[param] = {"step": state["step"].clone(),
+                                     "exp_avg": seed_slice(state["exp_avg"]).contiguous().clone(),
+                                     "exp_avg_sq": seed_slice(state["exp_avg_sq"]).contiguous().clone()}
+
+
+def clip_grad_norm_per_seed(parameters, max_norm, n_seeds):
+    # clip_grad_norm_ of each seed's own gradient, not of the whole stack
+    sq_norms = sum(p.grad.pow(2).reshape(n_seeds, -1).sum(dim=1) for p in parameters)
+    scale = (max_norm / (sq_norms.sqrt() + 1e-6)).clamp(max=1.0)
+    for p in parameters:
+        p.grad.mul_(scale.view(-1, *[1] * (p.dim() - 1)))
+
+
+class MultiSeedPPO():
+    """
+    Trains the policies of several PPO models (one per seed, same hyperparameters, each with its own
+    VecEnv) with stacked parameters. The models only hold env, hyperparameters, logger and the
+    exported policy and Adam state, so stable-baselines3 callbacks and model.save() work on them as usual.
+
+    Adam works elementwise, so one Adam over the stacked parameters equals one Adam per seed. The
+    losses of the seeds are summed, their gradients never mix, gradient clipping is done per seed.
+    Callbacks run once per rollout (on_step) and get on_rollout_end before the update.
+    """
+    def __init__(self, models):
+        self.models = models
+        self.envs = [m.get_env() for m in models]
+        m = models[0]
+        self.n_seeds = len(models)
+        self.n_envs = m.n_envs
+        self.n_steps, self.batch_size, self.n_epochs = m.n_steps, m.batch_size, m.n_epochs
+        self.gamma, self.gae_lambda = m.gamma, m.gae_lambda
+        self.ent_coef, self.vf_coef, self.max_grad_norm = m.ent_coef, m.vf_coef, m.max_grad_norm
+        self.normalize_advantage = m.normalize_advantage
+        self.lr_schedule, self.clip_range = m.lr_schedule, m.clip_range
+        self.policy = StackedMlpPolicy([m.policy for m in models])
+        # same optimizer settings as the ActorCriticPolicy of stable-baselines3
+        self.optimizer = th.optim.Adam(self.policy.parameters(), lr=self.lr_schedule(1), eps=1e-5)
+        self.num_timesteps = 0
+        self.n_updates = 0
+        self.ep_info_buffers = [deque(maxlen=100) for _ in models]
+        self.ep_env_buffers = [deque(maxlen=100) for _ in models]
+
+    def _update_info_buffers(self, k, infos):
+        for info in infos:
+            if "episode" in info:
+                self.ep_info_buffers[k].append(info["episode"])
+            if "episode_env" in info:
+                self.ep_env_buffers[k].append(info["episode_env"]["r"])
+
+    def collect_rollouts(self):
+        K, T, E = self.n_seeds, self.n_steps, self.n_envs
+        obs_dim = self.last_obs.shape[-1]
+        self.obs_buf = np.zeros((T, K, E, obs_dim), dtype=np.float32)
+        self.actions_buf = np.zeros((T, K, E), dtype=np.int64)
+        self.rewards_buf = np.zeros((T, K, E), dtype=np.float32)
+        self.starts_buf = np.zeros((T, K, E), dtype=np.float32)
+        self.values_buf = np.zeros((T, K, E), dtype=np.float32)
+        self.log_probs_buf = np.zeros((T, K, E), dtype=np.float32)
+        for step in range(T):
+            with th.no_grad():
+                logits, values = self.policy(th.as_tensor(self.last_obs))
+                dist = Categorical(logits=logits)
+                actions = dist.sample()
+                log_probs = dist.log_prob(actions)
+            actions = actions.numpy()
+            # all env sets step at the same time
+            for k, env in enumerate(self.envs):
+                env.step_async(actions[k])
+            new_obs = np.zeros_like(self.last_obs)
+            rewards = np.zeros((K, E), dtype=np.float32)
+            dones = np.zeros((K, E), dtype=np.float32)
+            for k, env in enumerate(self.envs):
+                obs_k, rewards_k, dones_k, infos_k = env.step_wait()
+                new_obs[k], rewards[k], dones[k] = obs_k, rewards_k, dones_k
+                self._update_info_buffers(k, infos_k)
+                # bootstrap truncated episodes, like stable-baselines3
+                for idx, done in enumerate(dones_k):
+                    if done and infos_k[idx].get("terminal_observation") is not None and infos_k[idx].get("TimeLimit.truncated", False):
+                        terminal_obs = th.as_tensor(np.asarray(infos_k[idx]["terminal_observation"], dtype=np.float32)[None])
+                        with th.no_grad():
+                            rewards[k, idx] += self.gamma * self.policy.predict_values(k, terminal_obs)[0].item()
+            self.obs_buf[step] = self.last_obs
+            self.actions_buf[step] = actions
+            self.rewards_buf[step] = rewards
+            self.starts_buf[step] = self.last_episode_starts
+            self.values_buf[step] = values.numpy()
+            self.log_probs_buf[step] = log_probs.numpy()
+            self.last_obs, self.last_episode_starts = new_obs, dones
+        self.num_timesteps += T * E
+        with th.no_grad():
+            _, last_values = self.policy(th.as_tensor(self.last_obs))
+        self._compute_returns_and_advantage(last_values.numpy())
+
+    def _compute_returns_and_advantage(self, last_values):
+        self.advantages_buf = np.zeros_like(self.rewards_buf)
+        last_gae = 0
+        for step in reversed(range(self.n_steps)):
+            if step == self.n_steps - 1:
+                next_non_terminal = 1.0 - self.last_episode_starts
+                next_values = last_values
+            else:
+                next_non_terminal = 1.0 - self.starts_buf[step + 1]
+                next_values = self.values_buf[step + 1]
+            delta = self.rewards_buf[step] + self.gamma * next_values * next_non_terminal - self.values_buf[step]
+            last_gae = delta + self.gamma * self.gae_lambda * next_non_terminal * last_gae
+            self.advantages_buf[step] = last_gae
+        self.returns_buf = self.advantages_buf + self.values_buf
+
+    def train(self, progress_remaining):
+        K = self.n_seeds
+        lr = self.lr_schedule(progress_remaining)
+        for group in self.optimizer.param_groups:
+            group["lr"] = lr
+        clip_range = self.clip_range(progress_remaining)
+
+        def flat(buf):
+            # (n_steps, K, n_envs, ...) -> (K, n_steps * n_envs, ...)
+            buf = np.swapaxes(buf, 0, 1)
+            return th.as_tensor(buf.reshape(K, -1, *buf.shape[3:]))
+        obs, actions = flat(self.obs_buf), flat(self.actions_buf)
+        old_log_probs, advantages, returns = flat(self.log_probs_buf), flat(self.advantages_buf), flat(self.returns_buf)
+        n_samples = obs.shape[1]
+        seed_idx = th.arange(K).unsqueeze(1)
+        stats = {"pg": [], "value": [], "entropy": [], "clip_fraction": [], "approx_kl": [], "loss": []}
+        parameters = list(self.policy.parameters())
+        for _ in range(self.n_epochs):
+            # an own shuffle per seed
+            perms = th.stack([th.randperm(n_samples) for _ in range(K)])
+            for start in range(0, n_samples, self.batch_size):
+                idx = perms[:, start:start + self.batch_size]
+                logits, values = self.policy(obs[seed_idx, idx])
+                dist = Categorical(logits=logits)
+                log_prob = dist.log_prob(actions[seed_idx, idx])
+                entropy = dist.entropy()
+                adv = advantages[seed_idx, idx]
+                if self.normalize_advantage and adv.shape[1] > 1:
+                    adv = (adv - adv.mean(dim=1, keepdim=True)) / (adv.std(dim=1, keepdim=True) + 1e-8)
+                log_ratio = log_prob - old_log_probs[seed_idx, idx]
+                ratio = th.exp(log_ratio)
+                policy_loss = -th.min(adv * ratio, adv * th.clamp(ratio, 1 - clip_range, 1 + clip_range)).mean(dim=1)
+                value_loss = F.mse_loss(returns[seed_idx, idx], values, reduction="none").mean(dim=1)
+                entropy_loss = -entropy.mean(dim=1)
+                loss = policy_loss + self.ent_coef * entropy_loss + self.vf_coef * value_loss
+                self.optimizer.zero_grad()
+                loss.sum().backward()
+                clip_grad_norm_per_seed(parameters, self.max_grad_norm, K)
+                self.optimizer.step()
+                with th.no_grad():
+                    stats["pg"].append(policy_loss.detach())
+                    stats["value"].append(value_loss.detach())
+                    stats["entropy"].append(entropy_loss.detach())
+                    stats["loss"].append(loss.detach())
+                    stats["clip_fraction"].append(((ratio - 1).abs() > clip_range).float().mean(dim=1))
+                    stats["approx_kl"].append(((ratio - 1) - log_ratio).mean(dim=1))
+        self.n_updates += self.n_epochs
+        values, returns = self.values_buf.swapaxes(0, 1).reshape(K, -1), self.returns_buf.swapaxes(0, 1).reshape(K, -1)
+        var_returns = np.var(returns, axis=1)
+        explained_var = np.where(var_returns == 0, np.nan, 1 - np.var(returns - values, axis=1) / np.where(var_returns == 0, 1, var_returns))
+        stats = {key: th.stack(v).mean(dim=0).numpy() for key, v in stats.items()}
+        for k, model in enumerate(self.models):
+            logger = model.logger
+            logger.record("train/entropy_loss", float(stats["entropy"][k]))
+            logger.record("train/policy_gradient_loss", float(stats["pg"][k]))
+            logger.record("train/value_loss", float(stats["value"][k]))
+            logger.record("train/approx_kl", float(stats["approx_kl"][k]))
+            logger.record("train/clip_fraction", float(stats["clip_fraction"][k]))
+            logger.record("train/loss", float(stats["loss"][k]))
+            logger.record("train/explained_variance", float(explained_var[k]))
+            logger.record("train/n_updates", self.n_updates, exclude="tensorboard")
+            logger.record("train/clip_range", clip_range)
+            logger.record("train/learning_rate", lr)
+
+    def learn(self, total_timesteps, callbacks, rtpt=None):
+        """total_timesteps per seed, callbacks: one (list) callback per seed"""
+        for model, callback in zip(self.models, callbacks):
+            callback.init_callback(model)
+            callback.on_training_start(locals(), globals())
+        self.last_obs = np.stack([env.reset() for env in self.envs]).astype(np.float32)
+        self.last_episode_starts = np.ones((self.n_seeds, self.n_envs), dtype=np.float32)
+        start_time = time.time_ns()
+        iteration = 0
+        while self.num_timesteps < total_timesteps:
+            self.collect_rollouts()
+            iteration += 1
+            for model, callback in zip(self.models, callbacks):
+                model.num_timesteps = self.num_timesteps
+                callback.on_rollout_end()
+            self.train(1.0 - self.num_timesteps / total_timesteps)
+            fps = int(self.num_timesteps / max((time.time_ns() - start_time) / 1e9, 1e-8))
+            for k, (model, callback) in enumerate(zip(self.models, callbacks)):
+                self.policy.export(k, model.policy, self.optimizer)
+                logger = model.logger
+                if self.ep_info_buffers[k]:
+                    logger.record("rollout/ep_rew_mean", np.mean([ep["r"] for ep in self.ep_info_buffers[k]]))
+                    logger.record("rollout/ep_len_mean", np.mean([ep["l"] for ep in self.ep_info_buffers[k]]))
+                if self.ep_env_buffers[k]:
+                    logger.record("rollout/ep_env_rew_mean", np.mean(self.ep_env_buffers[k]))
+                logger.record("time/iterations", iteration, exclude="tensorboard")
+                logger.record("time/fps", fps)
+                logger.record("time/total_timesteps", self.num_timesteps, exclude="tensorboard")
+                logger.dump(step=self.num_timesteps)
+                callback.on_step()
+            if rtpt is not None:
+                rtpt.step()
+        for callback in callbacks:
+            callback.on_training_end()
@@ -6,14 +6,14 @@ import argparse
 
 
 
-def parse_train():
+def parse_train(multi_seed=False, distributed=False):
     parser = argparse.ArgumentParser()
     parser.add_argument("-g", "--game", type=str, required=True,
                         help="game to train (e.g. 'Pong')")
-    parser.add_argument("-s", "--seed", type=int, required=True,
-                        help="seed")
-    parser.add_argument("-env", "--environments", type=int, required=True,
-                        help="number of envs used")
+    parser.add_argument("-s", "--seed", type=int, required=True, nargs="+" if multi_seed else None,
+                        help="seeds, one policy each" if multi_seed else "seed")
+    parser.add_argument("-env", "--environments", type=int, required=False,
+                        help="number of envs used (with --autotune-envs: the most to try)")
     parser.add_argument("-r", "--reward", type=str, required=False, choices=["env", "human", "mixed"],
                         help="reward mode, env if omitted")
     parser.add_argument("-p", "--prune", type=str, required=False, choices=["default", "external"],
@@ -22,9 +22,36 @@ def parse_train():
     parser.add_argument("--rgb", action="store_true", help="rgb observation space")
     parser.add_argument("--progress", action="store_true", help="display a progress bar of the training process")
     parser.add_argument("--hud", action="store_true", help="use HUD objects")
-    parser.add_argument("-m", "--mode", action="store_true", type=str, default="ram", help="set object detection method")
+    parser.add_argument("-m", "--mode", type=str, default="ram", choices=["ram", "vision", "both"], help="set object detection method")
+    parser.add_argument("--reset-pool", type=int, default=0, help="number of pre-captured start states (reset + random no-ops) per training env, reset restores one of them (0: disabled)")
+    parser.add_argument("--ns-log", action="store_true", help="log raw ns_repr buffers of the training envs to resources/ns_logs for offline feature recomputation")
+    parser.add_argument("--obs-dtype", type=str, default="float32", choices=["float32", "float16", "int16"], help="observation dtype, reduced precision modes clip to screen-derived bounds, int16 stores function features in 1/64 pixel fixed point")
+    parser.add_argument("--scobi-norm", action="store_true", help="normalize observations inside scobi instead of wrapping the envs in VecNormalize")
+    parser.add_argument("--noise-std", type=float, default=3.0, help="std of the position jitter in noisy mode (SCOBI_OBJ_EXTRACTOR=Noisy_OC_Atari)")
+    parser.add_argument("--noise-error-rate", type=float, default=0.05, help="detection error rate in noisy mode (SCOBI_OBJ_EXTRACTOR=Noisy_OC_Atari)")
+    parser.add_argument("--focus-rules", nargs="?", const=True, default=None, help="generate the default focus file with relation rules (packaged rules, or a path to a rules yaml)")
+    parser.add_argument("--keep-checkpoints", type=int, default=None, help="keep only the newest N training checkpoints (default: keep all)")
+    parser.add_argument("--keep-best-checkpoints", type=int, default=0, help="additionally keep the N training checkpoints with the best eval reward")
+    parser.add_argument("--async-eval", action="store_true", help="evaluate policy snapshots in a separate process while training continues")
+    parser.add_argument("--placement", action="store_true", help="pin every env worker to its own core with single-threaded torch/BLAS, the learner keeps --learner-cores cores (Linux)")
+    parser.add_argument("--learner-cores", type=int, default=1, help="cores (and torch threads) reserved for the learner with --placement")
+    parser.add_argument("--autotune-envs", action="store_true", help="time short rollouts at increasing env counts and train with the fastest (object-centric only)")
+    if distributed:
+        parser.add_argument("--host", type=str, default="127.0.0.1", help="address the learner listens on for actors, e.g. 0.0.0.0 for actors on other machines")
+        parser.add_argument("--port", type=int, default=29500, help="port the learner listens on for actors")
+        parser.add_argument("--actors", type=int, required=True, help="number of actors to wait for, including --local-actors")
+        parser.add_argument("--local-actors", type=int, default=0, help="actors to start on this machine, with -env envs each")
+    parser.add_argument("--rollout-dataset", type=int, default=None, help="stream the PPO rollouts (obs, actions, log-probs, values) into a memory-mapped ring buffer of this many samples in the checkpoint directory")
+    parser.add_argument("--rollout-dataset-start", type=float, default=0.0, help="fraction of the training after which rollouts are logged to the dataset")
+    parser.add_argument("--resume", nargs="?", const=True, default=None, help="continue the latest run of this experiment (or the given checkpoint directory) from its newest training checkpoint")
 
     opts = parser.parse_args()
+    if opts.autotune_envs and (opts.rgb or multi_seed or distributed):
+        parser.error("--autotune-envs is only available for single-seed object-centric training")
+    if opts.rollout_dataset is not None and multi_seed:
+        parser.error("--rollout-dataset is not available for multi-seed training")
+    if opts.environments is None and not opts.autotune_envs:
+        parser.error("the following arguments are required: -env/--environments")
 
     env_str = "ALE/" + opts.game +"-v5"
     settings_str = ""
@@ -64,12 +91,14 @@ def parse_train():
         settings_str += '_excludeproperties'
         hide_properties = True
 
-    exp_name = opts.game + "_seed" + str(opts.seed) + settings_str
+    seeds = opts.seed if multi_seed else [opts.seed]
+    exp_names = [opts.game + "_seed" + str(seed) + settings_str for seed in seeds]
     if noisy:
-        exp_name += "-noisy"
+        exp_names = [exp_name + "-noisy" for exp_name in exp_names]
 
     return {
-        "exp_name": exp_name,
+        "exp_name": exp_names[0],
+        "exp_names": exp_names,
         "env": env_str,
         "hide_properties": hide_properties,
         "pruned_ff_name": pruned_ff_name,
@@ -83,7 +112,41 @@ def parse_train():
         "reward": opts.reward,
         "progress": opts.progress,
         "hud": opts.hud,
-        "mode": opts.mode
+        "mode": opts.mode,
+        "reset_pool": opts.reset_pool,
+        "ns_log": opts.ns_log,
+        "obs_dtype": opts.obs_dtype,
+        "scobi_norm": opts.scobi_norm,
+        "noisy": noisy,
+        "noise_std": opts.noise_std,
+        "noise_error_rate": opts.noise_error_rate,
+        "focus_rules": opts.focus_rules,
+        "keep_checkpoints": opts.keep_checkpoints,
+        "keep_best_checkpoints": opts.keep_best_checkpoints,
+        "async_eval": opts.async_eval,
+        "resume": opts.resume,
+        "placement": opts.placement,
+        "learner_cores": opts.learner_cores,
+        "autotune_envs": opts.autotune_envs,
+        "rollout_dataset": opts.rollout_dataset,
+        "rollout_dataset_start": opts.rollout_dataset_start,
+        "host": opts.host if distributed else None,
+        "port": opts.port if distributed else None,
+        "actors": opts.actors if distributed else None,
+        "local_actors": opts.local_actors if distributed else None
+    }
+
+
+def parse_actor():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, required=True, help="address of the learner")
+    parser.add_argument("--port", type=int, default=29500, help="port of the learner")
+    parser.add_argument("-env", "--environments", type=int, required=True, help="number of envs stepped by this actor")
+    opts = parser.parse_args()
+    return {
+        "host": opts.host,
+        "port": opts.port,
+        "environments": opts.environments
     }
 
 
@@ -105,7 +168,11 @@ def render_parser():
     parser.add_argument("--nb_frames", type=int, default=0, help="stop recording after nb_frames (or 1 episode if not specified)")
     parser.add_argument("--print-reward", action="store_true", help="display the reward in the console (if not 0)")
     parser.add_argument("--viper", nargs="?", const=True, default=False, help="evaluate the extracted viper tree instead of a checkpoint")
-    parser.add_argument("--hud", action="store_true", help="use HUD objects")
+    parser.add_argument("--hud", action="store_true", default=None, help="use HUD objects, the training run's choice if omitted")
+    parser.add_argument("--obs-dtype", type=str, default=None, choices=["float32", "float16", "int16"], help="observation dtype, the training run's if omitted")
+    parser.add_argument("--focus-rules", nargs="?", const=True, default=None, help="generate the default focus file with relation rules (packaged rules, or a path to a rules yaml), the training run's choice if omitted")
+    parser.add_argument("--noise-std", type=float, default=None, help="std of the position jitter in noisy mode, the training run's if omitted")
+    parser.add_argument("--noise-error-rate", type=float, default=None, help="detection error rate in noisy mode, the training run's if omitted")
     opts = parser.parse_args()
 
     env_str = "ALE/" + opts.game +"-v5"
@@ -159,7 +226,11 @@ def render_parser():
         "nb_frames": opts.nb_frames,
         "print_reward": opts.print_reward,
         "viper": opts.viper,
-        "hud": opts.hud
+        "hud": opts.hud,
+        "obs_dtype": opts.obs_dtype,
+        "focus_rules": opts.focus_rules,
+        "noise_std": opts.noise_std,
+        "noise_error_rate": opts.noise_error_rate
     }
 
 
@@ -179,7 +250,11 @@ def parse_eval(parser):
     parser.add_argument("--progress", action="store_true", help="display a progress bar of the training process")
     parser.add_argument("--rgb", required= False, action="store_true", help="rgb observation space")
     parser.add_argument("--viper", nargs="?", const=True, default=False, help="evaluate the extracted viper tree instead of a checkpoint")
-    parser.add_argument("--hud", action="store_true", help="use HUD objects")
+    parser.add_argument("--hud", action="store_true", default=None, help="use HUD objects, the training run's choice if omitted")
+    parser.add_argument("--obs-dtype", type=str, default=None, choices=["float32", "float16", "int16"], help="observation dtype, the training run's if omitted")
+    parser.add_argument("--focus-rules", nargs="?", const=True, default=None, help="generate the default focus file with relation rules (packaged rules, or a path to a rules yaml), the training run's choice if omitted")
+    parser.add_argument("--noise-std", type=float, default=None, help="std of the position jitter in noisy mode, the training run's if omitted")
+    parser.add_argument("--noise-error-rate", type=float, default=None, help="detection error rate in noisy mode, the training run's if omitted")
     opts = parser.parse_args()
 
     env_str = "ALE/" + opts.game +"-v5"
@@ -232,7 +307,11 @@ def parse_eval(parser):
         "progress": opts.progress,
         "rgb": opts.rgb,
         "viper": opts.viper,
-        "hud": opts.hud
+        "hud": opts.hud,
+        "obs_dtype": opts.obs_dtype,
+        "focus_rules": opts.focus_rules,
+        "noise_std": opts.noise_std,
+        "noise_error_rate": opts.noise_error_rate
     }
 
 
@@ -0,0 +1,112 @@
+"""
+CPU placement for training runs (Linux): the learner gets its own cores, every env worker is pinned
+to one core and runs with a single torch/BLAS thread, so torch intra-op threads of the learner and
+the env workers do not compete for the same cores.
+"""
+import os
+import sys
+from pathlib import Path
+
+try:
+    from threadpoolctl import threadpool_limits
+    _threadpoolctl_imported = True
+except ImportError as imp_err:
+    _threadpoolctl_imported = False
+
+CPU_DIR = Path("/sys/devices/system/cpu")
+
+
+def placement_supported():
+    return hasattr(os, "sched_setaffinity")
+
+
+def _read_int(fpath, default):
+    try:
+        return int(fpath.read_text().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def cpu_topology():
+    """
+    usable cpus of this process as dicts (cpu, core, package, node), ordered so that the first
+    hardware thread of every physical core comes before the SMT siblings, grouped by numa node
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if placement_supported() else list(range(os.cpu_count()))
+    topology = []
+    for cpu in cpus:
+        cpu_dir = CPU_DIR / f"cpu{cpu}"
+        nodes = [int(p.name[4:]) for p in cpu_dir.glob("node[0-9]*")]
+        topology.append({"cpu": cpu,
+                         "core": _read_int(cpu_dir / "topology" / "core_id", cpu),
+                         "package": _read_int(cpu_dir / "topology" / "physical_package_id", 0),
+                         "node": nodes[0] if nodes else 0})
+    seen = {}
+    for t in topology:
+        key = (t["package"], t["core"])
+        t["sibling"] = seen.get(key, 0)
+        seen[key] = t["sibling"] + 1
+    return sorted(topology, key=lambda t: (t["sibling"], t["node"], t["package"], t["core"], t["cpu"]))
+
+
+def plan_placement(n_train_workers, n_eval_workers, learner_cores=1):
+    """
+    {"learner": [cpus], "train": [cpu per worker], "eval": [cpu per worker], "oversubscribed": bool}.
+    the learner takes the first cores, workers one core each. with more workers than cores the
+    workers share the remaining cores round robin
+    """
+    cpus = [t["cpu"] for t in cpu_topology()]
+    learner_cores = max(1, min(learner_cores, len(cpus) - 1)) if len(cpus) > 1 else 1
+    learner = cpus[:learner_cores]
+    worker_cpus = cpus[learner_cores:] or cpus
+    n_workers = n_train_workers + n_eval_workers
+    workers = [worker_cpus[i % len(worker_cpus)] for i in range(n_workers)]
+    return {"learner": learner, "train": workers[:n_train_workers], "eval": workers[n_train_workers:],
+            "oversubscribed": n_workers > len(worker_cpus)}
+
+
+def format_layout(plan):
+    lines = [f"CPU placement ({len(cpu_topology())} usable cpus)",
+             f"  learner: cpus {','.join(map(str, plan['learner']))} ({len(plan['learner'])} torch threads)"]
+    for name in ["train", "eval"]:
+        if plan[name]:
+            lines.append(f"  {name} workers: " + " ".join(f"{i}->{cpu}" for i, cpu in enumerate(plan[name])))
+    if plan["oversubscribed"]:
+        lines.append("  more workers than free cpus, workers share cores")
+    return "\n".join(lines)
+
+
+def limit_threads(n_threads=1):
+    # OpenMP/BLAS pools created from now on, torch (if loaded) and BLAS pools already loaded
+    for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[var] = str(n_threads)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(n_threads)
+    if _threadpoolctl_imported:
+        threadpool_limits(n_threads)
+
+
+def pin_current_process(cpus, n_threads=1):
+    if placement_supported():
+        os.sched_setaffinity(0, set(cpus))
+    limit_threads(n_threads)
+
+
+def pinned(fn, cpus):
+    """wraps an env (or vec env) factory, the process that calls it is pinned to cpus first"""
+    def _init():
+        pin_current_process(cpus)
+        return fn()
+    return _init
+
+
+def pin_processes(pids, cpus):
+    """pins already running processes from outside, for workers whose factory cannot be wrapped"""
+    if placement_supported():
+        for pid, cpu in zip(pids, cpus):
+            os.sched_setaffinity(pid, {cpu})
+
+
+def pin_learner(cpus):
+    # the learner uses one torch thread per reserved core
+    pin_current_process(cpus, n_threads=len(cpus))
@@ -14,6 +14,8 @@ except ImportError as imp_err:
 
 from pathlib import Path
 
+from scobi import Environment
+
 
 class Renderer:
     window: pygame.Surface
@@ -26,13 +28,12 @@ class Renderer:
         self.envs = envs
         if hasattr(envs, 'venv') and hasattr(envs.venv, 'envs'):
             self.env = envs.venv.envs[0]
-            self.rgb_agent = False
         elif hasattr(envs, 'envs'):
             self.env = envs.envs[0]  # Handles cases where envs are in a DummyVecEnv or similar
-            self.rgb_agent = True
         else:
             self.env = envs
-            self.rgb_agent = True
+        # scobi envs normalizing on their own are not wrapped in VecNormalize
+        self.rgb_agent = not isinstance(self.env, Environment)
         self.model = model
         self.current_frame = self._get_current_frame()
         self._init_pygame(self.current_frame)
@@ -0,0 +1,159 @@
+"""
+Rollout datasets: observations, actions, action log-probs and values of the PPO rollouts, streamed into
+memory-mapped .npy files during training. The files form a ring buffer of fixed capacity, so a dataset
+holds the newest samples of the run. viper_extract.py --dataset and other tools read them without
+running the emulator again. Observations are stored un-normalized, normalize_obs() gives them the
+normalization of the agent that uses them.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+
+from scobi.focus import NORM_CLIP, NORM_EPSILON
+from scobi.utils.running_stats import RunningStats
+
+META_FILE = "meta.json"
+
+
+class RolloutDataset():
+    """
+    <path>/obs.npy, actions.npy, log_probs.npy, values.npy and meta.json. Samples are written in
+    rollout order (step major, envs of a step next to each other), "next" is the row the next sample
+    goes to, "size" the number of valid rows.
+    """
+    def __init__(self, path, capacity=None, obs_shape=None, obs_dtype=np.float32):
+        self.path = Path(path)
+        meta_file = self.path / META_FILE
+        if meta_file.exists():
+            self.meta = json.loads(meta_file.read_text())
+            mode = "r+" if capacity is not None else "r"
+            if capacity is not None and (self.meta["capacity"] != capacity or tuple(self.meta["obs_shape"]) != tuple(obs_shape)):
+                raise ValueError(f"rollout dataset {self.path} has capacity {self.meta['capacity']} and observation shape {tuple(self.meta['obs_shape'])}")
+            self.arrays = {name: np.load(self.path / f"{name}.npy", mmap_mode=mode) for name in self.fields()}
+        elif capacity is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.meta = {"capacity": int(capacity), "obs_shape": list(obs_shape), "obs_dtype": np.dtype(obs_dtype).name,
+                         "size": 0, "next": 0, "timesteps": 0}
+            shapes = {"obs": ((capacity, *obs_shape), obs_dtype), "actions": ((capacity,), np.int64),
+                      "log_probs": ((capacity,), np.float32), "values": ((capacity,), np.float32)}
+            # .npy headers, so the files also open with np.load(mmap_mode="r")
+            self.arrays = {name: np.lib.format.open_memmap(self.path / f"{name}.npy", mode="w+", dtype=dtype, shape=shape)
+                           for name, (shape, dtype) in shapes.items()}
+            self._write_meta()
+        else:
+            raise FileNotFoundError(f"no rollout dataset in {self.path}")
+
+    @staticmethod
+    def fields():
+        return ["obs", "actions", "log_probs", "values"]
+
+    def __len__(self):
+        return self.meta["size"]
+
+    def _write_meta(self):
+        # readers never see a half written meta file
+        tmp = self.path / (META_FILE + ".tmp")
+        tmp.write_text(json.dumps(self.meta))
+        os.replace(tmp, self.path / META_FILE)
+
+    def append(self, timesteps, **samples):
+        """samples: one array per field with the same number of rows, older rows are overwritten when full"""
+        capacity = self.meta["capacity"]
+        n = len(samples["obs"])
+        # only the newest capacity rows of a batch larger than the buffer are kept
+        skip = max(n - capacity, 0)
+        rows = (self.meta["next"] + skip + np.arange(n - skip)) % capacity
+        for name in self.fields():
+            self.arrays[name][rows] = samples[name][skip:]
+        for name in self.fields():
+            self.arrays[name].flush()
+        self.meta["next"] = int((self.meta["next"] + n) % capacity)
+        self.meta["size"] = int(min(self.meta["size"] + n, capacity))
+        self.meta["timesteps"] = int(timesteps)
+        self._write_meta()
+
+    def load(self, n_samples=None):
+        """fields as arrays in write order (oldest first), the newest n_samples if given"""
+        size, capacity, next_row = self.meta["size"], self.meta["capacity"], self.meta["next"]
+        n_samples = size if n_samples is None else min(n_samples, size)
+        first = (next_row - n_samples) % capacity
+        if first + n_samples <= capacity:
+            # no wrap around, views into the memmaps
+            return {name: self.arrays[name][first:first + n_samples] for name in self.fields()}
+        rows = (first + np.arange(n_samples)) % capacity
+        return {name: self.arrays[name][rows] for name in self.fields()}
+
+
+def normalize_obs(obs, vec_normalize=None, scobi_stats=None):
+    """un-normalized observations as a policy trained with VecNormalize or scobi normalization (stats) sees them"""
+    if vec_normalize is not None:
+        return vec_normalize.normalize_obs(obs)
+    if scobi_stats is not None:
+        # the normalization of scobi.focus
+        return np.clip((obs - scobi_stats.mean) / np.sqrt(scobi_stats.var + NORM_EPSILON), -NORM_CLIP, NORM_CLIP).astype(np.float32)
+    return obs
+
+
+def unnormalize_obs(obs, vec_normalize=None, scobi_stats=None):
+    """inverse of normalize_obs, exact up to the clipped values"""
+    if vec_normalize is not None:
+        return vec_normalize.unnormalize_obs(obs)
+    if scobi_stats is not None:
+        return (obs * np.sqrt(scobi_stats.var + NORM_EPSILON) + scobi_stats.mean).astype(np.float32)
+    return obs
+
+
+class RolloutDatasetCallback(BaseCallback):
+    """
+    Appends every PPO rollout (from start_timesteps on) to a RolloutDataset. Observations are stored
+    un-normalized, actions are the sampled ones. With scobi_norm the envs normalize with the stats
+    shared before the rollout (the first observation, returned by the last step of the previous
+    rollout, with the stats before), which are undone exactly up to clipped values. VecNormalize
+    updates its stats during the rollout, its observations are un-normalized with the stats at the
+    rollout end.
+    """
+    def __init__(self, save_path, capacity, start_timesteps=0, scobi_norm=False, verbose=0):
+        super().__init__(verbose)
+        self.save_path = save_path
+        self.capacity = capacity
+        self.start_timesteps = start_timesteps
+        self.scobi_norm = scobi_norm
+        self.scobi_stats = None
+        self.first_obs_scobi_stats = None
+        self.dataset = None
+
+    def _init_callback(self) -> None:
+        obs_shape = self.model.rollout_buffer.obs_shape
+        self.dataset = RolloutDataset(self.save_path, self.capacity, obs_shape, self.model.rollout_buffer.observations.dtype)
+
+    def _on_rollout_start(self) -> None:
+        if self.scobi_norm:
+            # envs without shared stats yet normalize with the initial ones
+            stats = self.training_env.env_method("get_normalization_stats", indices=[0])[0]
+            stats = stats.copy() if stats is not None else RunningStats(self.model.rollout_buffer.obs_shape)
+            self.first_obs_scobi_stats = self.scobi_stats if self.scobi_stats is not None else stats
+            self.scobi_stats = stats
+
+    def _on_rollout_end(self) -> None:
+        # the model's timesteps, num_timesteps of the callback is only updated with on_step, which
+        # the loop of utils.distributed calls after the rollout end
+        timesteps = self.model.num_timesteps
+        if timesteps < self.start_timesteps:
+            return
+        buffer = self.model.rollout_buffer
+        n_samples = buffer.buffer_size * buffer.n_envs
+        obs = unnormalize_obs(buffer.observations.reshape(n_samples, *buffer.obs_shape),
+                              self.model.get_vec_normalize_env(), self.scobi_stats)
+        if self.scobi_norm:
+            obs[:buffer.n_envs] = unnormalize_obs(buffer.observations[0], scobi_stats=self.first_obs_scobi_stats)
+        self.dataset.append(timesteps,
+                            obs=obs,
+                            actions=buffer.actions.reshape(n_samples),
+                            log_probs=buffer.log_probs.reshape(n_samples),
+                            values=buffer.values.reshape(n_samples))
+
+    def _on_step(self) -> bool:
+        return True
@@ -0,0 +1,216 @@
+"""
+Local job scheduler for train, eval and viper runs. Jobs are packed onto a core budget by their core
+footprint, so a box stays busy without oversubscription. The queue is a json file, a restarted
+scheduler picks up where it stopped, and each job writes its output to its own log file and its exit
+status next to it.
+"""
+import json
+import os
+import subprocess
+import time
+from pathlib import Path
+
+N_EVAL_ENVS = 4 # eval envs of train.py
+PENDING, RUNNING, DONE, FAILED, SKIPPED = "pending", "running", "done", "failed", "skipped"
+# runs a job and writes its exit status to $1 when it ends, also if no scheduler is running anymore
+EXIT_STATUS_WRAPPER = 'f="$1"; shift; "$@"; s=$?; echo $s > "$f.tmp" && mv "$f.tmp" "$f"; exit $s'
+
+
+def _flag_value(command, flags, default=None):
+    for i, c in enumerate(command[:-1]):
+        if c in flags:
+            return command[i + 1]
+    return default
+
+
+def job_cores(command):
+    """
+    cores a job keeps busy: train.py runs one process per training env plus the eval envs (a single
+    eval process with --async-eval) and, with --placement, the cores reserved for the learner.
+    eval.py and viper_extract.py run in a single process
+    """
+    script = next((Path(c).name for c in command if c.endswith(".py")), None)
+    if script == "train.py":
+        # --autotune-envs without -env tries up to all cores
+        n_envs = int(_flag_value(command, ["-env", "--environments"], os.cpu_count() if "--autotune-envs" in command else 1))
+        learner_cores = int(_flag_value(command, ["--learner-cores"], 1)) if "--placement" in command else 0
+        return n_envs + (1 if "--async-eval" in command else N_EVAL_ENVS) + learner_cores
+    return 1
+
+
+def _process_start_time(pid):
+    """start time of a process in clock ticks after boot, None if it is gone (or a zombie) or unknown"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # the command name may contain spaces, the fields after it do not
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    if fields[0] == "Z":
+        return None
+    return int(fields[19])
+
+
+def _pid_alive(pid, start_time=None):
+    """
+    start_time is the _process_start_time of the job, so a new process that got the pid of a finished
+    job is not taken for it. Without /proc only the pid is checked
+    """
+    if os.path.exists("/proc/self/stat"):
+        current = _process_start_time(pid)
+        return current is not None and (start_time is None or current == start_time)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _exit_file(job):
+    return Path(job["log"]).with_suffix(".exit")
+
+
+def _read_exit_status(job):
+    try:
+        return int(_exit_file(job).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+class Scheduler():
+    """
+    queue_dir holds queue.json and logs/<job id>.log. cores is the budget (default: all cores).
+    A job starts as soon as its dependencies (after) are done and its cores fit into the free
+    budget, jobs larger than the budget run alone. Jobs get one thread per library (OMP_NUM_THREADS=1),
+    the envs already use every core they are given.
+
+    On restart, jobs a previous scheduler started are adopted if still alive (same pid and process start
+    time). Each job writes its exit status to logs/<job id>.exit, adopted jobs and jobs that ended while
+    no scheduler was running are done or failed by it. Interrupted jobs (no exit status) and retried jobs
+    are queued again, train jobs with --resume, so they continue from their newest checkpoint.
+    """
+    def __init__(self, queue_dir="resources/scheduler", cores=None, poll_interval=5):
+        self.queue_dir = Path(queue_dir)
+        self.queue_file = self.queue_dir / "queue.json"
+        self.log_dir = self.queue_dir / "logs"
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.cores = cores or os.cpu_count()
+        self.poll_interval = poll_interval
+        self.processes = {} # job id -> Popen of the jobs started by this scheduler
+        self.jobs = []
+        if self.queue_file.exists():
+            with open(self.queue_file, "r") as f:
+                self.jobs = json.load(f)
+        self._recover()
+
+    def _save(self):
+        tmp_file = self.queue_file.with_suffix(".json.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.jobs, f, indent=2)
+        os.replace(tmp_file, self.queue_file)
+
+    def _requeue(self, job):
+        job["status"], job["pid"], job["pid_start"], job["returncode"] = PENDING, None, None, None
+        script = next((Path(c).name for c in job["command"] if c.endswith(".py")), None)
+        if script == "train.py" and "--resume" not in job["command"]:
+            job["command"].append("--resume")
+
+    def _recover(self):
+        for job in self.jobs:
+            if (job["status"] == RUNNING and not _pid_alive(job["pid"], job.get("pid_start"))
+                    and _read_exit_status(job) is None):
+                self._requeue(job)
+        self._save()
+
+    def add(self, job_id, command, after=(), cores=None):
+        """queues a job, unless a job with this id is already known. returns the job"""
+        for job in self.jobs:
+            if job["id"] == job_id:
+                return job
+        job = {"id": job_id, "command": list(command), "cores": min(cores or job_cores(command), self.cores),
+               "after": list(after), "status": PENDING, "pid": None, "pid_start": None, "returncode": None,
+               "log": str(self.log_dir / f"{job_id}.log"), "started": None, "finished": None}
+        self.jobs.append(job)
+        self._save()
+        return job
+
+    def retry(self):
+        """queues failed and skipped jobs again"""
+        for job in self.jobs:
+            if job["status"] in (FAILED, SKIPPED):
+                self._requeue(job)
+        self._save()
+
+    def used_cores(self):
+        return sum(job["cores"] for job in self.jobs if job["status"] == RUNNING)
+
+    def _ready(self, job):
+        status = {j["id"]: j["status"] for j in self.jobs}
+        return all(status.get(d) == DONE for d in job["after"])
+
+    def _blocked(self, job):
+        status = {j["id"]: j["status"] for j in self.jobs}
+        return any(status.get(d) in (FAILED, SKIPPED) for d in job["after"])
+
+    def _start(self, job):
+        env = os.environ.copy()
+        for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+            env.setdefault(var, "1")
+        _exit_file(job).unlink(missing_ok=True)
+        with open(job["log"], "a") as log:
+            log.write(f"$ {' '.join(job['command'])}\n")
+            log.flush()
+            # new session, so stopping the scheduler does not stop its jobs
+            process = subprocess.Popen(["sh", "-c", EXIT_STATUS_WRAPPER, "sh", str(_exit_file(job)), *job["command"]],
+                                       stdout=log, stderr=subprocess.STDOUT, env=env, start_new_session=True)
+        self.processes[job["id"]] = process
+        job["status"], job["pid"], job["started"] = RUNNING, process.pid, time.time()
+        job["pid_start"] = _process_start_time(process.pid)
+        print(f"started {job['id']} ({job['cores']} cores, {self.used_cores()}/{self.cores} in use)")
+
+    def _poll(self):
+        for job in self.jobs:
+            if job["status"] != RUNNING:
+                continue
+            process = self.processes.get(job["id"])
+            if process is not None:
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+            elif _pid_alive(job["pid"], job.get("pid_start")):
+                continue
+            else:
+                # adopted job, killed before it could write its exit status if there is none
+                returncode = _read_exit_status(job)
+            job["status"] = DONE if returncode == 0 else FAILED
+            job["returncode"], job["finished"] = returncode, time.time()
+            self.processes.pop(job["id"], None)
+            print(f"{job['status']} {job['id']} (log: {job['log']})")
+
+    def step(self):
+        """one scheduling round, returns False once no job is running or startable anymore"""
+        self._poll()
+        for job in self.jobs:
+            if job["status"] == PENDING and self._blocked(job):
+                job["status"] = SKIPPED
+                print(f"skipped {job['id']}, a dependency did not finish")
+        for job in self.jobs:
+            if job["status"] != PENDING or not self._ready(job):
+                continue
+            used = self.used_cores()
+            if used == 0 or used + job["cores"] <= self.cores:
+                self._start(job)
+        self._save()
+        return any(job["status"] == RUNNING for job in self.jobs) or any(
+            job["status"] == PENDING and self._ready(job) for job in self.jobs)
+
+    def run(self):
+        while self.step():
+            time.sleep(self.poll_interval)
+
+    def status(self):
+        for job in self.jobs:
+            returncode = "" if job["returncode"] is None else f" (exit {job['returncode']})"
+            print(f"{job['id']:40s} {job['status']:8s} {job['cores']:3d} cores{returncode}  {' '.join(job['command'])}")
@@ -31,13 +31,19 @@ class LogProbQ:
 
 
 class DecisionTreeExtractor: #Dagger
-    def __init__(self, model: PPO, dtpolicy: DecisionTreeClassifier, env: Env, data_per_iter: int=30_000):
+    def __init__(self, model: PPO, dtpolicy: DecisionTreeClassifier, env: Env, data_per_iter: int=30_000, data_dtype=np.float32, initial_data=None):
         self.model = model
+        self.initial_data = initial_data # (states, actions) for the first iteration, e.g. from a rollout dataset
+        self.data_dtype = data_dtype # storage dtype of the collected states, sklearn trees use float32 internally
         self.env = env # is vectorized
         self.data_per_iter = data_per_iter
         self.dt = dtpolicy
 
     def collect_data(self):
+        if self.initial_data is not None:
+            S, A = self.initial_data
+            self.initial_data = None
+            return np.asarray(S, dtype=self.data_dtype), np.asarray(A)
         S, A = [], []
         s = self.env.reset()
         for i in tqdm(range(self.data_per_iter)):
@@ -47,7 +53,7 @@ class DecisionTreeExtractor: #Dagger
             s, _, done, _ = self.env.step(action)
             if done:
                 s = self.env.reset()
-        return np.array(S), np.array(A)
+        return np.array(S, dtype=self.data_dtype), np.array(A)
 
     def collect_data_dt(self,):
         S = []
@@ -65,7 +71,7 @@ class DecisionTreeExtractor: #Dagger
                 ep_reward = 0
         if len(episodes) < 1:
             episodes.append(ep_reward)
-        return S, np.mean(episodes)
+        return np.array(S, dtype=self.data_dtype), np.mean(episodes)
 
     def fit_DT(self, S, A):
         ## sampling
@@ -115,8 +121,8 @@ class DecisionTreeExtractor: #Dagger
 
 
 class VIPER(DecisionTreeExtractor):
-    def __init__(self, model: PPO, dtpolicy: DecisionTreeClassifier, env: Env, rtpt, data_per_iter: int=30_000):
-        super().__init__(model, dtpolicy, env, data_per_iter)
+    def __init__(self, model: PPO, dtpolicy: DecisionTreeClassifier, env: Env, rtpt, data_per_iter: int=30_000, data_dtype=np.float32, initial_data=None):
+        super().__init__(model, dtpolicy, env, data_per_iter, data_dtype, initial_data)
         self.Q = LogProbQ(self.model, self.env)
         self.rtpt = rtpt
 
@@ -9,9 +9,12 @@ from stable_baselines3 import PPO
 from stable_baselines3.common.vec_env import VecNormalize, DummyVecEnv
 
 from scobi import Environment
+from utils.checkpointing import load_env_config
+from utils.rollout_dataset import RolloutDataset, normalize_obs
 from utils.viper import VIPER
 
 EVAL_ENV_SEED = 84
+VIPER_DATA_PER_ITER = 30_000
 
 class SB3Model():
     def __init__(self, model) -> None:
@@ -35,7 +38,7 @@ def flist(l):
     return ["%.2f" % e for e in l]
 
 
-def eval_agent(model, env, episodes, obs_save_file=None, acts_save_file=None):
+def eval_agent(model, env, episodes, obs_save_file=None, acts_save_file=None, obs_dtype=np.float32):
     current_episode = 0
     rewards = []
     steps = []
@@ -65,7 +68,7 @@ def eval_agent(model, env, episodes, obs_save_file=None, acts_save_file=None):
             print(f"rewards: {flist(rewards)} | mean: {np.mean(rewards):.2f} \nsteps: {flist(steps)} | mean: {np.mean(steps):.2f}")
             if obs_save_file:
                 obs_save_file.unlink(missing_ok=True)
-                np.save(obs_save_file, obs_out_array)
+                np.save(obs_save_file, np.array(obs_out_array, dtype=obs_dtype))
                 acts_save_file.unlink(missing_ok=True)
                 np.save(acts_save_file, acts_out_array)
                 print(">>> Observations & Actions saved!")
@@ -79,6 +82,11 @@ def main():
     parser.add_argument("-r", "--rule_extraction", type=str, required=True, choices=["viper"], default="viper", help="rule extraction to use.")
     parser.add_argument("-e", "--episodes", type=int, required=False, help="number of episodes to evaluate agents samples on")
     parser.add_argument("-n", "--name", type=str, required=False, help="experiment name")
+    parser.add_argument("--focus-rules", nargs="?", const=True, default=None, help="the agent was trained with a rule-generated default focus file (packaged rules, or a path to a rules yaml), the training run's choice if omitted")
+    parser.add_argument("--dataset", nargs="?", const=True, default=None, help="use the rollout dataset of the training run (train.py --rollout-dataset) instead of collecting samples with the agent, optionally its path")
+    parser.add_argument("--obs-dtype", type=str, default=None, choices=["float32", "float16", "int16"], help="observation dtype the agent was trained with (the training run's if omitted), reduced precision modes also store the datasets as float16")
+    parser.add_argument("--noise-std", type=float, default=None, help="std of the position jitter in noisy mode, the training run's if omitted")
+    parser.add_argument("--noise-error-rate", type=float, default=None, help="detection error rate in noisy mode, the training run's if omitted")
     opts = parser.parse_args()
 
     # Default values
@@ -128,13 +136,18 @@ def main():
 
     checkpoint_str = "best_model"
     vecnorm_str = "best_vecnormalize.pkl"
+    scobi_norm_str = "best_scobi_normalization.npz"
     if path_entered:
+        checkpoint_dir = Path(opts.input)
         model_path = Path(opts.input, checkpoint_str)
         vecnorm_path = Path(opts.input, vecnorm_str)
+        scobi_norm_path = Path(opts.input, scobi_norm_str)
         focus_dir = Path(opts.input)
     else:
+        checkpoint_dir = Path("resources/checkpoints", checkpoint_name)
         model_path = Path("resources/checkpoints", checkpoint_name, checkpoint_str)
         vecnorm_path = Path("resources/checkpoints",  checkpoint_name, vecnorm_str)
+        scobi_norm_path = Path("resources/checkpoints",  checkpoint_name, scobi_norm_str)
     print("Looking for focus file in " + str(focus_dir))
     print("Looking for model in " + str(model_path))
     output_path = Path("resources/viper_extracts/extract_output", checkpoint_name + "-" + expname)
@@ -143,21 +156,49 @@ def main():
     obs_outfile = output_path / "obs.npy"
     acts_outfile = output_path / "acts.npy"
 
+    # observation settings of the training run, flags override them
+    env_config = load_env_config(checkpoint_dir, {"obs_dtype": opts.obs_dtype, "focus_rules": opts.focus_rules,
+                                                  "noise_std": opts.noise_std, "noise_error_rate": opts.noise_error_rate})
     env = Environment(env_str,
                       focus_dir=focus_dir,
-                      focus_file=pruned_ff_name)
+                      focus_file=pruned_ff_name,
+                      normalization_stats=scobi_norm_path if scobi_norm_path.exists() else None,
+                      **env_config)
+    # datasets hold VecNormalize outputs, which are not integral, so int16 envs store them as float16 as well
+    data_dtype = np.float32 if env_config["obs_dtype"] == "float32" else np.float16
     _, _ = env.reset(seed=EVAL_ENV_SEED)
 
 
     # Original SB3 Model Eval and Trainset Generation
     model = PPO.load(model_path, device="cuda:0")
     sb3_model_wrapped = SB3Model(model=model)
-    dummy_vecenv = DummyVecEnv([lambda :  env])
-    vec_env = VecNormalize.load(vecnorm_path, dummy_vecenv)
+    vec_env = DummyVecEnv([lambda :  env])
+    if not scobi_norm_path.exists(): # trained with VecNormalize
+        vec_env = VecNormalize.load(vecnorm_path, vec_env)
+        vec_env.training = False
+        vec_env.norm_reward = False
     vec_env.seed = EVAL_ENV_SEED
-    vec_env.training = False
-    vec_env.norm_reward = False
-    eval_agent(sb3_model_wrapped, vec_env, episodes=episodes, obs_save_file=obs_outfile, acts_save_file=acts_outfile)
+    initial_data = None
+    if opts.dataset:
+        # the newest training rollouts, labeled with the greedy actions of the final agent, replace the agent runs.
+        # they are stored un-normalized and get the normalization the agent is evaluated with
+        dataset_path = checkpoint_dir / "rollout_dataset" if opts.dataset is True else Path(opts.dataset)
+        dataset = RolloutDataset(dataset_path)
+        raw_observations = np.asarray(dataset.load(VIPER_DATA_PER_ITER)["obs"], dtype=np.float32)
+        if scobi_norm_path.exists():
+            train_observations = normalize_obs(raw_observations, scobi_stats=env.get_normalization_stats())
+        else:
+            train_observations = normalize_obs(raw_observations, vec_normalize=vec_env)
+        train_observations = np.asarray(train_observations, dtype=data_dtype)
+        train_actions = model.predict(train_observations, deterministic=True)[0]
+        print(f">>> {len(train_observations)} samples of the rollout dataset {dataset_path} ({dataset.meta['timesteps']} training steps)")
+        obs_outfile.unlink(missing_ok=True)
+        np.save(obs_outfile, train_observations)
+        acts_outfile.unlink(missing_ok=True)
+        np.save(acts_outfile, train_actions)
+        initial_data = (train_observations, train_actions)
+    else:
+        eval_agent(sb3_model_wrapped, vec_env, episodes=episodes, obs_save_file=obs_outfile, acts_save_file=acts_outfile, obs_dtype=data_dtype)
 
 
     if rule_extract == "viper":
@@ -169,7 +210,7 @@ def main():
         train_observations = np.load(obs_outfile)
         train_actions = np.load(acts_outfile)
         clf = DecisionTreeClassifier(max_depth=MAX_DEPTH)
-        vip = VIPER(model, clf, vec_env, rtpt)
+        vip = VIPER(model, clf, vec_env, rtpt, data_per_iter=VIPER_DATA_PER_ITER, data_dtype=data_dtype, initial_data=initial_data)
         vip.imitate(nb_iter=NB_ITER)
         vip.save_best_tree(output_path)
         best_viper = sorted(output_path.glob("*_best.viper"))